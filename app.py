@@ -1,25 +1,46 @@
 import os
-import tempfile
+import uuid
 import logging
+from contextlib import asynccontextmanager
 from typing import List
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, Response, Query
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from starlette.requests import Request
+from starlette.formparsers import MultiPartParser
+from starlette.concurrency import run_in_threadpool
 
-from utils.document_processor import process_document
-from utils.vector_store import VectorStore
-from utils.openai_utils import get_answer_from_chunks
+from utils.startup import STARTUP_PRELOAD_NAMESPACES, startup
+from utils.document_processor import iter_document_chunks
+from utils.namespaces import NamespaceManager, TENANT_HEADER
+from utils.openai_utils import aget_answer_from_chunks, astream_answer_from_chunks, get_async_client, get_context_packer
+from utils.streaming import SSE_HEADERS, aanswer_events
+from utils.ingestion_jobs import IngestionJobs, QueueFullError, index_chunks
+from utils.digests import DigestStore, response_fields
+from utils.answer_cache import SemanticAnswerCache
+from utils.batch_answers import aanswer_questions, batch_deadline, parse_questions
+from utils.uploads import LimitUploadSize, UPLOAD_MAX_BYTES, UPLOAD_SPOOL_BYTES
+from utils.metrics import PROMETHEUS_CONTENT_TYPE, ServerTimingMiddleware, metrics
+from utils.resilience import DeadlineMiddleware, set_deadline
+from utils.request_limiter import RequestLimiter
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+startup.mark("imports")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Started here unless a gunicorn hook already did; threads do not survive a fork
+    startup.start_services()
+    yield
+
 # Initialize FastAPI app
-app = FastAPI(title="Document Q&A Chatbot")
+app = FastAPI(title="Document Q&A Chatbot", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -30,6 +51,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized uploads before their body is buffered
+app.add_middleware(LimitUploadSize, max_bytes=UPLOAD_MAX_BYTES)
+
+# OpenAI calls made for a request share its time budget
+app.add_middleware(DeadlineMiddleware)
+
+# Outermost, so the recorded latency covers the other middleware too
+app.add_middleware(ServerTimingMiddleware)
+
+# UploadFile keeps uploads in memory up to this size before spilling to disk
+MultiPartParser.spool_max_size = UPLOAD_SPOOL_BYTES
+
 # Ensure the app is correctly exposed for Gunicorn WSGI
 from starlette.middleware.wsgi import WSGIMiddleware
 
@@ -39,12 +72,47 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Setup Jinja2 templates
 templates = Jinja2Templates(directory="templates")
 
-# Initialize vector store
-vector_store = VectorStore()
+# Vector stores, one per session or tenant
+namespaces = NamespaceManager()
+
+NAMESPACE_COOKIE = "namespace"
+
+# Summaries and suggested questions, generated once per document in the background
+digests = DigestStore()
+
+# Background ingestion for uploads submitted with ?async=1
+ingestion_jobs = IngestionJobs(get_store=namespaces.get, digests=digests)
+startup.add_service(ingestion_jobs.start)
+
+# Answers reused for near-identical questions over the same context
+answer_cache = SemanticAnswerCache()
+
+# Stage latencies and counters, added up across workers for /metrics
+metrics.add_collector(namespaces.gauges)
+startup.add_service(metrics.start)
+
+# Loaded in the background after startup rather than by the first request that needs them
+startup.add_imports("langchain.text_splitter", "PyPDF2", "utils.vector_store")
+startup.add_step("openai_client", get_async_client)
+startup.add_step("tokenizer", get_context_packer)
+startup.add_step("namespaces", lambda: [namespaces.get(name) for name in STARTUP_PRELOAD_NAMESPACES])
+startup.mark("create_app")
+startup.warm_up()
+
+def current_namespace(request: Request, response: Response) -> str:
+    """Namespace for this request: the tenant header if configured, else a session cookie."""
+    if TENANT_HEADER and request.headers.get(TENANT_HEADER):
+        return f"tenant-{request.headers[TENANT_HEADER]}"
+    session_id = request.cookies.get(NAMESPACE_COOKIE)
+    if not session_id:
+        session_id = uuid.uuid4().hex
+        response.set_cookie(NAMESPACE_COOKIE, session_id, httponly=True, samesite="lax")
+    return f"session-{session_id}"
 
 # Pydantic models
 class QuestionRequest(BaseModel):
     question: str
+    stream: bool = False
 
 class AnswerResponse(BaseModel):
     answer: str
@@ -55,55 +123,79 @@ async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(
+    response: Response,
+    file: UploadFile = File(...),
+    namespace: str = Depends(current_namespace),
+    run_async: bool = Query(False, alias="async"),
+):
     logger.info(f"Received file: {file.filename}")
+    # Chunks, digests and DELETE /documents?source= all key on the bare file name
+    filename = os.path.basename(file.filename)
     
     # Check file type
-    if file.filename.endswith(('.txt', '.pdf')):
-        # Create a temporary file to store the uploaded content
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            try:
-                # Write the file content to the temp file
-                content = await file.read()
-                temp_file.write(content)
-                temp_file.flush()
-                
-                # Process the document and store embeddings
-                chunks = process_document(temp_file.name, file.filename)
-                vector_store.add_documents(chunks)
-                
-                # Generate sample questions based on content
-                sample_questions = [
-                    "What is the main topic of this document?",
-                    "Can you summarize this document?",
-                    "What are the key points from this document?"
-                ]
-                
-                return {
-                    "status": "success", 
-                    "message": f"Successfully processed {file.filename}", 
-                    "chunks_count": len(chunks),
-                    "sample_questions": sample_questions
-                }
-            except Exception as e:
-                logger.error(f"Error processing file: {str(e)}")
-                raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
-            finally:
-                # Remove the temporary file
-                os.unlink(temp_file.name)
+    if filename.endswith(('.txt', '.pdf')) and run_async:
+        try:
+            job_id = await run_in_threadpool(
+                ingestion_jobs.submit_file, namespace, file.file, filename
+            )
+        except QueueFullError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        response.status_code = 202
+        return {"status": "accepted", "job_id": job_id, "status_url": f"/jobs/{job_id}"}
+    
+    if filename.endswith(('.txt', '.pdf')):
+        try:
+            # Parse the upload straight from its spooled file; extraction and
+            # indexing are CPU-bound, so keep them off the event loop
+            vector_store = await run_in_threadpool(namespaces.get, namespace)
+            chunks = iter_document_chunks(file.file, filename)
+            chunks_count, first_chunks = await run_in_threadpool(index_chunks, vector_store, chunks)
+            
+            # Sample questions come from the stored digest, or are generated after we respond
+            digest = await run_in_threadpool(digests.request, first_chunks, filename)
+            
+            return {
+                "status": "success", 
+                "message": f"Successfully processed {filename}", 
+                "chunks_count": chunks_count,
+                **response_fields(digest)
+            }
+        except Exception as e:
+            logger.error(f"Error processing file: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
     else:
         raise HTTPException(status_code=400, detail="Only .txt and .pdf files are supported")
 
+async def stream_events(request: Request, events):
+    """Relay SSE events, stopping as soon as the client goes away.
+    
+    Closing the event generator closes the upstream completion, which
+    cancels it.
+    """
+    try:
+        async for event in events:
+            if await request.is_disconnected():
+                logger.info("Client disconnected during streamed answer")
+                break
+            yield event
+    finally:
+        await events.aclose()
+
 @app.post("/ask", response_model=AnswerResponse)
-async def ask_question(question_request: QuestionRequest):
+async def ask_question(request: Request, question_request: QuestionRequest, namespace: str = Depends(current_namespace)):
     logger.info(f"Received question: {question_request.question}")
     
+    vector_store = await run_in_threadpool(namespaces.get, namespace)
     if not vector_store.is_initialized():
         raise HTTPException(status_code=400, detail="Please upload a document first")
     
     try:
         # Retrieve relevant chunks
-        relevant_chunks = vector_store.similarity_search(question_request.question, k=3)
+        generation = vector_store.generation
+        relevant_chunks, chunk_ids, question_embedding = await vector_store.asimilarity_search_with_ids(
+            question_request.question, k=3
+        )
         
         if not relevant_chunks:
             return AnswerResponse(
@@ -111,8 +203,31 @@ async def ask_question(question_request: QuestionRequest):
                 source_chunks=[]
             )
         
+        # Reuse the answer to a near-identical question over the same chunks
+        cached_answer = answer_cache.lookup(namespace, generation, question_embedding, chunk_ids)
+        remember = lambda answer: answer_cache.store(namespace, generation, question_embedding, chunk_ids, answer)
+        
+        # Stream tokens as Server-Sent Events when the client asks for it
+        if question_request.stream or 'text/event-stream' in request.headers.get('accept', ''):
+            async def replay_cached():
+                yield cached_answer
+            if cached_answer is not None:
+                tokens = replay_cached
+            else:
+                tokens = lambda: astream_answer_from_chunks(question_request.question, relevant_chunks)
+            events = aanswer_events(
+                relevant_chunks,
+                tokens,
+                on_complete=remember if cached_answer is None else None
+            )
+            return StreamingResponse(stream_events(request, events), media_type="text/event-stream", headers=SSE_HEADERS)
+        
         # Get answer from OpenAI
-        answer = get_answer_from_chunks(question_request.question, relevant_chunks)
+        if cached_answer is not None:
+            answer = cached_answer
+        else:
+            answer = await aget_answer_from_chunks(question_request.question, relevant_chunks)
+            remember(answer)
         
         # Format source chunks for display
         formatted_chunks = [chunk.page_content[:200] + "..." for chunk in relevant_chunks]
@@ -123,6 +238,86 @@ async def ask_question(question_request: QuestionRequest):
         logger.error(f"Error answering question: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error answering question: {str(e)}")
 
+@app.post("/ask/batch")
+async def ask_batch(request: Request, namespace: str = Depends(current_namespace)):
+    """Answer a list of questions in one request, returning a result per question in order."""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    questions, problem = parse_questions(data)
+    if problem:
+        raise HTTPException(status_code=400, detail=problem)
+    
+    # Each question counts against the limit; a batch that does not fit is rejected whole
+    can_ask, remaining_requests = await run_in_threadpool(RequestLimiter.can_make_request, request, len(questions))
+    if not can_ask:
+        return JSONResponse(status_code=429, content={
+            "status": "error",
+            "detail": f"This batch of {len(questions)} questions exceeds your remaining limit. Please try again later.",
+            "remaining_requests": await run_in_threadpool(RequestLimiter.get_remaining_requests, request),
+            "limit_reached": True
+        })
+    
+    logger.info(f"Received a batch of {len(questions)} questions")
+    set_deadline(batch_deadline(len(questions)))
+    
+    vector_store = await run_in_threadpool(namespaces.get, namespace)
+    if not vector_store.is_initialized():
+        raise HTTPException(status_code=400, detail="Please upload a document first")
+    
+    try:
+        results = await aanswer_questions(vector_store, namespace, questions, answer_cache)
+    except Exception as e:
+        logger.error(f"Error answering questions: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error answering questions: {str(e)}")
+    return {"results": results, "remaining_requests": remaining_requests}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, namespace: str = Depends(current_namespace)):
+    job = await run_in_threadpool(ingestion_jobs.get, job_id, namespace)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/digests/{digest_id}")
+async def get_digest(digest_id: str):
+    digest = await run_in_threadpool(digests.get, digest_id)
+    if digest is None:
+        raise HTTPException(status_code=404, detail="Digest not found")
+    return {**digest, **response_fields(digest)}
+
+@app.get("/documents")
+async def list_documents(namespace: str = Depends(current_namespace)):
+    vector_store = await run_in_threadpool(namespaces.get, namespace)
+    sources = await run_in_threadpool(vector_store.sources)
+    return {"documents": [{"source": source, "chunks_count": count} for source, count in sorted(sources.items())]}
+
+@app.delete("/documents")
+async def delete_document(source: str = Query(...), namespace: str = Depends(current_namespace)):
+    vector_store = await run_in_threadpool(namespaces.get, namespace)
+    try:
+        deleted = await run_in_threadpool(vector_store.delete_source, source)
+    except Exception as e:
+        logger.error(f"Error deleting document: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error deleting document: {str(e)}")
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return {"status": "success", "message": f"Deleted {source}", "chunks_deleted": deleted}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(await run_in_threadpool(metrics.render), media_type=PROMETHEUS_CONTENT_TYPE)
+
 @app.get("/health")
 async def health_check():
+    """Liveness: the process is up and answering."""
     return {"status": "ok"}
+
+@app.get("/ready")
+async def readiness_check(response: Response):
+    """Readiness: the warm-up has finished, with a breakdown of where the startup time went."""
+    report = startup.report()
+    if not report["ready"]:
+        response.status_code = 503
+    return {"status": "ready" if report["ready"] else "starting", **report}
@@ -0,0 +1,78 @@
+import random
+import textwrap
+import itertools
+import numpy as np
+from typing import Iterator, List
+
+# Word list the synthetic text is drawn from, most frequent first; the long
+# tail keeps BM25 postings realistic
+_VOCABULARY = (
+    "the of and to in is that for it as with was on be by this are from at or an have not "
+    "document section result model data system value method table figure analysis report"
+).split() + [f"term{i}" for i in range(5000)]
+
+# Zipf's law: the word of rank r turns up with probability proportional to 1 / r
+_CUMULATIVE_WEIGHTS = list(itertools.accumulate(1.0 / rank for rank in range(1, len(_VOCABULARY) + 1)))
+
+
+def synthetic_text(rng: random.Random, words: int) -> str:
+    """Sentences of words picked with a skewed distribution, like natural text."""
+    picks = rng.choices(_VOCABULARY, cum_weights=_CUMULATIVE_WEIGHTS, k=words)
+    sentences = [" ".join(picks[i:i + 12]).capitalize() + "." for i in range(0, len(picks), 12)]
+    return " ".join(sentences)
+
+
+def synthetic_pages(count: int, chars_per_page: int = 2500, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [synthetic_text(rng, chars_per_page // 7) for _ in range(count)]
+
+
+def synthetic_questions(count: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    return [f"What does the document say about {synthetic_text(rng, 4).rstrip('.')}?" for _ in range(count)]
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: List[str], line_chars: int = 90) -> bytes:
+    """A minimal PDF with one text page per entry, readable by PyPDF2's text extraction."""
+    objects = [b"", b""]  # catalog and page tree, filled in once the pages are known
+    font = len(objects) + 1
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for text in pages:
+        lines = textwrap.wrap(text, line_chars)
+        body = "BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(f"({_pdf_escape(line)}) '" for line in lines) + " ET"
+        stream = body.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (content, font)
+        )
+        page_ids.append(len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def random_vectors(count: int, dimensions: int, seed: int = 0, block: int = 65536) -> Iterator[np.ndarray]:
+    """Unit vectors in blocks, so a million of them never need a second full-size copy."""
+    rng = np.random.default_rng(seed)
+    for start in range(0, count, block):
+        vectors = rng.standard_normal((min(block, count - start), dimensions), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        yield vectors
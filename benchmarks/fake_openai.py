@@ -0,0 +1,199 @@
+import json
+import time
+import asyncio
+import hashlib
+import numpy as np
+from typing import Any, Dict, List, Optional, Union
+
+
+class _Object:
+    """Attribute bag shaped like the SDK's response models."""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def fake_embedding(text: str, dimensions: int) -> np.ndarray:
+    """Unit vector derived from the text alone, so repeated runs embed identically."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def _count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class FakeConfig:
+    """Latencies and sizes shared by the sync and async fakes.
+
+    Embedding requests take embedding_latency plus per_input_latency for
+    each input; completions take chat_latency before the first token and
+    token_latency between tokens when streamed.
+    """
+
+    def __init__(
+        self,
+        dimensions: int = 1536,
+        embedding_latency: float = 0.0,
+        per_input_latency: float = 0.0,
+        chat_latency: float = 0.0,
+        token_latency: float = 0.0,
+        answer_tokens: int = 50,
+    ):
+        self.dimensions = dimensions
+        self.embedding_latency = embedding_latency
+        self.per_input_latency = per_input_latency
+        self.chat_latency = chat_latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+
+    def embedding_delay(self, inputs: int) -> float:
+        return self.embedding_latency + self.per_input_latency * inputs
+
+    def embeddings_response(self, input: Union[str, List[str]]) -> _Object:
+        texts = [input] if isinstance(input, str) else list(input)
+        data = [
+            _Object(index=i, embedding=fake_embedding(text, self.dimensions).tolist(), object="embedding")
+            for i, text in enumerate(texts)
+        ]
+        tokens = sum(_count_tokens(text) for text in texts)
+        return _Object(data=data, usage=_Object(prompt_tokens=tokens, total_tokens=tokens))
+
+    def completion_text(self, params: Dict[str, Any]) -> str:
+        if (params.get("response_format") or {}).get("type") == "json_object":
+            return json.dumps({
+                "summary": "A synthetic document used for benchmarking.",
+                "questions": [
+                    "What is the main topic of this document?",
+                    "Which terms appear most often?",
+                    "How is the document organised?",
+                ],
+            })
+        return " ".join(f"token{i}" for i in range(self.answer_tokens))
+
+    def usage(self, params: Dict[str, Any], completion: str) -> _Object:
+        prompt = sum(_count_tokens(message.get("content", "")) for message in params.get("messages", []))
+        completion_tokens = _count_tokens(completion)
+        return _Object(prompt_tokens=prompt, completion_tokens=completion_tokens, total_tokens=prompt + completion_tokens)
+
+    def completion_response(self, params: Dict[str, Any]) -> _Object:
+        text = self.completion_text(params)
+        message = _Object(role="assistant", content=text)
+        return _Object(choices=[_Object(index=0, message=message, finish_reason="stop")], usage=self.usage(params, text))
+
+    def stream_events(self, params: Dict[str, Any]) -> List[_Object]:
+        text = self.completion_text(params)
+        events = [
+            _Object(choices=[_Object(index=0, delta=_Object(content=token + " "), finish_reason=None)], usage=None)
+            for token in text.split(" ")
+        ]
+        if (params.get("stream_options") or {}).get("include_usage"):
+            events.append(_Object(choices=[], usage=self.usage(params, text)))
+        return events
+
+
+class _Stream:
+    def __init__(self, events: List[_Object], config: FakeConfig):
+        self.events = events
+        self.config = config
+        self.closed = False
+
+    def __iter__(self):
+        for i, event in enumerate(self.events):
+            if self.closed:
+                return
+            if i:
+                time.sleep(self.config.token_latency)
+            yield event
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class _AsyncStream(_Stream):
+    async def __aiter__(self):
+        for i, event in enumerate(self.events):
+            if self.closed:
+                return
+            if i:
+                await asyncio.sleep(self.config.token_latency)
+            yield event
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+class _Embeddings:
+    def __init__(self, owner: "FakeOpenAI"):
+        self.owner = owner
+
+    def create(self, input, model: str, timeout: Optional[float] = None, **params):
+        self.owner.calls["embeddings"] += 1
+        time.sleep(self.owner.config.embedding_delay(1 if isinstance(input, str) else len(input)))
+        return self.owner.config.embeddings_response(input)
+
+
+class _AsyncEmbeddings(_Embeddings):
+    async def create(self, input, model: str, timeout: Optional[float] = None, **params):
+        self.owner.calls["embeddings"] += 1
+        await asyncio.sleep(self.owner.config.embedding_delay(1 if isinstance(input, str) else len(input)))
+        return self.owner.config.embeddings_response(input)
+
+
+class _Completions:
+    def __init__(self, owner: "FakeOpenAI"):
+        self.owner = owner
+
+    def create(self, model: str, messages: List[Dict[str, str]], stream: bool = False, **params):
+        self.owner.calls["chat"] += 1
+        params["messages"] = messages
+        time.sleep(self.owner.config.chat_latency)
+        if stream:
+            return _Stream(self.owner.config.stream_events(params), self.owner.config)
+        # A non-streamed answer arrives once every token has been generated
+        time.sleep(self.owner.config.token_latency * self.owner.config.answer_tokens)
+        return self.owner.config.completion_response(params)
+
+
+class _AsyncCompletions(_Completions):
+    async def create(self, model: str, messages: List[Dict[str, str]], stream: bool = False, **params):
+        self.owner.calls["chat"] += 1
+        params["messages"] = messages
+        await asyncio.sleep(self.owner.config.chat_latency)
+        if stream:
+            return _AsyncStream(self.owner.config.stream_events(params), self.owner.config)
+        await asyncio.sleep(self.owner.config.token_latency * self.owner.config.answer_tokens)
+        return self.owner.config.completion_response(params)
+
+
+class FakeOpenAI:
+    """Offline stand-in for openai.OpenAI covering the calls this app makes.
+
+    Embeddings are deterministic per text and completions are canned, so
+    benchmark runs are repeatable; only the configured latencies are
+    simulated.
+    """
+
+    def __init__(self, config: Optional[FakeConfig] = None):
+        self.config = config or FakeConfig()
+        self.calls = {"embeddings": 0, "chat": 0}
+        self.embeddings = _Embeddings(self)
+        self.chat = _Object(completions=_Completions(self))
+
+
+class AsyncFakeOpenAI(FakeOpenAI):
+    """Offline stand-in for openai.AsyncOpenAI."""
+
+    def __init__(self, config: Optional[FakeConfig] = None):
+        super().__init__(config)
+        self.embeddings = _AsyncEmbeddings(self)
+        self.chat = _Object(completions=_AsyncCompletions(self))
+
+
+def install(config: FakeConfig) -> None:
+    """Route every OpenAI call the app makes to the fakes; call before the apps are imported."""
+    from utils import openai_utils
+
+    openai_utils.client = FakeOpenAI(config)
+    openai_utils.async_client = AsyncFakeOpenAI(config)
@@ -0,0 +1,255 @@
+"""A local stand-in for the OpenAI API that injects faults.
+
+Serves /v1/embeddings and /v1/chat/completions (streamed or not) with the
+fake responses of benchmarks/fake_openai.py, failing, stalling or dropping
+a configurable share of requests. Point the app at it with OPENAI_BASE_URL:
+
+    python -m benchmarks.fault_server --port 8900 --error-rate 0.2 --slow-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OPENAI_API_KEY=x gunicorn main:app
+
+The faults can be changed while it runs by POSTing a JSON object of
+FaultConfig fields to /_faults; GET /_faults returns them with the request
+counts.
+"""
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+from benchmarks.fake_openai import FakeConfig, fake_embedding, _count_tokens
+
+
+class FaultConfig:
+    """Share of requests failing in each way, drawn independently per request.
+
+    error_rate answers with error_status (and Retry-After when set),
+    reset_rate closes the connection without answering, slow_rate adds
+    slow_latency seconds before answering; every other request only waits
+    for the latencies of the fake.
+    """
+
+    FIELDS = ("error_rate", "error_status", "retry_after", "reset_rate", "slow_rate", "slow_latency")
+
+    def __init__(
+        self,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        retry_after: Optional[float] = None,
+        reset_rate: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_latency: float = 5.0,
+    ):
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.reset_rate = reset_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+
+    def update(self, fields: Dict[str, Any]) -> None:
+        for name in self.FIELDS:
+            if name in fields:
+                setattr(self, name, fields[name])
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+class FaultServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], faults: FaultConfig, fake: FakeConfig, seed: int = 0):
+        super().__init__(address, _Handler)
+        self.faults = faults
+        self.fake = fake
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "errors": 0, "resets": 0, "slow": 0}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def draw(self) -> str:
+        """The fault for the next request: error, reset, slow or ok."""
+        with self.lock:
+            self.counts["requests"] += 1
+            roll = self.random.random()
+            for fault, rate in (("errors", self.faults.error_rate), ("resets", self.faults.reset_rate),
+                                ("slow", self.faults.slow_rate)):
+                if roll < rate:
+                    self.counts[fault] += 1
+                    return fault
+                roll -= rate
+        return "ok"
+
+    def reset_counts(self) -> None:
+        with self.lock:
+            self.counts = dict.fromkeys(self.counts, 0)
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on hedged losers and timed-out calls; only report real errors
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FaultServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/_faults":
+            with self.server.lock:
+                counts = dict(self.server.counts)
+            self._send_json(200, {**self.server.faults.as_dict(), "counts": counts})
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        params = self._read_json()
+        if self.path == "/_faults":
+            self.server.faults.update(params)
+            self._send_json(200, self.server.faults.as_dict())
+            return
+        if self.path not in ("/v1/embeddings", "/v1/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        fault = self.server.draw()
+        faults = self.server.faults
+        if fault == "resets":
+            # Drop the connection without a response, as a crashed upstream or proxy would
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+            return
+        if fault == "errors":
+            headers = {"Retry-After": str(faults.retry_after)} if faults.retry_after is not None else None
+            error = {"message": f"Injected fault ({faults.error_status})", "type": "server_error", "code": None}
+            self._send_json(faults.error_status, {"error": error}, headers)
+            return
+        if fault == "slow":
+            time.sleep(faults.slow_latency)
+
+        if self.path == "/v1/embeddings":
+            self._embeddings(params)
+        elif params.get("stream"):
+            self._stream(params)
+        else:
+            self._completion(params)
+
+    def _embeddings(self, params: Dict[str, Any]) -> None:
+        fake = self.server.fake
+        texts = [params["input"]] if isinstance(params["input"], str) else list(params["input"])
+        time.sleep(fake.embedding_delay(len(texts)))
+        dimensions = params.get("dimensions") or fake.dimensions
+        data = [
+            {"object": "embedding", "index": i, "embedding": fake_embedding(text, dimensions).tolist()}
+            for i, text in enumerate(texts)
+        ]
+        tokens = sum(_count_tokens(text) for text in texts)
+        self._send_json(200, {
+            "object": "list", "data": data, "model": params.get("model"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _usage(self, params: Dict[str, Any], text: str) -> Dict[str, int]:
+        usage = self.server.fake.usage(params, text)
+        return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens,
+                "total_tokens": usage.total_tokens}
+
+    def _completion(self, params: Dict[str, Any]) -> None:
+        fake = self.server.fake
+        time.sleep(fake.chat_latency + fake.token_latency * fake.answer_tokens)
+        text = fake.completion_text(params)
+        self._send_json(200, {
+            "id": "chatcmpl-fault", "object": "chat.completion", "created": int(time.time()),
+            "model": params.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": self._usage(params, text),
+        })
+
+    def _stream(self, params: Dict[str, Any]) -> None:
+        fake = self.server.fake
+        time.sleep(fake.chat_latency)
+        text = fake.completion_text(params)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(choices, usage=None) -> None:
+            chunk = {"id": "chatcmpl-fault", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": params.get("model"), "choices": choices, "usage": usage}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        for i, token in enumerate(text.split(" ")):
+            if i:
+                time.sleep(fake.token_latency)
+            event([{"index": 0, "delta": {"content": token + " "}, "finish_reason": None}])
+        if (params.get("stream_options") or {}).get("include_usage"):
+            event([], self._usage(params, text))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def serve(faults: FaultConfig, fake: Optional[FakeConfig] = None, port: int = 0, seed: int = 0) -> FaultServer:
+    """Start a fault server on a local port in a background thread."""
+    server = FaultServer(("127.0.0.1", port), faults, fake or FakeConfig(), seed)
+    threading.Thread(target=server.serve_forever, name="fault-server", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="OpenAI API stand-in that injects faults")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float)
+    parser.add_argument("--reset-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-latency", type=float, default=5.0)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--chat-latency", type=float, default=0.3)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    faults = FaultConfig(args.error_rate, args.error_status, args.retry_after, args.reset_rate,
+                         args.slow_rate, args.slow_latency)
+    fake = FakeConfig(dimensions=args.dimensions, embedding_latency=args.embedding_latency,
+                      chat_latency=args.chat_latency, token_latency=args.token_latency)
+    server = FaultServer(("127.0.0.1", args.port), faults, fake, args.seed)
+    print(f"Serving the OpenAI stand-in at {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,590 @@
+"""Offline benchmarks for ingestion, vector search, the HTTP apps and fault handling.
+
+Every OpenAI call goes to the fakes in benchmarks/fake_openai.py, or for
+the faults suite to the local server in benchmarks/fault_server.py, so runs
+need no API key and are repeatable. Results are written as JSON.
+
+    python -m benchmarks.run                          # all suites
+    python -m benchmarks.run --suites search --sizes 10000,100000
+    python -m benchmarks.run --suites http --apps fastapi --concurrency 32
+    python -m benchmarks.run --suites faults --fault-error-rate 0.3
+
+Run from the repository root.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import numpy as np
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.corpus import make_pdf, random_vectors, synthetic_pages, synthetic_questions, synthetic_text
+from benchmarks.fake_openai import FakeConfig, FakeOpenAI, install
+
+SUITES = ("ingest", "search", "http", "faults")
+APPS = ("flask", "fastapi")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Embedding size of the stores the apps create; --dimensions only applies to the other suites
+APP_DIMENSIONS = 1536
+
+# Bump when the layout of the results file changes
+RESULTS_SCHEMA = 1
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    """Latency percentiles in milliseconds."""
+    if not latencies:
+        return {"count": 0}
+    ms = np.asarray(latencies) * 1000
+    return {
+        "count": len(latencies),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def fake_config(args) -> FakeConfig:
+    return FakeConfig(
+        dimensions=args.dimensions,
+        embedding_latency=args.embedding_latency,
+        per_input_latency=args.per_input_latency,
+        chat_latency=args.chat_latency,
+        token_latency=args.token_latency,
+    )
+
+
+def embedding_provider(args, config: FakeConfig):
+    """Provider the ingest and search suites embed with; "openai" means the fake client."""
+    from utils.embedding_providers import HashingEmbeddingProvider, LocalEmbeddingProvider, OpenAIEmbeddingProvider
+
+    if args.provider == "local":
+        return LocalEmbeddingProvider(args.model_path)
+    if args.provider == "hashing":
+        return HashingEmbeddingProvider(args.dimensions)
+    return OpenAIEmbeddingProvider(client=FakeOpenAI(config), model="fake", dimension=args.dimensions)
+
+
+def bench_ingest(args, workdir: str) -> Dict[str, Any]:
+    """Pages and chunks per second for a PDF, extracted alone and ingested end to end."""
+    from utils.pdf_extraction import iter_pdf_pages
+    from utils.document_processor import iter_document_chunks
+    from utils.embedding_pipeline import EmbeddingPipeline
+    from utils.ingestion_jobs import index_chunks
+    from utils.vector_store import VectorStore
+
+    path = os.path.join(workdir, "ingest.pdf")
+    with open(path, "wb") as f:
+        f.write(make_pdf(synthetic_pages(args.pages)))
+
+    runs = []
+    for run in range(args.repeat):
+        started = time.perf_counter()
+        pages = sum(1 for _ in iter_pdf_pages(path))
+        extract_seconds = time.perf_counter() - started
+
+        store = VectorStore(
+            embedder=EmbeddingPipeline(provider=embedding_provider(args, fake_config(args)), use_cache=False),
+            snapshot_dir=os.path.join(workdir, f"ingest-store-{run}"),
+        )
+        started = time.perf_counter()
+        chunks, _ = index_chunks(store, iter_document_chunks(path, "ingest.pdf"))
+        ingest_seconds = time.perf_counter() - started
+        runs.append({
+            "pages": pages,
+            "chunks": chunks,
+            "extract_seconds": extract_seconds,
+            "extract_pages_per_second": pages / extract_seconds,
+            "ingest_seconds": ingest_seconds,
+            "ingest_pages_per_second": pages / ingest_seconds,
+            "ingest_chunks_per_second": chunks / ingest_seconds,
+            "embedding_batches": store.embedder.stats()["totals"]["batches"],
+        })
+        print(
+            f"ingest: {pages} pages extracted at {pages / extract_seconds:.1f} pages/s, "
+            f"ingested at {pages / ingest_seconds:.1f} pages/s ({chunks / ingest_seconds:.1f} chunks/s)",
+            file=sys.stderr,
+        )
+
+    # The median run by end-to-end time is reported, with every run kept for reference
+    best = sorted(runs, key=lambda run: run["ingest_seconds"])[len(runs) // 2]
+    return dict(best, embedding=store.embedder.provider.signature(), runs=runs)
+
+
+def build_store(size: int, args, quantization: str = "none"):
+    """A store of size synthetic chunks whose vectors are added directly, skipping embedding."""
+    from langchain_core.documents import Document
+    from utils.embedding_pipeline import EmbeddingPipeline
+    from utils.vector_store import VectorStore
+    from utils.ann_index import VECTOR_INDEX_PROMOTION_THRESHOLD
+
+    store = VectorStore(
+        # No simulated latency, so only the search itself is timed
+        embedder=EmbeddingPipeline(provider=embedding_provider(args, FakeConfig(dimensions=args.dimensions)), use_cache=False),
+        snapshot_dir=None,
+        index_type=args.index_type,
+        quantization=quantization,
+        # Build the target index in one go rather than promoting in the background
+        promotion_threshold=min(size, VECTOR_INDEX_PROMOTION_THRESHOLD),
+        retrieval_mode=args.retrieval_mode,
+    )
+    rng = random.Random(size)
+    added = 0
+    for vectors in random_vectors(size, store.dimension, seed=size):
+        documents = [
+            Document(page_content=synthetic_text(rng, 24), metadata={"source": f"doc-{(added + i) // 100}"})
+            for i in range(len(vectors))
+        ]
+        with store._lock:
+            store._append(documents, vectors)
+        added += len(vectors)
+    return store
+
+
+def _resident_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def exact_neighbours(size: int, dimensions: int, queries: np.ndarray, k: int) -> np.ndarray:
+    """Rows of build_store's vectors nearest to each query, found block by block without holding them all."""
+    import faiss
+
+    distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+    labels = np.full((len(queries), k), -1, dtype=np.int64)
+    offset = 0
+    for vectors in random_vectors(size, dimensions, seed=size):
+        exact = faiss.IndexFlatL2(dimensions)
+        exact.add(vectors)
+        block_distances, block_labels = exact.search(queries, min(k, len(vectors)))
+        merged_distances = np.hstack([distances, block_distances])
+        merged_labels = np.hstack([labels, block_labels + offset])
+        order = np.argsort(merged_distances, axis=1)[:, :k]
+        distances = np.take_along_axis(merged_distances, order, axis=1)
+        labels = np.take_along_axis(merged_labels, order, axis=1)
+        offset += len(vectors)
+    return labels
+
+
+def measure_recall(store, size: int, k: int, num_queries: int = 200) -> float:
+    """recall@k of the store's index against exact float32 search.
+
+    Queries are stored vectors with a little noise added, as in
+    VectorStore.index_report, but the truth comes from the original
+    vectors, so the loss from quantization is included.
+    """
+    first_block = next(random_vectors(size, store.dimension, seed=size))
+    rng = np.random.default_rng(0)
+    sample = first_block[rng.choice(len(first_block), size=min(num_queries, len(first_block)), replace=False)]
+    queries = (sample + rng.normal(0, 0.01, sample.shape)).astype(np.float32)
+    truth = exact_neighbours(size, store.dimension, queries, k)
+    _, found = store.index.search(queries, k)
+    hits = sum(len(set(found[i]) & set(truth[i])) for i in range(len(queries)))
+    return hits / float(len(queries) * k)
+
+
+def bench_search(args, workdir: str) -> List[Dict[str, Any]]:
+    """similarity_search latency, memory and recall at each corpus size and quantization."""
+    results = []
+    for size in args.sizes:
+        for quantization in args.quantization:
+            results.append(_bench_search_store(args, size, quantization))
+    return results
+
+
+def _bench_search_store(args, size: int, quantization: str) -> Dict[str, Any]:
+    from utils.ann_index import estimate_index_bytes, index_type_of, quantization_of
+
+    questions = synthetic_questions(args.queries)
+    resident = _resident_bytes()
+    started = time.perf_counter()
+    store = build_store(size, args, quantization)
+    build_seconds = time.perf_counter() - started
+    resident_after = _resident_bytes()
+
+    for question in questions[:10]:
+        store.similarity_search(question, k=args.k)  # warm up
+    latencies = []
+    for question in questions:
+        started = time.perf_counter()
+        store.similarity_search(question, k=args.k)
+        latencies.append(time.perf_counter() - started)
+
+    result = {
+        "vectors": size,
+        "embedding": store.embedder.provider.signature(),
+        "index_type": index_type_of(store.index),
+        "quantization": quantization_of(store.index),
+        "retrieval_mode": store.retrieval_mode,
+        "k": args.k,
+        "build_seconds": build_seconds,
+        "memory_bytes": store.memory_usage(),
+        "index_bytes": estimate_index_bytes(store.index),
+        "chunk_bytes": store.documents.nbytes,
+        # Growth of the process while the store was built, including allocator slack
+        "resident_bytes": resident_after - resident if resident is not None and resident_after is not None else None,
+        f"recall@{args.k}": measure_recall(store, size, args.k),
+        **summarize(latencies),
+    }
+    print(
+        f"search: {size} vectors ({result['index_type']}/{result['quantization']}, {result['retrieval_mode']}): "
+        f"p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, "
+        f"recall@{args.k} {result[f'recall@{args.k}']:.3f}, index {result['index_bytes'] / 2 ** 20:.1f} MiB",
+        file=sys.stderr,
+    )
+    return result
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve(app_name: str) -> str:
+    """Start the app on a local port in a background thread and return its base URL."""
+    port = _free_port()
+    if app_name == "flask":
+        from werkzeug.serving import make_server
+        from flask_app import app
+
+        server = make_server("127.0.0.1", port, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        import uvicorn
+        from app import app
+
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+    from utils.startup import startup
+
+    # Load against a warmed-up app, with the background services an app server would start
+    startup.wait()
+    startup.start_services()
+    return f"http://127.0.0.1:{port}"
+
+
+def _load(base_url: str, requests: List[Callable], concurrency: int) -> Dict[str, Any]:
+    """Send requests from concurrency threads, each with its own connection."""
+    import httpx
+
+    local = threading.local()
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    stages: Dict[str, List[float]] = {}
+    lock = threading.Lock()
+
+    def run(request: Callable) -> None:
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = httpx.Client(base_url=base_url, timeout=120, headers={"X-Tenant-ID": "bench"})
+        started = time.perf_counter()
+        try:
+            response = request(client)
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            response, status = None, type(e).__name__
+        elapsed = time.perf_counter() - started
+        timing = response.headers.get("server-timing", "") if response is not None else ""
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+            for entry in filter(None, (part.strip() for part in timing.split(","))):
+                name, _, duration = entry.partition(";dur=")
+                if duration:
+                    stages.setdefault(name, []).append(float(duration))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run, requests))
+    wall = time.perf_counter() - started
+    return {
+        **summarize(latencies),
+        "concurrency": concurrency,
+        "requests_per_second": len(requests) / wall,
+        "errors": sum(count for status, count in statuses.items() if not status.startswith("2")),
+        "statuses": statuses,
+        # Mean per request of each stage reported in the Server-Timing header
+        "server_timing_mean_ms": {name: sum(values) / len(requests) for name, values in sorted(stages.items())},
+    }
+
+
+def http_child(app_name: str, args) -> Dict[str, Any]:
+    """Benchmark one app in this process; run by bench_http in a fresh interpreter."""
+    config = fake_config(args)
+    # The apps create their stores at the default embedding size
+    config.dimensions = APP_DIMENSIONS
+    install(config)
+    base_url = _serve(app_name)
+
+    def upload(number: int) -> Callable:
+        # Every upload is a different document, so none is skipped as already indexed
+        text = "\n\n".join(synthetic_pages(args.upload_pages, seed=1000 + number))
+        return lambda client: client.post("/upload", files={"file": (f"upload-{number}.txt", text.encode("utf-8"), "text/plain")})
+
+    def ask(question: str) -> Callable:
+        return lambda client: client.post("/ask", json={"question": question})
+
+    # Seed the shared namespace so questions have something to retrieve
+    _load(base_url, [upload(-1)], 1)
+    return {
+        "upload": _load(base_url, [upload(i) for i in range(args.uploads)], args.concurrency),
+        "ask": _load(base_url, [ask(q) for q in synthetic_questions(args.asks)], args.concurrency),
+    }
+
+
+def bench_http(args, workdir: str) -> Dict[str, Any]:
+    """End-to-end /upload and /ask latency under concurrency for each app."""
+    results = {}
+    for app_name in args.apps:
+        state = os.path.join(workdir, app_name)
+        os.makedirs(state, exist_ok=True)
+        env = dict(
+            os.environ,
+            OPENAI_API_KEY="benchmark",
+            TENANT_HEADER="X-Tenant-ID",
+            RATE_LIMIT_MAX_REQUESTS=str(10 ** 9),
+            # Every question is answered rather than served from the answer cache
+            ANSWER_CACHE_MAX_ENTRIES="0",
+            SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(state, 'app.db')}",
+            VECTOR_STORE_SNAPSHOT_DIR=os.path.join(state, "vector_store"),
+            VECTOR_STORE_NAMESPACE_DIR=os.path.join(state, "namespaces"),
+            EMBEDDING_CACHE_PATH=os.path.join(state, "embedding_cache.db"),
+            INGESTION_JOBS_DB=os.path.join(state, "ingestion_jobs.db"),
+            INGESTION_SPOOL_DIR=os.path.join(state, "uploads"),
+            RATE_LIMIT_DB=os.path.join(state, "rate_limits.db"),
+            DIGESTS_DB=os.path.join(state, "digests.db"),
+            METRICS_DB=os.path.join(state, "metrics.db"),
+            CRAWL_STATE_DB=os.path.join(state, "crawl_state.db"),
+        )
+        command = [sys.executable, "-m", "benchmarks.run", "--http-child", app_name, *args.child_argv]
+        completed = subprocess.run(
+            command,
+            cwd=REPO_ROOT,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=None if args.verbose else subprocess.DEVNULL,
+            check=True,
+        )
+        results[app_name] = json.loads(completed.stdout.decode("utf-8").strip().splitlines()[-1])
+        for endpoint, result in results[app_name].items():
+            print(
+                f"http: {app_name} {endpoint}: p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, "
+                f"{result['requests_per_second']:.1f} req/s at concurrency {result['concurrency']}",
+                file=sys.stderr,
+            )
+    return results
+
+
+def _fault_calls(calls: List[Callable[[], Any]], concurrency: int, seconds: float) -> Dict[str, Any]:
+    """Run calls from concurrency threads, each under a deadline of seconds, counting outcomes."""
+    from utils.resilience import deadline
+
+    latencies: List[float] = []
+    outcomes: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def run(call: Callable[[], Any]) -> None:
+        started = time.perf_counter()
+        try:
+            with deadline(seconds):
+                call()
+            outcome = "ok"
+        except Exception as e:
+            outcome = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run, calls))
+    return {**summarize(latencies), "success_rate": outcomes.get("ok", 0) / len(calls), "outcomes": outcomes}
+
+
+def bench_faults(args, workdir: str) -> Dict[str, Any]:
+    """Completions and embeddings through the real SDK against a local server that injects faults."""
+    import logging
+    import httpx
+    from openai import OpenAI, DefaultHttpxClient
+    from benchmarks.fault_server import FaultConfig, serve
+    from utils import openai_utils, resilience
+    from utils.embedding_providers import OpenAIEmbeddingProvider
+
+    if not args.verbose:
+        # Every retry and opened circuit is logged as a warning
+        logging.getLogger("utils.resilience").setLevel(logging.ERROR)
+    config = fake_config(args)
+    server = serve(FaultConfig(), config)
+    options = openai_utils._client_options(httpx, DefaultHttpxClient)
+    openai_utils.client = OpenAI(**dict(options, api_key="benchmark", base_url=server.base_url))
+    questions = synthetic_questions(args.fault_calls)
+
+    def scenario(name: str, calls: List[Callable[[], Any]], **faults) -> Dict[str, Any]:
+        server.faults.update(FaultConfig(**faults).as_dict())
+        server.reset_counts()
+        # Each scenario starts with closed circuits
+        for upstream in resilience.breakers:
+            resilience.breakers[upstream] = resilience.CircuitBreaker(upstream)
+        result = _fault_calls(calls, args.concurrency, args.fault_deadline)
+        result.update(
+            faults=faults,
+            upstream=dict(server.counts),
+            circuits={upstream: breaker.stats() for upstream, breaker in resilience.breakers.items()},
+        )
+        print(
+            f"faults: {name}: {result['success_rate']:.1%} succeeded, p50 {result['p50_ms']:.1f} ms, "
+            f"p99 {result['p99_ms']:.1f} ms, {result['upstream']['requests']} upstream requests for {len(calls)} calls",
+            file=sys.stderr,
+        )
+        return result
+
+    def answer(question: str) -> Callable[[], Any]:
+        return lambda: openai_utils.complete("answer", messages=[{"role": "user", "content": question}])
+
+    def embed(provider: OpenAIEmbeddingProvider, question: str) -> Callable[[], Any]:
+        return lambda: provider.embed_batch([question], timeout=resilience.call_timeout())
+
+    plain = OpenAIEmbeddingProvider(model="fake", dimension=args.dimensions)
+    hedging = OpenAIEmbeddingProvider(model="fake", dimension=args.dimensions, hedge_delay=args.hedge_delay)
+    slow = dict(slow_rate=args.fault_slow_rate, slow_latency=args.fault_slow_latency)
+    try:
+        return {
+            # Transient errors and dropped connections, retried with backoff
+            "chat_errors": scenario("chat with errors", [answer(q) for q in questions],
+                                    error_rate=args.fault_error_rate, reset_rate=args.fault_reset_rate),
+            # A slow tail, with and without a hedged second request
+            "embeddings_slow": scenario("embeddings with a slow tail", [embed(plain, q) for q in questions], **slow),
+            "embeddings_slow_hedged": scenario("embeddings with a slow tail, hedged",
+                                               [embed(hedging, q) for q in questions], **slow),
+            # Upstream down: the circuit opens and later calls fail without reaching it
+            "chat_outage": scenario("chat during an outage", [answer(q) for q in questions], error_rate=1.0),
+        }
+    finally:
+        server.shutdown()
+        openai_utils.client = None
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _csv(kind: Callable) -> Callable[[str], List]:
+    return lambda value: [kind(item) for item in value.split(",") if item]
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks with a fake OpenAI client")
+    parser.add_argument("--suites", type=_csv(str), default=list(SUITES), help="comma-separated: ingest,search,http,faults")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<UTC time>.json)")
+    parser.add_argument("--verbose", action="store_true", help="show the apps' logs during the http suite")
+
+    fake = parser.add_argument_group("fake OpenAI")
+    parser.add_argument("--provider", choices=("openai", "local", "hashing"), default="openai",
+                        help="embedding provider for the ingest and search suites; openai uses the fake client")
+    parser.add_argument("--model-path", help="model file for --provider local")
+    fake.add_argument("--dimensions", type=int, default=1536, help="embedding size of the openai and hashing providers")
+    fake.add_argument("--embedding-latency", type=float, default=0.05, help="seconds per embeddings request")
+    fake.add_argument("--per-input-latency", type=float, default=0.0005, help="extra seconds per embedded text")
+    fake.add_argument("--chat-latency", type=float, default=0.3, help="seconds to the first completion token")
+    fake.add_argument("--token-latency", type=float, default=0.01, help="seconds between completion tokens")
+
+    ingest = parser.add_argument_group("ingest")
+    ingest.add_argument("--pages", type=int, default=200)
+    ingest.add_argument("--repeat", type=int, default=3)
+
+    search = parser.add_argument_group("search")
+    search.add_argument("--sizes", type=_csv(int), default=[10_000, 100_000, 1_000_000])
+    search.add_argument("--queries", type=int, default=200)
+    search.add_argument("--k", type=int, default=3)
+    search.add_argument("--index-type", default="flat")
+    search.add_argument("--quantization", type=_csv(str), default=["none"], help="comma-separated: none,fp16,int8")
+    search.add_argument("--retrieval-mode", default="hybrid")
+
+    http = parser.add_argument_group("http")
+    http.add_argument("--apps", type=_csv(str), default=list(APPS))
+    http.add_argument("--concurrency", type=int, default=8)
+    http.add_argument("--uploads", type=int, default=40)
+    http.add_argument("--upload-pages", type=int, default=5)
+    http.add_argument("--asks", type=int, default=200)
+
+    faults = parser.add_argument_group("faults")
+    faults.add_argument("--fault-calls", type=int, default=100, help="calls per scenario, run at --concurrency")
+    faults.add_argument("--fault-error-rate", type=float, default=0.2, help="share of requests answered with a 503")
+    faults.add_argument("--fault-reset-rate", type=float, default=0.02, help="share of connections dropped unanswered")
+    faults.add_argument("--fault-slow-rate", type=float, default=0.05, help="share of requests delayed by --fault-slow-latency")
+    faults.add_argument("--fault-slow-latency", type=float, default=2.0)
+    faults.add_argument("--fault-deadline", type=float, default=10.0, help="deadline of each call, as REQUEST_DEADLINE")
+    faults.add_argument("--hedge-delay", type=float, default=0.2, help="EMBEDDING_HEDGE_DELAY of the hedged scenario")
+    parser.add_argument("--http-child", choices=APPS, help=argparse.SUPPRESS)
+
+    args = parser.parse_args(argv)
+    unknown = set(args.suites) - set(SUITES) or set(args.apps) - set(APPS)
+    if unknown:
+        parser.error(f"unknown choice: {', '.join(sorted(unknown))}")
+    # The http suite re-runs this module per app with the same options
+    args.child_argv = [arg for arg in (argv if argv is not None else sys.argv[1:]) if arg != "--verbose"]
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    if args.http_child:
+        print(json.dumps(http_child(args.http_child, args)))
+        return
+
+    benchmarks = {"ingest": bench_ingest, "search": bench_search, "http": bench_http, "faults": bench_faults}
+    report = {
+        "schema": RESULTS_SCHEMA,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("child_argv", "http_child", "output", "verbose")},
+        "results": {},
+    }
+    workdir = tempfile.mkdtemp(prefix="chatbot-bench-")
+    try:
+        for suite in args.suites:
+            started = time.perf_counter()
+            report["results"][suite] = benchmarks[suite](args, workdir)
+            print(f"{suite} suite finished in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json")
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,175 @@
 import os
+import time
+import uuid
 import tempfile
 import logging
 from typing import List
-from flask import Flask, request, jsonify, render_template, redirect, url_for, g
+from flask import Blueprint, Flask, Request, Response, request, jsonify, render_template, redirect, url_for, g, session
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-from utils.document_processor import process_document, process_url, is_valid_url
-from utils.vector_store import VectorStore
-from utils.openai_utils import get_answer_from_chunks
+from utils.startup import STARTUP_PRELOAD_NAMESPACES, startup
+from utils.document_processor import iter_document_chunks, process_url, is_valid_url
+from utils.namespaces import NamespaceManager, TENANT_HEADER
+from utils.openai_utils import get_answer_from_chunks, get_client, get_context_packer, stream_answer_from_chunks
+from utils.ingestion_jobs import IngestionJobs, QueueFullError, index_chunks
+from utils.digests import DigestStore, response_fields
+from utils.answer_cache import SemanticAnswerCache
+from utils.batch_answers import answer_questions, batch_deadline, parse_questions
+from utils.streaming import SSE_HEADERS, answer_events
 from utils.request_limiter import RequestLimiter
-from models import db, VisitorCount
+from utils.uploads import UPLOAD_MAX_BYTES, UPLOAD_SPOOL_BYTES
+from utils.crawler import CRAWL_MAX_PAGES, CRAWL_MAX_DEPTH
+from utils.visitor_counter import VisitorCounter
+from utils.metrics import PROMETHEUS_CONTENT_TYPE, begin_request, metrics, record_request, server_timing
+from utils.resilience import request_deadline, set_deadline
+from models import db
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Initialize Flask app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
+startup.mark("imports")
 
-# Configure the database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("SQLALCHEMY_DATABASE_URI", "sqlite:///app.db")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+class SpooledUploadRequest(Request):
+    """Keep uploads in memory up to UPLOAD_SPOOL_BYTES, spilling to disk only past that."""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+
+bp = Blueprint('chatbot', __name__)
+
+# Vector stores, one per session or tenant
+namespaces = NamespaceManager()
+
+# Summaries and suggested questions, generated once per document in the background
+digests = DigestStore()
+
+# Background ingestion for uploads and URLs submitted with ?async=1
+ingestion_jobs = IngestionJobs(get_store=namespaces.get, digests=digests)
+
+# Answers reused for near-identical questions over the same context
+answer_cache = SemanticAnswerCache()
+
+# Visits are counted in memory and flushed to the database in the background
+visitor_counter = VisitorCounter()
+
+# Stage latencies and counters, added up across workers for /metrics
+metrics.add_collector(namespaces.gauges)
+
+# Threads do not survive a fork, so these start in each process that serves requests
+startup.add_service(ingestion_jobs.start)
+startup.add_service(visitor_counter.start)
+startup.add_service(metrics.start)
+
+# Loaded in the background after startup rather than by the first request that needs them
+startup.add_imports("langchain.text_splitter", "PyPDF2", "trafilatura", "utils.vector_store")
+startup.add_step("openai_client", get_client)
+startup.add_step("tokenizer", get_context_packer)
+startup.add_step("namespaces", lambda: [namespaces.get(name) for name in STARTUP_PRELOAD_NAMESPACES])
+
+def create_app() -> Flask:
+    """Build the Flask app and start warming it up.
+
+    Serve it with gunicorn --preload (see gunicorn.conf.py) to warm up once
+    in the master process and fork workers that already hold the loaded
+    libraries and indexes.
+    """
+    with startup.stage("create_app"):
+        app = Flask(__name__)
+        app.request_class = SpooledUploadRequest
+        app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
+
+        # Requests over the limit are rejected with 413 before their body is read
+        app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_BYTES or None
+
+        # Configure the database
+        app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("SQLALCHEMY_DATABASE_URI", "sqlite:///app.db")
+        app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+        # Initialize the database
+        db.init_app(app)
+        visitor_counter.init_app(app)
+        app.register_blueprint(bp)
 
-# Initialize the database
-db.init_app(app)
+    # Create database tables
+    with startup.stage("database"), app.app_context():
+        db.create_all()
 
-# Initialize vector store
-vector_store = VectorStore()
+    def dispose_database_pool():
+        # Pooled connections opened before a fork belong to the parent process
+        with app.app_context():
+            db.engine.dispose(close=False)
 
-# Create database tables
-with app.app_context():
-    db.create_all()
+    startup.add_service(dispose_database_pool)
+    startup.warm_up()
+    return app
 
-@app.route('/')
+@bp.before_app_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    begin_request()
+    # OpenAI calls made for this request share its time budget
+    set_deadline(request_deadline(request.path))
+    # Started here unless a gunicorn hook already did, e.g. under the development server
+    startup.start_services()
+
+@bp.after_app_request
+def add_server_timing(response):
+    """Record the request's latency and report its stage timings in a Server-Timing header."""
+    started = g.get('request_started')
+    if started is not None and metrics.enabled:
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        record_request(request.method, route, response.status_code, elapsed)
+        response.headers['Server-Timing'] = server_timing(elapsed)
+    return response
+
+def current_namespace() -> str:
+    """Namespace for this request: the tenant header if configured, else the session."""
+    if TENANT_HEADER and request.headers.get(TENANT_HEADER):
+        return f"tenant-{request.headers[TENANT_HEADER]}"
+    if 'namespace' not in session:
+        session['namespace'] = uuid.uuid4().hex
+    return f"session-{session['namespace']}"
+
+def wants_async(data=None) -> bool:
+    """Whether the client asked for ingestion to run as a background job."""
+    flag = request.args.get('async') or request.form.get('async') or (data or {}).get('async')
+    return str(flag).lower() in ('1', 'true', 'yes')
+
+def clamp_option(value, limit: int) -> int:
+    """A client-supplied limit, capped at the server's configured maximum."""
+    try:
+        return max(0, min(int(value), limit))
+    except (TypeError, ValueError):
+        return limit
+
+def job_accepted(job_id: str):
+    return jsonify({
+        "status": "accepted",
+        "job_id": job_id,
+        "status_url": url_for('.get_job', job_id=job_id)
+    }), 202
+
+@bp.route('/')
 def index():
     # Increment visitor count
-    visitor_count = VisitorCount.increment()
+    visitor_count = visitor_counter.increment()
     return render_template('index.html', visitor_count=visitor_count)
 
-@app.route('/visitor-count')
+@bp.route('/visitor-count')
 def get_visitor_count():
     # Get current visitor count
-    count = VisitorCount.get_count()
+    count = visitor_counter.count()
     return jsonify({"count": count})
 
-@app.route('/upload', methods=['POST'])
+@bp.route('/upload', methods=['POST'])
 def upload_file():
     logger.info("Received upload request")
-    temp_file = None
     
     if 'file' not in request.files:
         return jsonify({"status": "error", "detail": "No file part"}), 400
@@ -64,46 +181,34 @@ def upload_file():
     
     # Check file type
     if file and (file.filename.endswith('.txt') or file.filename.endswith('.pdf')):
+        if wants_async():
+            try:
+                job_id = ingestion_jobs.submit_file(current_namespace(), file.stream, secure_filename(file.filename))
+            except QueueFullError as e:
+                return jsonify({"status": "error", "detail": str(e)}), 503
+            return job_accepted(job_id)
+        
         try:
-            # Create a temporary file to store the uploaded content
-            temp_file = tempfile.NamedTemporaryFile(delete=False)
-            file.save(temp_file.name)
-            temp_file.close()  # Close the file before processing
-            
-            # Process the document and store embeddings
-            chunks = process_document(temp_file.name, secure_filename(file.filename))
-            vector_store.add_documents(chunks)
-            
-            # Generate sample questions based on the actual content
-            content_summary = get_answer_from_chunks(
-                "Briefly summarize the key topics and concepts in this document", 
-                chunks[:3]  # Using first few chunks to get the main topics
-            )
+            # Parse the upload straight from its spooled stream
+            chunks = iter_document_chunks(file.stream, secure_filename(file.filename))
+            chunks_count, first_chunks = index_chunks(namespaces.get(current_namespace()), chunks)
             
-            # Generate relevant questions based on the content
-            from utils.openai_utils import generate_content_specific_questions
-            sample_questions = generate_content_specific_questions(content_summary)
+            # Questions come from the stored digest, or are generated after we respond
+            digest = digests.request(first_chunks, secure_filename(file.filename))
             
             return jsonify({
                 "status": "success", 
                 "message": f"Successfully processed {file.filename}", 
-                "chunks_count": len(chunks),
-                "sample_questions": sample_questions
+                "chunks_count": chunks_count,
+                **response_fields(digest)
             })
         except Exception as e:
             logger.error(f"Error processing file: {str(e)}")
             return jsonify({"status": "error", "detail": f"Error processing file: {str(e)}"}), 500
-        finally:
-            # Clean up the temporary file
-            if temp_file and os.path.exists(temp_file.name):
-                try:
-                    os.unlink(temp_file.name)
-                except Exception as e:
-                    logger.warning(f"Could not delete temporary file: {str(e)}")
     else:
         return jsonify({"status": "error", "detail": "Only .txt and .pdf files are supported"}), 400
 
-@app.route('/ask', methods=['POST'])
+@bp.route('/ask', methods=['POST'])
 def ask_question():
     data = request.get_json()
     
@@ -122,12 +227,15 @@ def ask_question():
     question = data['question']
     logger.info(f"Received question: {question}")
     
+    namespace = current_namespace()
+    vector_store = namespaces.get(namespace)
     if not vector_store.is_initialized():
         return jsonify({"status": "error", "detail": "Please upload a document first"}), 400
     
     try:
         # Retrieve relevant chunks
-        relevant_chunks = vector_store.similarity_search(question, k=3)
+        generation = vector_store.generation
+        relevant_chunks, chunk_ids, question_embedding = vector_store.similarity_search_with_ids(question, k=3)
         
         if not relevant_chunks:
             return jsonify({
@@ -135,8 +243,31 @@ def ask_question():
                 "remaining_requests": remaining_requests
             })
         
+        # Reuse the answer to a near-identical question over the same chunks
+        cached_answer = answer_cache.lookup(namespace, generation, question_embedding, chunk_ids)
+        remember = lambda answer: answer_cache.store(namespace, generation, question_embedding, chunk_ids, answer)
+        
+        # Stream tokens as Server-Sent Events when the client asks for it.
+        # The request has already been counted against the rate limit.
+        if data.get('stream') or 'text/event-stream' in request.headers.get('Accept', ''):
+            if cached_answer is not None:
+                tokens = lambda: iter([cached_answer])
+            else:
+                tokens = lambda: stream_answer_from_chunks(question, relevant_chunks)
+            events = answer_events(
+                relevant_chunks,
+                tokens,
+                {"remaining_requests": remaining_requests},
+                on_complete=remember if cached_answer is None else None
+            )
+            return Response(events, mimetype='text/event-stream', headers=SSE_HEADERS)
+        
         # Get answer from OpenAI
-        answer = get_answer_from_chunks(question, relevant_chunks)
+        if cached_answer is not None:
+            answer = cached_answer
+        else:
+            answer = get_answer_from_chunks(question, relevant_chunks)
+            remember(answer)
         
         # Return the answer and remaining requests
         return jsonify({
@@ -148,7 +279,42 @@ def ask_question():
         logger.error(f"Error answering question: {str(e)}")
         return jsonify({"status": "error", "detail": f"Error answering question: {str(e)}"}), 500
 
-@app.route('/process-url', methods=['POST'])
+@bp.route('/ask/batch', methods=['POST'])
+def ask_batch():
+    """Answer a list of questions in one request, returning a result per question in order."""
+    questions, problem = parse_questions(request.get_json(silent=True))
+    if problem:
+        return jsonify({"status": "error", "detail": problem}), 400
+    
+    # Each question counts against the limit; a batch that does not fit is rejected whole
+    can_ask, remaining_requests = RequestLimiter.can_make_request(request, cost=len(questions))
+    if not can_ask:
+        return jsonify({
+            "status": "error",
+            "detail": f"This batch of {len(questions)} questions exceeds your remaining limit. Please try again later.",
+            "remaining_requests": RequestLimiter.get_remaining_requests(request),
+            "limit_reached": True
+        }), 429
+    
+    logger.info(f"Received a batch of {len(questions)} questions")
+    set_deadline(batch_deadline(len(questions)))
+    namespace = current_namespace()
+    vector_store = namespaces.get(namespace)
+    if not vector_store.is_initialized():
+        return jsonify({"status": "error", "detail": "Please upload a document first"}), 400
+    
+    try:
+        results = answer_questions(vector_store, namespace, questions, answer_cache)
+    except Exception as e:
+        logger.error(f"Error answering questions: {str(e)}")
+        return jsonify({"status": "error", "detail": f"Error answering questions: {str(e)}"}), 500
+    
+    return jsonify({
+        "results": results,
+        "remaining_requests": remaining_requests
+    })
+
+@bp.route('/process-url', methods=['POST'])
 def process_website_url():
     logger.info("Received URL processing request")
     
@@ -163,6 +329,26 @@ def process_website_url():
     if not is_valid_url(url):
         return jsonify({"status": "error", "detail": "Invalid URL format"}), 400
     
+    # Crawls can take minutes, so they always run as a background job
+    if data.get('crawl'):
+        try:
+            job_id = ingestion_jobs.submit_crawl(
+                current_namespace(),
+                url,
+                max_pages=clamp_option(data.get('max_pages'), CRAWL_MAX_PAGES),
+                max_depth=clamp_option(data.get('max_depth'), CRAWL_MAX_DEPTH),
+            )
+        except QueueFullError as e:
+            return jsonify({"status": "error", "detail": str(e)}), 503
+        return job_accepted(job_id)
+    
+    if wants_async(data):
+        try:
+            job_id = ingestion_jobs.submit_url(current_namespace(), url)
+        except QueueFullError as e:
+            return jsonify({"status": "error", "detail": str(e)}), 503
+        return job_accepted(job_id)
+    
     try:
         # Process the URL and get chunks
         chunks = process_url(url)
@@ -170,40 +356,88 @@ def process_website_url():
         if not chunks:
             return jsonify({"status": "error", "detail": "Failed to extract content from the URL"}), 400
         
-        # Add chunks to vector store
-        vector_store.add_documents(chunks)
-        
-        # Generate sample questions based on the actual content
-        content_summary = get_answer_from_chunks(
-            "Briefly summarize the key topics and concepts in this document", 
-            chunks[:3]  # Using first few chunks to get the main topics
-        )
+        # Add chunks to vector store, replacing any earlier version of the page
+        index_chunks(namespaces.get(current_namespace()), chunks)
         
-        # Generate relevant questions based on the content
-        from utils.openai_utils import generate_content_specific_questions
-        sample_questions = generate_content_specific_questions(content_summary)
+        # Questions come from the stored digest, or are generated after we respond
+        digest = digests.request(chunks, url)
         
         return jsonify({
             "status": "success", 
             "message": f"Successfully processed content from {url}", 
             "chunks_count": len(chunks),
-            "sample_questions": sample_questions
+            **response_fields(digest)
         })
         
     except Exception as e:
         logger.error(f"Error processing URL: {str(e)}")
         return jsonify({"status": "error", "detail": f"Error processing URL: {str(e)}"}), 500
 
-@app.route('/remaining-requests')
+@bp.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Report the progress of a background ingestion job"""
+    job = ingestion_jobs.get(job_id, namespace=current_namespace())
+    if job is None:
+        return jsonify({"status": "error", "detail": "Job not found"}), 404
+    return jsonify(job)
+
+@bp.route('/digests/<digest_id>')
+def get_digest(digest_id):
+    """Return the summary and suggested questions generated for a document"""
+    digest = digests.get(digest_id)
+    if digest is None:
+        return jsonify({"status": "error", "detail": "Digest not found"}), 404
+    return jsonify({**digest, **response_fields(digest)})
+
+@bp.route('/documents')
+def list_documents():
+    """List the sources indexed in this namespace with their chunk counts"""
+    sources = namespaces.get(current_namespace()).sources()
+    return jsonify({"documents": [{"source": source, "chunks_count": count} for source, count in sorted(sources.items())]})
+
+@bp.route('/documents', methods=['DELETE'])
+def delete_document():
+    """Delete every chunk of a source (a file name or URL) from this namespace"""
+    source = request.args.get('source', '')
+    if not source:
+        return jsonify({"status": "error", "detail": "No source provided"}), 400
+    try:
+        deleted = namespaces.get(current_namespace()).delete_source(source)
+    except Exception as e:
+        logger.error(f"Error deleting document: {str(e)}")
+        return jsonify({"status": "error", "detail": f"Error deleting document: {str(e)}"}), 500
+    if not deleted:
+        return jsonify({"status": "error", "detail": "Document not found"}), 404
+    return jsonify({"status": "success", "message": f"Deleted {source}", "chunks_deleted": deleted})
+
+@bp.route('/remaining-requests')
 def remaining_requests():
     """Get the remaining requests for the current user"""
     remaining = RequestLimiter.get_remaining_requests(request)
     return jsonify({"remaining_requests": remaining})
 
-@app.route('/health')
+@bp.app_errorhandler(413)
+def upload_too_large(e):
+    return jsonify({"status": "error", "detail": f"Upload exceeds the {UPLOAD_MAX_BYTES} byte limit"}), 413
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics for every worker on this host"""
+    return Response(metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+@bp.route('/health')
 def health_check():
+    """Liveness: the process is up and answering."""
     return jsonify({"status": "ok"})
 
+@bp.route('/ready')
+def readiness_check():
+    """Readiness: the warm-up has finished, with a breakdown of where the startup time went."""
+    report = startup.report()
+    return jsonify({"status": "ready" if report["ready"] else "starting", **report}), 200 if report["ready"] else 503
+
+app = create_app()
+
 if __name__ == '__main__':
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=5000)
\ No newline at end of file
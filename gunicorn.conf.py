@@ -0,0 +1,13 @@
+import os
+import sys
+
+# Load the app once in the master and fork workers from it, so they start warm and share
+# preloaded indexes copy-on-write. Off under --reload, which has to re-import changed code.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1" and "--reload" not in sys.argv
+
+
+def post_worker_init(worker):
+    """Start the background services in each worker, as they cannot be inherited through a fork."""
+    from utils.startup import startup
+
+    startup.start_services()
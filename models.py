@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 
 # Initialize SQLAlchemy with no app yet
@@ -14,22 +15,36 @@ class VisitorCount(db.Model):
     @classmethod
     def increment(cls):
         """Increment the visitor count"""
-        visitor_count = cls.query.first()
-        if visitor_count:
-            visitor_count.total_count += 1
-            visitor_count.last_updated = datetime.utcnow()
-        else:
-            visitor_count = cls(total_count=1)
-            db.session.add(visitor_count)
+        return cls.add(1)
+    
+    @classmethod
+    def add(cls, delta):
+        """Atomically add delta to the visitor count and return the new total.
+        
+        The increment happens in the UPDATE itself, so concurrent workers
+        never overwrite each other's counts.
+        """
+        table = cls.__table__
+        updated = db.session.execute(
+            table.update()
+            .where(table.c.id == 1)
+            .values(total_count=table.c.total_count + delta, last_updated=datetime.utcnow())
+        ).rowcount
+        if not updated:
+            try:
+                db.session.add(cls(id=1, total_count=delta))
+                db.session.commit()
+                return delta
+            except IntegrityError:
+                # Another worker created the row first
+                db.session.rollback()
+                return cls.add(delta)
         db.session.commit()
-        return visitor_count.total_count
+        return cls.get_count()
     
     @classmethod
     def get_count(cls):
         """Get the current visitor count"""
         visitor_count = cls.query.first()
-        if not visitor_count:
-            visitor_count = cls(total_count=0)
-            db.session.add(visitor_count)
-            db.session.commit()
-        return visitor_count.total_count
\ No newline at end of file
+        # The row is created by the first add(); reading never writes
+        return visitor_count.total_count if visitor_count else 0
@@ -72,12 +72,19 @@ document.addEventListener('DOMContentLoaded', function() {
         formData.append('file', file);
         
         try {
-            const response = await fetch('/upload', {
+            const response = await fetch('/upload?async=1', {
                 method: 'POST',
                 body: formData
             });
+            let data = await response.json();
+            let ok = response.ok;
             
-            // Set progress to 100% when response is received
+            // The document is ingested in the background; follow the job until it finishes
+            if (response.status === 202) {
+                ({ ok, data } = await waitForJob(data.status_url));
+            }
+            
+            // Set progress to 100% when the document is ready
             clearInterval(progressInterval);
             uploadProgress.style.width = '100%';
             
@@ -87,9 +94,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 uploadProgress.style.width = '0%';
             }, 500);
             
-            const data = await response.json();
-            
-            if (response.ok) {
+            if (ok) {
                 showUploadStatus(data.message, 'success');
                 documentUploaded = true;
                 
@@ -103,8 +108,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 // Add welcome message from Joco
                 showChatMessage('Document processed successfully! I\'m ready to answer your questions about the content.', 'bot');
                 
-                // Display sample questions
-                displaySampleQuestions(data.sample_questions);
+                // Display sample questions, once they have been generated
+                showDigestQuestions(data);
             } else {
                 showUploadStatus(data.detail || 'Upload failed.', 'danger');
             }
@@ -128,6 +133,7 @@ document.addEventListener('DOMContentLoaded', function() {
         e.preventDefault();
         
         const urlInput = document.getElementById('website-url');
+        const crawlCheckbox = document.getElementById('crawl-site');
         const url = urlInput.value.trim();
         
         if (!url) {
@@ -152,6 +158,7 @@ document.addEventListener('DOMContentLoaded', function() {
         // Progress animation with variable speed
         let progress = 0;
         let randomFactor = 1;
+        let followingJob = false;
         const progressInterval = setInterval(() => {
             // Randomize progress speed a bit to make it look more natural
             randomFactor = 0.5 + Math.random();
@@ -164,8 +171,10 @@ document.addEventListener('DOMContentLoaded', function() {
                 progress += increment;
                 uploadProgress.style.width = `${progress}%`;
                 
-                // Add "thinking" periods to the label as time passes
-                if (progress > 40 && progress < 60) {
+                // Add "thinking" periods to the label as time passes, unless the job reports real progress
+                if (followingJob) {
+                    return;
+                } else if (progress > 40 && progress < 60) {
                     progressLabel.textContent = "Analyzing content...";
                 } else if (progress > 60 && progress < 80) {
                     progressLabel.textContent = "Processing text...";
@@ -181,10 +190,18 @@ document.addEventListener('DOMContentLoaded', function() {
                 headers: {
                     'Content-Type': 'application/json'
                 },
-                body: JSON.stringify({ url })
+                body: JSON.stringify({ url, async: true, crawl: crawlCheckbox.checked })
             });
+            let data = await response.json();
+            let ok = response.ok;
+            
+            // The site is ingested in the background; follow the job until it finishes
+            if (response.status === 202) {
+                followingJob = true;
+                ({ ok, data } = await waitForJob(data.status_url));
+            }
             
-            // Set progress to 100% when response is received
+            // Set progress to 100% when the content is ready
             clearInterval(progressInterval);
             uploadProgress.style.width = '100%';
             progressLabel.textContent = "Complete!";
@@ -199,9 +216,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 }, 300);
             }, 800);
             
-            const data = await response.json();
-            
-            if (response.ok) {
+            if (ok) {
                 showUploadStatus(data.message, 'success');
                 documentUploaded = true;
                 
@@ -217,8 +232,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 // Add welcome message from Joco
                 showChatMessage(`Website content processed successfully! I've analyzed content from ${url} and I'm ready to answer your questions.`, 'bot');
                 
-                // Display sample questions with staggered animation
-                displaySampleQuestions(data.sample_questions, true);
+                // Display sample questions with staggered animation, once they have been generated
+                showDigestQuestions(data, true);
                 
                 // Check remaining requests on successful upload
                 checkRemainingRequests();
@@ -287,11 +302,19 @@ document.addEventListener('DOMContentLoaded', function() {
             const response = await fetch('/ask', {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream'
                 },
-                body: JSON.stringify({ question })
+                body: JSON.stringify({ question, stream: true })
             });
             
+            // Successful answers stream in as Server-Sent Events
+            const contentType = response.headers.get('Content-Type') || '';
+            if (response.ok && contentType.includes('text/event-stream')) {
+                await renderStreamedAnswer(response, typingIndicator);
+                return;
+            }
+            
             const data = await response.json();
             
             // Remove typing indicator after a minimum of 1 second for effect
@@ -343,6 +366,77 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
+    // Function to poll a background ingestion job until it finishes
+    async function waitForJob(statusUrl) {
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            
+            const response = await fetch(statusUrl);
+            const job = await response.json();
+            if (!response.ok) {
+                return { ok: false, data: job };
+            }
+            
+            progressLabel.textContent = describeJobProgress(job.progress || {});
+            
+            if (job.status === 'done') {
+                return { ok: true, data: job.result };
+            }
+            if (job.status === 'failed') {
+                return { ok: false, data: { detail: job.error || 'Processing failed.' } };
+            }
+        }
+    }
+    
+    // Function to show a document's sample questions, polling for them if still being generated
+    async function showDigestQuestions(data, animated = false) {
+        let questions = data.sample_questions || [];
+        if (!questions.length && data.digest_url && data.digest_status === 'pending') {
+            try {
+                while (true) {
+                    await new Promise(resolve => setTimeout(resolve, 1000));
+                    
+                    const response = await fetch(data.digest_url);
+                    if (!response.ok) {
+                        return;
+                    }
+                    const digest = await response.json();
+                    if (digest.status !== 'pending') {
+                        questions = digest.sample_questions || [];
+                        break;
+                    }
+                }
+            } catch (error) {
+                console.error('Error fetching sample questions:', error);
+                return;
+            }
+        }
+        if (questions.length) {
+            displaySampleQuestions(questions, animated);
+        }
+    }
+    
+    // Function to turn job progress into a progress bar label
+    function describeJobProgress(progress) {
+        switch (progress.stage) {
+            case 'queued':
+                return 'Waiting to start...';
+            case 'extracting':
+                if (progress.chunks_embedded) {
+                    return `Extracting and indexing (${progress.pages_extracted || 0} pages, ${progress.chunks_embedded} chunks)...`;
+                }
+                return progress.pages_extracted
+                    ? `Extracting text (${progress.pages_extracted} pages)...`
+                    : 'Extracting text...';
+            case 'crawling':
+                return `Crawling site (${progress.pages_crawled || 0} pages, ${progress.chunks_embedded || 0} chunks indexed)...`;
+            case 'embedding':
+                return `Indexing content (${progress.chunks_embedded || 0}/${progress.chunks_total || 0} chunks)...`;
+            default:
+                return 'Finalizing...';
+        }
+    }
+    
     // Function to display upload status
     function showUploadStatus(message, type) {
         uploadStatus.textContent = message;
@@ -392,6 +486,95 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Scroll to bottom
         chatContainer.scrollTop = chatContainer.scrollHeight;
+        
+        return textP;
+    }
+    
+    // Function to render an answer streamed from /ask as Server-Sent Events
+    async function renderStreamedAnswer(response, typingIndicator) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let answerText = null;
+        let sources = [];
+        
+        const removeTypingIndicator = () => {
+            if (typingIndicator && typingIndicator.parentNode) {
+                typingIndicator.parentNode.removeChild(typingIndicator);
+            }
+        };
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            // Events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const event = parseSseEvent(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+                if (!event) continue;
+                
+                if (event.type === 'sources') {
+                    sources = event.data.sources || [];
+                } else if (event.type === 'token') {
+                    // Replace the typing indicator with the answer on the first token
+                    if (!answerText) {
+                        removeTypingIndicator();
+                        answerText = showChatMessage('', 'bot');
+                    }
+                    answerText.textContent += event.data.token;
+                    chatContainer.scrollTop = chatContainer.scrollHeight;
+                } else if (event.type === 'done') {
+                    removeTypingIndicator();
+                    if (!answerText) {
+                        answerText = showChatMessage(event.data.answer, 'bot');
+                    }
+                    showSources(answerText, sources);
+                    if (event.data.remaining_requests !== undefined) {
+                        updateRemainingRequestsUI(event.data.remaining_requests);
+                    }
+                } else if (event.type === 'error') {
+                    removeTypingIndicator();
+                    showChatMessage(event.data.detail || 'Failed to get answer.', 'bot');
+                }
+            }
+        }
+        
+        removeTypingIndicator();
+    }
+    
+    // Function to parse a single Server-Sent Event block
+    function parseSseEvent(block) {
+        let type = 'message';
+        const dataLines = [];
+        block.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                type = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+        if (!dataLines.length) return null;
+        
+        try {
+            return { type, data: JSON.parse(dataLines.join('\n')) };
+        } catch (error) {
+            console.error('Malformed event:', error);
+            return null;
+        }
+    }
+    
+    // Function to list the documents an answer was drawn from
+    function showSources(answerText, sources) {
+        const names = [...new Set(sources.map(source => source.source).filter(Boolean))];
+        if (!answerText || !names.length) return;
+        
+        const sourcesLine = document.createElement('small');
+        sourcesLine.className = 'd-block mt-1 text-muted';
+        sourcesLine.textContent = `Sources: ${names.join(', ')}`;
+        answerText.parentNode.appendChild(sourcesLine);
     }
 
     // Function to display sample questions
@@ -524,6 +707,7 @@ document.addEventListener('DOMContentLoaded', function() {
             // Disable URL input
             if (urlBtn) urlBtn.disabled = true;
             const urlInput = document.getElementById('website-url');
+        const crawlCheckbox = document.getElementById('crawl-site');
             if (urlInput) urlInput.disabled = true;
             
             // Add a disabled appearance to the tab panels
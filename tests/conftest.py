@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Every store the modules create at import time goes to a scratch directory, not instance/
+_STATE_DIR = tempfile.mkdtemp(prefix="chatbot-tests-")
+for name, relative in (
+    ("CRAWL_STATE_DB", "crawl_state.db"),
+    ("DIGESTS_DB", "digests.db"),
+    ("INGESTION_JOBS_DB", "ingestion_jobs.db"),
+    ("INGESTION_SPOOL_DIR", "uploads"),
+    ("METRICS_DB", "metrics.db"),
+    ("RATE_LIMIT_DB", "rate_limits.db"),
+    ("VECTOR_STORE_NAMESPACE_DIR", "namespaces"),
+):
+    os.environ.setdefault(name, os.path.join(_STATE_DIR, relative))
+os.environ.setdefault("EMBEDDING_CACHE_PATH", "")
+os.environ.setdefault("VECTOR_STORE_SNAPSHOT_DIR", "")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_store():
+    """Factory for vector stores embedding with hashing vectors, in memory unless given a snapshot_dir.
+
+    embedder may be a provider, wrapped in an uncached pipeline, or a pipeline.
+    """
+    from utils.embedding_pipeline import EmbeddingPipeline
+    from utils.embedding_providers import HashingEmbeddingProvider
+    from utils.vector_store import VectorStore
+
+    def make(snapshot_dir=None, embedder=None, **options):
+        if not isinstance(embedder, EmbeddingPipeline):
+            embedder = EmbeddingPipeline(provider=embedder or HashingEmbeddingProvider(), use_cache=False)
+        return VectorStore(embedder=embedder, snapshot_dir=snapshot_dir, **options)
+
+    return make
+
+
+class WordCounter:
+    """Counts whitespace-separated words in place of model tokens, so budgets are easy to reason about."""
+
+    def count(self, text):
+        return len(text.split())
+
+    def truncate(self, text, tokens):
+        return " ".join(text.split()[:tokens])
+
+
+@pytest.fixture
+def make_packer():
+    """Factory for context packers that count words instead of loading a tokenizer."""
+    from utils.context_packing import ContextPacker
+
+    def make(**options):
+        return ContextPacker("gpt-4o", counter=WordCounter(), **options)
+
+    return make
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from utils.ann_index import (
+    build_index,
+    default_nlist,
+    estimate_index_bytes,
+    evaluate_index,
+    factory_string,
+    index_type_of,
+    min_training_size,
+    quantization_of,
+)
+from utils.embedding_providers import HashingEmbeddingProvider
+
+
+def clustered(count, dimension=32, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dimension)).astype(np.float32) * 4
+    return (centres[rng.integers(clusters, size=count)] + rng.normal(size=(count, dimension))).astype(np.float32)
+
+
+def test_factory_strings_follow_the_index_type_and_quantization():
+    assert factory_string("flat", 64, 1000) == "Flat"
+    assert factory_string("flat", 64, 1000, "int8") == "SQ8"
+    assert factory_string("ivf_flat", 64, 10000) == f"IVF{default_nlist(10000)},Flat"
+    assert factory_string("ivf_pq", 64, 10000) == f"IVF{default_nlist(10000)},PQ4"
+    assert factory_string("hnsw", 64, 1000, "fp16").endswith(",SQfp16")
+    with pytest.raises(ValueError):
+        factory_string("lsh", 64, 1000)
+
+
+def test_ivf_lists_stay_trainable_for_small_corpora():
+    assert default_nlist(1) == 1
+    assert default_nlist(100) * 39 <= 100
+    assert default_nlist(1_000_000) == 4000
+
+
+@pytest.mark.parametrize("index_type, quantization, recall", [
+    ("flat", "none", 1.0),
+    ("ivf_flat", "none", 0.9),
+    ("hnsw", "none", 0.9),
+    ("hnsw", "int8", 0.8),
+    ("ivf_pq", "none", 0.3),
+])
+def test_built_indexes_keep_recall_against_exact_search(index_type, quantization, recall):
+    vectors = clustered(max(2000, min_training_size(index_type, quantization)))
+    queries = clustered(50, seed=1)
+
+    index = build_index(index_type, vectors.shape[1], vectors, quantization)
+    report = evaluate_index(index, vectors, queries, k=10)
+
+    assert (report["index_type"], report["quantization"]) == (index_type, quantization)
+    assert report["vectors"] == len(vectors)
+    assert report["recall@10"] >= recall
+    assert report["bytes"] == estimate_index_bytes(index) > 0
+
+
+def test_quantized_indexes_are_smaller_than_flat():
+    vectors = clustered(2000)
+    flat = estimate_index_bytes(build_index("flat", 32, vectors))
+    assert estimate_index_bytes(build_index("flat", 32, vectors, "fp16")) == flat / 2
+    assert estimate_index_bytes(build_index("flat", 32, vectors, "int8")) == flat / 4
+
+
+def test_store_promotes_from_flat_once_it_reaches_the_threshold(make_store):
+    store = make_store(embedder=HashingEmbeddingProvider(dimension=32), index_type="hnsw", promotion_threshold=40)
+    documents = [Document(page_content=f"Entry {i} describes item{i} in the catalogue.", metadata={"source": "catalogue"}) for i in range(60)]
+
+    store.add_documents(documents[:30])
+    assert index_type_of(store.index) == "flat"
+
+    store.add_documents(documents[30:])
+    if store._promotion is not None:
+        store._promotion.join(timeout=30)
+    assert (index_type_of(store.index), quantization_of(store.index)) == ("hnsw", "none")
+    assert store.index.ntotal == 60
+    assert store.similarity_search("item42", k=1)[0].page_content == documents[42].page_content
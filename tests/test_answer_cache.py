@@ -0,0 +1,72 @@
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from utils.answer_cache import SemanticAnswerCache
+
+QUESTION = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+REPHRASED = np.array([0.99, 0.1, 0.0], dtype=np.float32)
+UNRELATED = np.array([0.0, 1.0, 0.0], dtype=np.float32)
+
+
+def test_near_identical_questions_over_the_same_chunks_hit():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store("default", "g1", QUESTION, [3, 1], "cached answer")
+
+    # Chunk order does not matter, only which chunks were retrieved
+    assert cache.lookup("default", "g1", REPHRASED, [1, 3]) == "cached answer"
+    assert cache.lookup("default", "g1", UNRELATED, [1, 3]) is None
+    assert cache.lookup("default", "g1", QUESTION, [1, 4]) is None
+    assert cache.lookup("other", "g1", QUESTION, [1, 3]) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 3
+
+
+def test_entries_expire_after_the_ttl():
+    cache = SemanticAnswerCache(ttl=60)
+    cache.store("default", "g1", QUESTION, [1], "old answer")
+    cache._entries[next(iter(cache._entries))].created_at = time.time() - 61
+
+    assert cache.lookup("default", "g1", QUESTION, [1]) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_a_new_index_generation_drops_only_that_namespaces_answers():
+    cache = SemanticAnswerCache()
+    cache.store("default", "g1", QUESTION, [1], "before the upload")
+    cache.store("other", "h1", QUESTION, [1], "other tenant")
+
+    assert cache.lookup("default", "g2", QUESTION, [1]) is None
+    assert cache.lookup("default", "g1", QUESTION, [1]) is None
+    assert cache.lookup("other", "h1", QUESTION, [1]) == "other tenant"
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_least_recently_used_answers_are_evicted():
+    cache = SemanticAnswerCache(max_entries=2)
+    cache.store("default", "g1", QUESTION, [1], "first")
+    cache.store("default", "g1", QUESTION, [2], "second")
+    cache.lookup("default", "g1", QUESTION, [1])
+    cache.store("default", "g1", QUESTION, [3], "third")
+
+    assert cache.lookup("default", "g1", QUESTION, [1]) == "first"
+    assert cache.lookup("default", "g1", QUESTION, [2]) is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_a_zero_size_cache_is_disabled():
+    cache = SemanticAnswerCache(max_entries=0)
+    cache.store("default", "g1", QUESTION, [1], "answer")
+    assert not cache.enabled
+    assert cache.lookup("default", "g1", QUESTION, [1]) is None
+
+
+def test_indexing_changes_the_store_generation(make_store):
+    store = make_store()
+    store.add_documents([Document(page_content="First version.", metadata={"source": "a"})])
+    before = store.generation
+    store.add_documents([Document(page_content="Second version.", metadata={"source": "b"})])
+    assert store.generation != before
+    after_add = store.generation
+    store.delete_source("b")
+    assert store.generation != after_add
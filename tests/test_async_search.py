@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from benchmarks.fake_openai import AsyncFakeOpenAI, FakeConfig, FakeOpenAI, fake_embedding
+from utils.embedding_pipeline import EmbeddingPipeline
+from utils.embedding_providers import OpenAIEmbeddingProvider
+
+DIMENSIONS = 16
+
+
+def fake_pipeline(config: FakeConfig, **options):
+    provider = OpenAIEmbeddingProvider(
+        client=FakeOpenAI(config), async_client=AsyncFakeOpenAI(config), model="fake", dimension=DIMENSIONS, hedge_delay=0
+    )
+    return EmbeddingPipeline(provider=provider, use_cache=False, **options)
+
+
+def test_async_embedding_runs_batches_concurrently_and_keeps_order():
+    pipeline = fake_pipeline(FakeConfig(dimensions=DIMENSIONS, embedding_latency=0.1), batch_size=4, concurrency=4)
+    texts = [f"Question {i} about the manual?" for i in range(16)]
+
+    started = time.perf_counter()
+    vectors = asyncio.run(pipeline.aembed(texts))
+
+    # Four batches of 0.1s each overlap rather than running back to back
+    assert time.perf_counter() - started < 0.3
+    np.testing.assert_allclose(vectors, [fake_embedding(text, DIMENSIONS) for text in texts], rtol=1e-5)
+
+
+def test_async_search_leaves_the_event_loop_free(make_store):
+    store = make_store(embedder=fake_pipeline(FakeConfig(dimensions=DIMENSIONS, embedding_latency=0.2)), retrieval_mode="vector")
+    store.add_documents([Document(page_content=f"Chapter {i} of the manual.", metadata={"source": "manual"}) for i in range(8)])
+    expected = store.similarity_search_with_ids("Chapter 3 of the manual.", k=2)[1]
+
+    async def run():
+        ticks = 0
+
+        async def heartbeat():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        beating = asyncio.create_task(heartbeat())
+        result = await store.asimilarity_search_with_ids("Chapter 3 of the manual.", k=2)
+        beating.cancel()
+        return result, ticks
+
+    (documents, ids, embedding), ticks = asyncio.run(run())
+
+    assert ids == expected
+    assert documents[0].page_content == "Chapter 3 of the manual."
+    assert embedding.shape == (DIMENSIONS,)
+    # The loop kept running other tasks while the query was embedded
+    assert ticks >= 10
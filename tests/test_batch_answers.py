@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.documents import Document
+
+import app as fastapi_app
+from utils import batch_answers, request_limiter
+from utils.answer_cache import SemanticAnswerCache
+from utils.batch_answers import answer_questions, batch_deadline, parse_questions
+from utils.resilience import REQUEST_DEADLINE
+
+
+@pytest.mark.parametrize("data", [None, [], {}, {"questions": []}, {"questions": "why?"}, {"questions": ["why?", "  "]}, {"questions": ["why?", 3]}])
+def test_parse_questions_rejects_malformed_bodies(data):
+    questions, problem = parse_questions(data)
+    assert questions is None
+    assert problem
+
+
+def test_parse_questions_caps_the_batch_size():
+    assert parse_questions({"questions": ["a", "b"]}, max_questions=2) == (["a", "b"], None)
+    questions, problem = parse_questions({"questions": ["a", "b", "c"]}, max_questions=2)
+    assert questions is None
+    assert "at most 2" in problem
+
+
+def test_batch_deadline_scales_with_rounds_of_completions():
+    assert batch_deadline(1, concurrency=4) == REQUEST_DEADLINE
+    assert batch_deadline(4, concurrency=4) == REQUEST_DEADLINE
+    assert batch_deadline(50, concurrency=4) == 13 * REQUEST_DEADLINE
+
+
+@pytest.fixture
+def documented_store(make_store):
+    store = make_store()
+    store.add_documents([
+        Document(page_content=f"Section {i} explains topic {i} in detail.", metadata={"source": "guide"})
+        for i in range(6)
+    ])
+    return store
+
+
+def test_answers_keep_question_order_and_isolate_failures(monkeypatch, documented_store):
+    questions = [f"What does section {i} explain?" for i in range(6)]
+    in_flight, peak = [0], [0]
+    lock = threading.Lock()
+
+    def complete(question, chunks):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        try:
+            # Later questions finish first, so completion order differs from question order
+            time.sleep(0.01 * (len(questions) - questions.index(question)))
+            if question == questions[2]:
+                raise RuntimeError("upstream failed")
+            return f"answer to {question}"
+        finally:
+            with lock:
+                in_flight[0] -= 1
+
+    monkeypatch.setattr(batch_answers, "get_answer_from_chunks", complete)
+    results = answer_questions(documented_store, "default", questions, SemanticAnswerCache(), concurrency=2)
+
+    assert [result["question"] for result in results] == questions
+    assert "upstream failed" in results[2]["error"]
+    assert "answer" not in results[2]
+    assert all(results[i]["answer"] == f"answer to {questions[i]}" for i in (0, 1, 3, 4, 5))
+    assert peak[0] <= 2
+
+
+def test_repeated_questions_are_served_from_the_answer_cache(monkeypatch, documented_store):
+    calls = []
+    monkeypatch.setattr(batch_answers, "get_answer_from_chunks", lambda question, chunks: calls.append(question) or "cached answer")
+    cache = SemanticAnswerCache()
+
+    answer_questions(documented_store, "default", ["What does section 1 explain?"], cache)
+    results = answer_questions(documented_store, "default", ["What does section 1 explain?"], cache)
+
+    assert results == [{"question": "What does section 1 explain?", "answer": "cached answer", "cached": True}]
+    assert len(calls) == 1
+
+
+def test_fastapi_batch_is_charged_one_request_per_question(monkeypatch, documented_store):
+    monkeypatch.setattr(request_limiter, "MAX_REQUESTS", 3)
+    monkeypatch.setattr(request_limiter, "_backend", request_limiter.MemoryRateLimitBackend())
+    monkeypatch.setattr(fastapi_app.namespaces, "get", lambda namespace: documented_store)
+
+    async def complete(question, chunks):
+        return "fine"
+
+    monkeypatch.setattr(batch_answers, "aget_answer_from_chunks", complete)
+    client = TestClient(fastapi_app.app)
+
+    response = client.post("/ask/batch", json={"questions": ["one?", "two?"]})
+    assert response.status_code == 200
+    assert response.json()["remaining_requests"] == 1
+
+    response = client.post("/ask/batch", json={"questions": ["three?", "four?"]})
+    assert response.status_code == 429
+    assert response.json()["limit_reached"] is True
+    assert response.json()["remaining_requests"] == 1
@@ -0,0 +1,49 @@
+import pytest
+from langchain_core.documents import Document
+
+from utils.chunk_table import ChunkTable
+
+DOCUMENTS = [
+    Document(page_content="Première partie — café ☕", metadata={"source": "a.pdf", "page": 1, "start_index": 0,
+                                                                    "chunk_id": "0123456789abcdef0123456789abcdef"}),
+    Document(page_content="", metadata={"source": "a.pdf", "page": 1, "start_index": 42,
+                                        "chunk_id": "fedcba9876543210fedcba9876543210"}),
+    # Ids and offsets that do not fit their columns stay in the shared metadata as they were
+    Document(page_content="Odd metadata", metadata={"source": "b.txt", "start_index": True, "chunk_id": "ABCDEF"}),
+    Document(page_content="Upper hex", metadata={"source": "b.txt", "start_index": -3,
+                                                 "chunk_id": "0123456789ABCDEF0123456789ABCDEF"}),
+    Document(page_content="No metadata at all", metadata={}),
+]
+
+
+def test_documents_round_trip_unchanged():
+    table = ChunkTable(DOCUMENTS)
+
+    assert len(table) == len(DOCUMENTS)
+    for stored, original in zip(table, DOCUMENTS):
+        assert stored.page_content == original.page_content
+        assert stored.metadata == original.metadata
+        assert type(stored.metadata.get("start_index")) is type(original.metadata.get("start_index"))
+    assert table[-1].metadata == {}
+    assert [document.page_content for document in table[1:3]] == ["", "Odd metadata"]
+    with pytest.raises(IndexError):
+        table[len(DOCUMENTS)]
+
+
+def test_reads_return_copies_of_the_shared_metadata():
+    table = ChunkTable(DOCUMENTS[:2])
+    table[0].metadata["page"] = 99
+
+    assert table[1].metadata["page"] == 1
+    assert len(table._metadata) == 1
+
+
+def test_chunks_survive_a_snapshot_reload(make_store, tmp_path):
+    store = make_store(snapshot_dir=str(tmp_path))
+    store.add_documents(DOCUMENTS[:4])
+
+    reloaded = make_store(snapshot_dir=str(tmp_path))
+    assert type(reloaded.documents) is not ChunkTable
+    assert len(reloaded.documents) == len(store.documents) > 0
+    assert [(d.page_content, d.metadata) for d in reloaded.documents] == \
+        [(d.page_content, d.metadata) for d in store.documents]
@@ -0,0 +1,103 @@
+import pytest
+from langchain_core.documents import Document
+
+from utils.context_packing import TokenCounter, merge_chunks
+
+
+def chunk(text, start=None, source="guide"):
+    metadata = {"source": source}
+    if start is not None:
+        metadata["start_index"] = start
+    return Document(page_content=text, metadata=metadata)
+
+
+def test_overlapping_chunks_are_merged_with_the_shared_text_once():
+    text = "alpha beta gamma delta epsilon zeta"
+    first, second = chunk(text[:16], start=0), chunk(text[11:], start=11)
+
+    (rank, passage), = merge_chunks([second, first])
+
+    assert rank == 0
+    assert passage.page_content == text
+    assert passage.metadata == {"source": "guide", "start_index": 0, "merged_chunks": 2}
+
+
+def test_adjacent_chunks_are_joined_across_the_dropped_newlines():
+    first, second = chunk("First paragraph.", start=0), chunk("Second paragraph.", start=18)
+
+    (_, passage), = merge_chunks([first, second])
+
+    assert passage.page_content == "First paragraph.\n\nSecond paragraph."
+
+
+def test_chunks_whose_text_disagrees_with_their_positions_stay_apart():
+    # Positions overlap but the text does not, as after the source was re-chunked
+    merged = merge_chunks([chunk("one two three", start=0), chunk("nine ten", start=8)])
+    assert [passage.page_content for _, passage in merged] == ["one two three", "nine ten"]
+
+
+def test_passages_keep_the_rank_of_their_best_chunk():
+    merged = merge_chunks([
+        chunk("other source", start=0, source="b"),
+        chunk("no position"),
+        chunk("first half", start=0, source="a"),
+        chunk("half and more", start=6, source="a"),
+    ])
+    assert [(rank, passage.page_content) for rank, passage in merged] == [
+        (0, "other source"),
+        (1, "no position"),
+        (2, "first half and more"),
+    ]
+
+
+def test_passages_are_added_by_relevance_while_they_fit_the_budget(make_packer):
+    packer = make_packer(budget=6, separator=" | ")
+    chunks = [
+        chunk("most relevant passage", source="a"),
+        chunk("a passage far too long to fit", source="b"),
+        chunk("short one", source="c"),
+    ]
+
+    context = packer.pack(chunks)
+
+    assert context.text == "most relevant passage | short one"
+    assert context.tokens == 6
+    assert context.tokens_saved == 8
+    assert packer.stats()["tokens_saved"] == 8
+
+
+def test_a_best_passage_over_the_budget_is_truncated(make_packer):
+    packer = make_packer(budget=3)
+
+    context = packer.pack([chunk("one two three four five")])
+
+    assert context.text == "one two three"
+    assert context.passages[0].metadata["truncated"] is True
+
+
+def test_a_zero_budget_sends_everything(make_packer):
+    packer = make_packer(budget=0)
+    context = packer.pack([chunk("one two", source="a"), chunk("three four", source="b")])
+    assert context.tokens == 4
+
+
+def test_token_counts_use_the_model_encoding():
+    tiktoken = pytest.importorskip("tiktoken")
+    try:
+        counter = TokenCounter("gpt-4o")
+    except Exception as e:
+        pytest.skip(f"encoding unavailable offline: {e}")
+    text = "Context is packed in tokens, not characters."
+    assert counter.count(text) == len(tiktoken.encoding_for_model("gpt-4o").encode(text))
+    assert counter.count(counter.truncate(text, 3)) == 3
+
+
+def test_counting_without_tiktoken_fails_loudly():
+    try:
+        import tiktoken  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        pytest.skip("tiktoken is installed")
+    with pytest.raises(ImportError, match="tiktoken is required"):
+        TokenCounter("gpt-4o")
@@ -0,0 +1,136 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils.crawler import CrawlCheckpoint, CrawlState, SiteCrawler
+from utils.document_processor import iter_site_chunks
+from utils.ingestion_jobs import index_chunks
+
+
+def article(topic: str) -> bytes:
+    paragraphs = "".join(
+        f"<p>Paragraph {i} explains how {topic} works, why it matters and what to watch out for "
+        f"when applying {topic} in practice, with a worked example for readers.</p>"
+        for i in range(8)
+    )
+    return f"<html><head><title>{topic}</title></head><body><article><h1>{topic}</h1>{paragraphs}</article></body></html>".encode()
+
+
+class Site(ThreadingHTTPServer):
+    """Pages by path, each served with an ETag unless etags is off."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SiteHandler)
+        self.pages = {}
+        self.etags = True
+        self.requests = []
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/docs/"
+
+
+class _SiteHandler(BaseHTTPRequestHandler):
+    server: Site
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("If-None-Match")))
+        body = self.server.pages.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        etag = f'"{hash(body)}"'
+        if self.server.etags and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if self.server.etags:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def site():
+    server = Site()
+    server.pages["/docs/"] = article("caching")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def state(tmp_path):
+    return CrawlState(str(tmp_path / "crawl_state.db"))
+
+
+@pytest.fixture
+def store(make_store):
+    return make_store()
+
+
+def crawler(site, state, **options) -> SiteCrawler:
+    return SiteCrawler(site.url, scope="tenant", host_delay=0, extract_workers=0, state=state, **options)
+
+
+def crawl_into(store, site, state) -> int:
+    """Crawl the site into store as an ingestion job does; returns the chunks indexed."""
+    checkpoint = CrawlCheckpoint(scope="tenant", state=state)
+    chunks = iter_site_chunks(
+        site.url, scope="tenant", checkpoint=checkpoint, state=state, indexed=store.has_source,
+        host_delay=0, extract_workers=0,
+    )
+    count, _ = index_chunks(store, chunks, on_indexed=checkpoint.indexed)
+    checkpoint.indexed(count)
+    return count
+
+
+def test_unchanged_page_is_skipped_by_etag(site, state, store):
+    assert crawl_into(store, site, state) > 0
+    assert crawl_into(store, site, state) == 0
+    # The second crawl was conditional and answered 304
+    assert site.requests[-1][1] is not None
+
+
+def test_unchanged_page_is_skipped_by_content_hash(site, state, store):
+    site.etags = False
+    assert crawl_into(store, site, state) > 0
+    second = crawler(site, state, indexed=store.has_source)
+    assert list(second.crawl()) == []
+    assert second.stats["unchanged"] == 1
+
+
+def test_validators_are_not_saved_until_indexed(site, state):
+    first = crawler(site, state)
+    assert len(list(first.crawl())) == 1
+    # Nothing was indexed, so the next crawl must fetch and yield the page again
+    assert state.get("tenant", site.url) is None
+    assert len(list(crawler(site, state).crawl())) == 1
+
+
+def test_page_is_indexed_again_after_its_source_is_deleted(site, state, store):
+    assert crawl_into(store, site, state) > 0
+    store.delete_source(site.url)
+    assert not store.has_source(site.url)
+
+    assert crawl_into(store, site, state) > 0
+    assert store.has_source(site.url)
+    # The validators of the deleted page were not sent
+    assert site.requests[-1][1] is None
+
+
+def test_oversized_page_is_skipped(site, state):
+    oversized = crawler(site, state, max_page_bytes=100)
+    assert list(oversized.crawl()) == []
+    assert oversized.stats["failed"] == 1
@@ -0,0 +1,111 @@
+import threading
+import time
+
+from langchain_core.documents import Document
+
+from utils import digests as digests_module
+from utils.digests import DigestStore, response_fields
+
+HEAD = [Document(page_content=f"Opening chunk {i} of the report.", metadata={"source": "report.pdf"}) for i in range(3)]
+
+
+class Generator:
+    """Counts digest generations; fails or blocks when told to."""
+
+    def __init__(self, fail=False):
+        self.calls = 0
+        self.fail = fail
+        self.release = threading.Event()
+        self.release.set()
+        self.lock = threading.Lock()
+
+    def __call__(self, chunks, num_questions):
+        with self.lock:
+            self.calls += 1
+        self.release.wait(5)
+        if self.fail:
+            raise RuntimeError("model unavailable")
+        return {"summary": "A report.", "questions": [f"Question {i}?" for i in range(num_questions)]}
+
+
+def settled(store, digest_id):
+    for _ in range(200):
+        digest = store.get(digest_id)
+        if digest["status"] != "pending":
+            return digest
+        time.sleep(0.01)
+    raise AssertionError("digest still pending")
+
+
+def called(generate, times):
+    for _ in range(200):
+        if generate.calls >= times:
+            return generate.calls
+        time.sleep(0.01)
+    return generate.calls
+
+
+def test_concurrent_requests_from_several_workers_generate_once(tmp_path):
+    generate = Generator()
+    generate.release.clear()
+    workers = [DigestStore(path=str(tmp_path / "digests.db"), generate=generate) for _ in range(3)]
+    results = []
+
+    threads = [threading.Thread(target=lambda w=w: results.append(w.request(HEAD, "report.pdf"))) for w in workers * 3]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    generate.release.set()
+
+    assert {digest["status"] for digest in results} == {"pending"}
+    assert len({digest["digest_id"] for digest in results}) == 1
+    assert settled(workers[0], results[0]["digest_id"])["questions"] == ["Question 0?", "Question 1?", "Question 2?"]
+    assert generate.calls == 1
+
+
+def test_a_ready_digest_is_reused_for_the_same_opening(tmp_path):
+    generate = Generator()
+    store = DigestStore(path=str(tmp_path / "digests.db"), generate=generate)
+    settled(store, store.request(HEAD, "report.pdf")["digest_id"])
+
+    again = store.request(HEAD, "copy-of-report.pdf")
+
+    assert again["status"] == "ready"
+    assert again["source"] == "report.pdf"
+    assert generate.calls == 1
+    assert store.request([], "empty.txt") is None
+
+
+def test_failed_and_abandoned_digests_are_generated_again(monkeypatch, tmp_path):
+    generate = Generator(fail=True)
+    store = DigestStore(path=str(tmp_path / "digests.db"), generate=generate)
+    failed = settled(store, store.request(HEAD, "report.pdf")["digest_id"])
+    assert failed["status"] == "failed"
+    assert "model unavailable" in failed["error"]
+
+    generate.fail = False
+    generate.release.clear()
+    assert store.request(HEAD, "report.pdf")["status"] == "pending"
+    assert called(generate, 2) == 2
+
+    # The worker generating it went away; past the stale limit another one takes over
+    monkeypatch.setattr(digests_module, "DIGEST_STALE_SECONDS", -1)
+    store.request(HEAD, "report.pdf")
+    generate.release.set()
+    assert settled(store, failed["digest_id"])["status"] == "ready"
+    assert generate.calls == 3
+
+
+def test_response_fields_follow_the_digest_status():
+    assert response_fields(None) == {"sample_questions": []}
+    pending = {"digest_id": "abc", "status": "pending", "questions": []}
+    assert response_fields(pending) == {
+        "sample_questions": [],
+        "digest_id": "abc",
+        "digest_status": "pending",
+        "digest_url": "/digests/abc",
+    }
+    ready = dict(pending, status="ready", questions=["Why?"])
+    assert response_fields(ready)["sample_questions"] == ["Why?"]
+    assert response_fields(dict(pending, status="failed"))["sample_questions"]
@@ -0,0 +1,51 @@
+import io
+
+from utils.document_processor import CHUNK_SIZE, chunk_pages, chunk_text, iter_document_chunks, read_text_file
+
+
+def pages(count=12, sentences=40):
+    return [
+        " ".join(f"Page {page} sentence {i} explains part {i} of the topic." for i in range(sentences))
+        for page in range(count)
+    ]
+
+
+def test_page_chunks_point_at_their_text_in_the_whole_document():
+    texts = pages()
+    document = "".join(page + "\n" for page in texts)
+
+    chunks = list(chunk_pages(iter(texts), "report.pdf"))
+
+    assert len(chunks) > len(texts)
+    for chunk in chunks:
+        start = chunk.metadata["start_index"]
+        assert document[start:start + len(chunk.page_content)] == chunk.page_content
+        assert len(chunk.page_content) <= CHUNK_SIZE
+        assert chunk.metadata["source"] == "report.pdf"
+    starts = [chunk.metadata["start_index"] for chunk in chunks]
+    assert starts == sorted(starts)
+    # Carried-over text is not lost: the chunks reach the end of the document
+    assert chunks[-1].metadata["start_index"] + len(chunks[-1].page_content) == len(document.rstrip())
+
+
+def test_streamed_chunks_match_chunking_the_whole_document():
+    # Short pages, so chunks span page boundaries and the carry-over is exercised
+    texts = pages(count=40, sentences=8)
+    document = "".join(page + "\n" for page in texts)
+
+    streamed = list(chunk_pages(iter(texts), "report.pdf"))
+
+    assert [(c.page_content, c.metadata) for c in streamed] == [
+        (c.page_content, c.metadata) for c in chunk_text(document, "report.pdf")
+    ]
+    assert all("\n" in chunk.page_content for chunk in streamed)
+
+
+def test_text_uploads_are_read_from_the_stream():
+    stream = io.BytesIO("Caf\xe9 menu".encode("latin-1"))
+    stream.read()
+    assert read_text_file(stream) == "Caf\xe9 menu"
+
+    upload = io.BytesIO(("Uploaded text is chunked in place. " * 100).encode())
+    chunks = list(iter_document_chunks(upload, "notes.txt"))
+    assert chunks and all(chunk.metadata["source"] == "notes.txt" for chunk in chunks)
@@ -0,0 +1,62 @@
+import sqlite3
+
+import numpy as np
+from langchain_core.documents import Document
+
+from benchmarks.fake_openai import FakeConfig, FakeOpenAI
+from utils import embedding_cache
+from utils.embedding_cache import EmbeddingCache
+from utils.embedding_pipeline import EmbeddingPipeline
+from utils.embedding_providers import OpenAIEmbeddingProvider
+
+
+def test_failed_write_is_rolled_back(tmp_path):
+    path = str(tmp_path / "embedding_cache.db")
+    cache = EmbeddingCache(path)
+    # Make inserts of large vectors fail part-way through the transaction
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TRIGGER reject_large BEFORE INSERT ON embeddings WHEN NEW.size > 64 "
+            "BEGIN SELECT RAISE(ABORT, 'too large'); END"
+        )
+
+    cache.put_many(["small", "large"], "model", [np.ones(4), np.ones(64)])
+    assert not cache._connection().in_transaction
+    assert cache.get_many(["small"], "model") == {}
+
+    # The connection is usable again for the next write
+    cache.put_many(["small"], "model", [np.ones(4)])
+    assert list(cache.get_many(["small"], "model")) == [0]
+
+
+def test_eviction_drops_the_least_recently_used_in_batches(monkeypatch, tmp_path):
+    monkeypatch.setattr(embedding_cache, "_EVICT_BATCH", 3)
+    cache = EmbeddingCache(str(tmp_path / "embedding_cache.db"))
+    texts = [f"text {i}" for i in range(20)]
+    cache.put_many(texts, "model", np.ones((20, 4)))
+    with sqlite3.connect(cache.path) as conn:
+        conn.executemany(
+            "UPDATE embeddings SET last_access = ? WHERE key = ?",
+            [(i, embedding_cache.cache_key(text, "model")) for i, text in enumerate(texts)],
+        )
+
+    # 20 vectors of 16 bytes against room for 10; eviction goes down to 9
+    cache.max_bytes = 160
+    assert cache.evict() == 11
+    assert sorted(cache.get_many(texts, "model")) == list(range(11, 20))
+    assert cache.evict() == 0
+
+
+def test_reingesting_a_document_makes_no_provider_calls(tmp_path, make_store):
+    client = FakeOpenAI(FakeConfig(dimensions=16))
+    provider = OpenAIEmbeddingProvider(client=client, model="fake", dimension=16, hedge_delay=0)
+    pipeline = EmbeddingPipeline(provider=provider, cache=EmbeddingCache(str(tmp_path / "embedding_cache.db")))
+    document = [Document(page_content=f"Section {i} of the handbook.", metadata={"source": "handbook"}) for i in range(12)]
+
+    assert make_store(embedder=pipeline).add_documents(document) == 12
+    calls = client.calls["embeddings"]
+    assert calls > 0
+
+    # A new store, as after a restart or in another namespace, gets every vector from the cache
+    assert make_store(embedder=pipeline).add_documents(document) == 12
+    assert client.calls["embeddings"] == calls
@@ -0,0 +1,45 @@
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from benchmarks.fake_openai import FakeConfig, FakeOpenAI, fake_embedding
+from utils.embedding_pipeline import EmbeddingPipeline
+from utils.embedding_providers import OpenAIEmbeddingProvider
+
+DIMENSIONS = 16
+
+
+def fake_pipeline(client: FakeOpenAI, **options) -> EmbeddingPipeline:
+    provider = OpenAIEmbeddingProvider(client=client, model="fake", dimension=DIMENSIONS, hedge_delay=0)
+    return EmbeddingPipeline(provider=provider, use_cache=False, **options)
+
+
+def chunks(count: int):
+    return [Document(page_content=f"Chunk number {i} of the manual.", metadata={"source": "manual"}) for i in range(count)]
+
+
+def test_chunks_are_embedded_in_batches_and_kept_in_order(make_store):
+    client = FakeOpenAI(FakeConfig(dimensions=DIMENSIONS))
+    store = make_store(embedder=fake_pipeline(client, batch_size=8, concurrency=4))
+    documents = chunks(40)
+
+    assert store.add_documents(documents) == 40
+    assert client.calls["embeddings"] == 5
+    for row, doc in enumerate(documents):
+        np.testing.assert_allclose(store.index.reconstruct(row), fake_embedding(doc.page_content, DIMENSIONS), rtol=1e-5)
+
+    # Chunks the store already holds are not embedded again
+    assert store.add_documents(chunks(40)) == 0
+    assert client.calls["embeddings"] == 5
+
+
+def test_batches_are_embedded_concurrently(make_store):
+    client = FakeOpenAI(FakeConfig(dimensions=DIMENSIONS, embedding_latency=0.1))
+    store = make_store(embedder=fake_pipeline(client, batch_size=4, concurrency=4))
+
+    started = time.perf_counter()
+    store.add_documents(chunks(32))
+    # Eight batches one after another would take 0.8s
+    assert client.calls["embeddings"] == 8
+    assert time.perf_counter() - started < 0.6
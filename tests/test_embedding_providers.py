@@ -0,0 +1,20 @@
+import pytest
+
+from utils.embedding_providers import EmbeddingProvider, HashingEmbeddingProvider
+
+
+class NoBatches(EmbeddingProvider):
+    model = "incomplete"
+    dimension = 8
+
+
+def test_incomplete_provider_fails_when_constructed():
+    with pytest.raises(TypeError):
+        NoBatches()
+    with pytest.raises(TypeError):
+        EmbeddingProvider()
+
+
+def test_complete_provider_embeds():
+    provider = HashingEmbeddingProvider(dimension=16)
+    assert provider.embed_batch(["a text", "another text"]).shape == (2, 16)
@@ -0,0 +1,85 @@
+import httpx
+import numpy as np
+import pytest
+from openai import OpenAI, DefaultHttpxClient
+
+from benchmarks.fake_openai import FakeConfig, fake_embedding
+from benchmarks.fault_server import FaultConfig, serve
+from utils import openai_utils, resilience
+from utils.embedding_providers import OpenAIEmbeddingProvider
+from utils.resilience import CircuitBreaker, CircuitOpenError
+
+
+@pytest.fixture
+def server():
+    server = serve(FaultConfig(retry_after=0), FakeConfig(dimensions=16))
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def client(server, monkeypatch):
+    """The app's OpenAI client pointed at the fault server, with closed circuits."""
+    options = openai_utils._client_options(httpx, DefaultHttpxClient)
+    client = OpenAI(**dict(options, api_key="test", base_url=server.base_url))
+    monkeypatch.setattr(openai_utils, "client", client)
+    monkeypatch.setitem(resilience.breakers, "chat", CircuitBreaker("chat"))
+    return client
+
+
+def ask(question="What is in the report?"):
+    return openai_utils.complete("answer", messages=[{"role": "user", "content": question}])
+
+
+def test_serves_the_fake_embeddings_and_streamed_completions(server, client):
+    provider = OpenAIEmbeddingProvider(client=client, model="fake", dimension=16)
+    vectors = provider.embed_batch(["alpha", "beta"])
+    assert np.allclose(vectors, [fake_embedding("alpha", 16), fake_embedding("beta", 16)])
+
+    answer = ask().choices[0].message.content
+    stream = client.chat.completions.create(
+        model="fake", messages=[{"role": "user", "content": "What is in the report?"}], stream=True
+    )
+    streamed = "".join(chunk.choices[0].delta.content or "" for chunk in stream if chunk.choices)
+    assert streamed.strip() == answer.strip()
+    assert server.counts == {"requests": 3, "errors": 0, "resets": 0, "slow": 0}
+
+
+def test_transient_faults_are_retried(server, client):
+    server.faults.update({"error_rate": 0.3, "reset_rate": 0.1})
+
+    for _ in range(10):
+        assert ask().choices[0].message.content
+
+    counts = server.counts
+    assert counts["errors"] + counts["resets"] > 0
+    assert counts["requests"] == 10 + counts["errors"] + counts["resets"]
+
+
+def test_an_outage_opens_the_circuit(server, client):
+    server.faults.update({"error_rate": 1.0})
+
+    with pytest.raises(Exception) as failure:
+        ask()
+    assert getattr(failure.value, "status_code", None) == 503
+    assert server.counts["requests"] == 1 + resilience.OPENAI_MAX_RETRIES
+
+    for _ in range(resilience.CIRCUIT_FAILURE_THRESHOLD):
+        try:
+            ask()
+        except Exception:
+            pass
+    reached = server.counts["requests"]
+    with pytest.raises(CircuitOpenError):
+        ask()
+    assert server.counts["requests"] == reached
+
+
+def test_faults_can_be_changed_while_running(server):
+    control = server.base_url.replace("/v1", "/_faults")
+    assert httpx.post(control, json={"error_rate": 1.0, "error_status": 429}).json()["error_rate"] == 1.0
+
+    response = httpx.post(f"{server.base_url}/embeddings", json={"model": "fake", "input": "alpha"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "0"
+    assert httpx.get(control).json()["counts"] == {"requests": 1, "errors": 1, "resets": 0, "slow": 0}
@@ -0,0 +1,93 @@
+import io
+import json
+import os
+
+import pytest
+
+from utils import ingestion_jobs
+from utils.digests import DigestStore
+from utils.ingestion_jobs import IngestionJobs, QueueFullError
+
+
+@pytest.fixture
+def make_jobs(tmp_path, make_store):
+    store = make_store()
+    digests = DigestStore(path=str(tmp_path / "digests.db"), generate=lambda chunks, n: {"summary": "s", "questions": ["q"] * n})
+
+    def make(**options):
+        options.setdefault("get_store", lambda namespace: store)
+        return IngestionJobs(
+            path=str(tmp_path / "jobs.db"), spool_dir=str(tmp_path / "uploads"), digests=digests, **options
+        )
+
+    make.store = store
+    return make
+
+
+def document(paragraphs=12):
+    return io.BytesIO("\n\n".join(f"Paragraph {i} talks about topic {i} at length. " * 8 for i in range(paragraphs)).encode())
+
+
+def test_file_job_reports_each_stage_and_deletes_its_upload(make_jobs):
+    jobs = make_jobs()
+    job_id = jobs.submit_file("default", document(), "notes.txt")
+    spool = os.path.join(jobs.spool_dir, job_id)
+    assert os.path.exists(spool)
+    assert jobs.get(job_id)["progress"] == {"stage": "queued"}
+
+    stages = []
+    update = jobs._update
+
+    def recording_update(job_id, **fields):
+        if "progress" in fields:
+            stages.append(json.loads(fields["progress"])["stage"])
+        update(job_id, **fields)
+
+    jobs._update = recording_update
+    jobs._process(jobs._claim())
+
+    job = jobs.get(job_id)
+    assert job["status"] == "done"
+    assert job["progress"]["chunks_embedded"] == job["result"]["chunks_count"] > 0
+    assert [stage for i, stage in enumerate(stages) if stage not in stages[:i]] == ["extracting", "embedding", "done"]
+    assert make_jobs.store.has_source("notes.txt")
+    assert not os.path.exists(spool)
+
+
+def test_jobs_are_only_visible_to_their_namespace(make_jobs):
+    jobs = make_jobs()
+    job_id = jobs.submit_url("tenant-a", "https://example.com")
+    assert jobs.get(job_id, "tenant-a")["kind"] == "url"
+    assert jobs.get(job_id, "tenant-b") is None
+
+
+def test_stale_jobs_are_requeued_then_failed_with_their_upload_deleted(monkeypatch, make_jobs):
+    monkeypatch.setattr(ingestion_jobs, "INGESTION_STALE_SECONDS", -1)
+    monkeypatch.setattr(ingestion_jobs, "INGESTION_MAX_ATTEMPTS", 2)
+    jobs = make_jobs()
+    job_id = jobs.submit_file("default", document(), "notes.txt")
+    spool = os.path.join(jobs.spool_dir, job_id)
+
+    # The worker that claimed it went away without reporting
+    assert jobs._claim()["id"] == job_id
+    jobs._requeue_stale()
+    assert jobs.get(job_id)["status"] == "queued"
+    assert os.path.exists(spool)
+
+    assert jobs._claim()["id"] == job_id
+    jobs._requeue_stale()
+    job = jobs.get(job_id)
+    assert job["status"] == "failed"
+    assert "repeated interruptions" in job["error"]
+    assert not os.path.exists(spool)
+
+
+def test_submissions_are_rejected_once_the_queue_is_full(make_jobs):
+    jobs = make_jobs(max_queued=1)
+    jobs.submit_url("default", "https://example.com/a")
+
+    with pytest.raises(QueueFullError):
+        jobs.submit_url("default", "https://example.com/b")
+    with pytest.raises(QueueFullError):
+        jobs.submit_file("default", document(), "notes.txt")
+    assert os.listdir(jobs.spool_dir) == []
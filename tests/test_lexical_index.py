@@ -0,0 +1,100 @@
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from utils.embedding_providers import HashingEmbeddingProvider
+from utils.lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+
+TEXTS = [
+    "The router forwards packets between networks.",
+    "A router table maps each network prefix to a next hop.",
+    "Firewalls filter packets by port and address.",
+    "Packets carry a header and a payload; the header names the router that sent them and the router it is meant for.",
+]
+
+
+def test_tokens_are_lowercased_words_without_stopwords():
+    assert tokenize("What is the Router's IPv6 address?") == ["router", "s", "ipv6", "address"]
+
+
+def test_bm25_favours_rare_terms_and_short_documents():
+    index = LexicalIndex()
+    index.add(TEXTS)
+
+    # "firewalls" appears once in the corpus, so it outweighs the common "packets"
+    assert index.search("firewalls packets", k=1) == [2]
+    # Two mentions beat one, and of the single mentions the shorter text ranks first
+    assert index.search("router", k=4) == [3, 0, 1]
+    assert index.search("quantum", k=4) == []
+    assert index.search("the of", k=4) == []
+
+
+def test_removed_rows_are_skipped_until_compacted():
+    index = LexicalIndex()
+    index.add(TEXTS)
+    index.remove([0])
+    assert 0 not in index.search("router", k=4)
+
+    compacted = index.compact(np.array([1, 2, 3]))
+    assert len(compacted) == 3
+    assert compacted.search("firewalls", k=1) == [1]
+
+
+def test_truncate_drops_rows_written_after_a_snapshot():
+    index = LexicalIndex()
+    index.add(TEXTS)
+    index.truncate(2)
+    assert len(index) == 2
+    assert index.search("firewalls", k=4) == []
+    assert index.search("router", k=4) == [0, 1]
+
+
+def test_postings_survive_a_write_and_read(tmp_path):
+    index = LexicalIndex()
+    index.add(TEXTS)
+    path = str(tmp_path / "lexical.npz")
+    index.write(path)
+
+    loaded = LexicalIndex.read(path)
+    for query in ("router", "packets header", "firewalls port"):
+        assert loaded.search(query, k=4) == index.search(query, k=4)
+
+
+def test_rank_fusion_rewards_agreement_between_rankings():
+    assert reciprocal_rank_fusion([[1, 2, 3], [2, 4, 5]]) == [2, 1, 4, 3, 5]
+    assert reciprocal_rank_fusion([[5], []]) == [5]
+
+
+class SlowQueries(HashingEmbeddingProvider):
+    """Embeds documents at once but takes its time over questions once indexing is done."""
+
+    delay = 0.0
+
+    def embed_batch(self, texts, timeout=None):
+        time.sleep(self.delay)
+        return super().embed_batch(texts, timeout)
+
+
+def test_slow_query_embeddings_fall_back_to_bm25(make_store):
+    provider = SlowQueries()
+    store = make_store(embedder=provider, query_budget=0.05)
+    store.add_documents([Document(page_content=text, metadata={"source": "net"}) for text in TEXTS])
+
+    provider.delay = 1.0
+    started = time.perf_counter()
+    results, ids, embedding = store.similarity_search_with_ids("firewalls", k=1)
+
+    assert time.perf_counter() - started < 0.5
+    assert ids == [2]
+    assert embedding.size == 0
+
+
+def test_hybrid_search_fuses_vector_and_bm25_rankings(make_store):
+    store = make_store(retrieval_mode="hybrid")
+    store.add_documents([Document(page_content=text, metadata={"source": "net"}) for text in TEXTS])
+
+    hybrid = store.similarity_search_with_ids("router table next hop", k=2)[1]
+    lexical = store.similarity_search_with_ids("router table next hop", k=2, mode="lexical")[1]
+
+    assert hybrid[0] == lexical[0] == 1
@@ -0,0 +1,86 @@
+import pytest
+
+from utils.metrics import LATENCY_BUCKETS, MemoryMetricsStore, Metrics, MetricsStore, SQLiteMetricsStore
+
+
+class AddOnly(MetricsStore):
+    def add(self, samples):
+        pass
+
+
+def test_incomplete_store_fails_when_constructed():
+    with pytest.raises(TypeError):
+        AddOnly()
+
+
+def test_workers_sharing_a_database_report_combined_totals(tmp_path):
+    path = str(tmp_path / "metrics.db")
+    first = Metrics(store=SQLiteMetricsStore(path), enabled=True)
+    second = Metrics(store=SQLiteMetricsStore(path), enabled=True)
+    first.add_collector(lambda: [("chatbot_namespaces_loaded", 2, {})])
+    second.add_collector(lambda: [("chatbot_namespaces_loaded", 3, {})])
+
+    first.inc("chatbot_openai_requests_total", operation="answer")
+    second.inc("chatbot_openai_requests_total", 2, operation="answer")
+    first.observe("chatbot_stage_duration_seconds", 0.02, stage="search")
+    second.observe("chatbot_stage_duration_seconds", 0.3, stage="search")
+    first.flush()
+    second.flush()
+
+    text = first.render()
+    assert 'chatbot_openai_requests_total{operation="answer"} 3' in text
+    assert 'chatbot_stage_duration_seconds_count{stage="search"} 2' in text
+    assert f'chatbot_namespaces_loaded{{worker="{first.worker}"}} 2' in text
+    assert f'chatbot_namespaces_loaded{{worker="{second.worker}"}} 3' in text
+
+    second.close()
+    assert second.worker not in first.render()
+
+
+def test_histograms_render_cumulative_buckets_then_sum_and_count():
+    metrics = Metrics(store=MemoryMetricsStore(), enabled=True)
+    metrics.observe("chatbot_stage_duration_seconds", 0.003, stage="embed")
+    metrics.observe("chatbot_stage_duration_seconds", 0.2, stage="embed")
+    metrics.observe("chatbot_stage_duration_seconds", 120, stage="embed")
+
+    lines = [line for line in metrics.render().splitlines() if "stage_duration" in line]
+
+    assert lines[:2] == [
+        "# HELP chatbot_stage_duration_seconds Time spent in each stage of handling a request",
+        "# TYPE chatbot_stage_duration_seconds histogram",
+    ]
+    buckets = lines[2:2 + len(LATENCY_BUCKETS) + 1]
+    assert buckets[0] == 'chatbot_stage_duration_seconds_bucket{stage="embed",le="0.001"} 0'
+    assert buckets[1] == 'chatbot_stage_duration_seconds_bucket{stage="embed",le="0.005"} 1'
+    assert 'le="0.25"} 2' in buckets[LATENCY_BUCKETS.index(0.25)]
+    assert buckets[-1] == 'chatbot_stage_duration_seconds_bucket{stage="embed",le="+Inf"} 3'
+    assert lines[-2:] == [
+        'chatbot_stage_duration_seconds_sum{stage="embed"} 120.203',
+        'chatbot_stage_duration_seconds_count{stage="embed"} 3',
+    ]
+
+
+def test_label_values_are_escaped():
+    metrics = Metrics(store=MemoryMetricsStore(), enabled=True)
+    metrics.inc("chatbot_http_requests_total", route='/say "hi"\\now')
+    assert 'route="/say \\"hi\\"\\\\now"' in metrics.render()
+
+
+def test_scrapes_between_flushes_do_not_write_to_the_store():
+    class CountingStore(MemoryMetricsStore):
+        writes = 0
+
+        def add(self, samples):
+            CountingStore.writes += 1
+            super().add(samples)
+
+    metrics = Metrics(store=CountingStore(), flush_interval=60, enabled=True)
+    metrics.inc("chatbot_http_requests_total")
+    assert "chatbot_http_requests_total 1" in metrics.render()
+
+    metrics.inc("chatbot_http_requests_total")
+    assert "chatbot_http_requests_total 1" in metrics.render()
+    assert CountingStore.writes == 1
+
+    metrics.flush()
+    assert "chatbot_http_requests_total 2" in metrics.render()
@@ -0,0 +1,72 @@
+import threading
+
+from utils.namespaces import NamespaceManager, normalize_namespace
+
+
+class StubStore:
+    def __init__(self, snapshot_dir, size=10):
+        self.snapshot_dir = snapshot_dir
+        self.size = size
+        self.saved = False
+        self.closed = False
+
+    def memory_usage(self):
+        return self.size
+
+    def refresh(self):
+        pass
+
+    def save_snapshot(self):
+        self.saved = True
+
+    def close(self):
+        self.closed = True
+
+
+def test_distinct_ids_get_distinct_directories():
+    names = {normalize_namespace(name) for name in ("tenant/a", "tenant_a", "tenant a", "x" * 64 + "1", "x" * 64 + "2")}
+    assert len(names) == 5
+    assert all("/" not in name and len(name) < 128 for name in names)
+    assert normalize_namespace("  ") == normalize_namespace(None) == "default"
+
+
+def test_slow_load_does_not_block_other_namespaces(tmp_path):
+    entered, release = threading.Event(), threading.Event()
+    loads = []
+
+    def factory(snapshot_dir):
+        loads.append(snapshot_dir)
+        if snapshot_dir.endswith(normalize_namespace("slow")):
+            entered.set()
+            release.wait(5)
+        return StubStore(snapshot_dir)
+
+    manager = NamespaceManager(spill_dir=str(tmp_path), store_factory=factory)
+    slow = [threading.Thread(target=manager.get, args=("slow",)) for _ in range(2)]
+    for thread in slow:
+        thread.start()
+    entered.wait(5)
+    # Answered while the slow namespace is still loading
+    assert manager.get("fast").snapshot_dir.endswith(normalize_namespace("fast"))
+    release.set()
+    for thread in slow:
+        thread.join()
+    # The second request for the slow namespace waited for the first load
+    assert len(loads) == 2 and manager.loads == 2
+
+
+def test_evicted_store_is_closed_and_spilled(tmp_path):
+    manager = NamespaceManager(memory_budget=15, spill_dir=str(tmp_path), store_factory=StubStore)
+    first = manager.get("first")
+    manager.get("second")
+    assert first.closed and first.saved
+    assert manager.stats()["loaded"] == 1 and manager.evictions == 1
+
+
+def test_closed_store_stops_its_snapshot_timer(make_store, tmp_path):
+    store = make_store(snapshot_dir=str(tmp_path), snapshot_mode="interval", snapshot_interval=60)
+    timer = store._timer
+    store.close()
+    assert timer.finished.is_set()
+    store._schedule_snapshot()
+    assert store._timer is timer
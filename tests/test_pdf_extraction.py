@@ -0,0 +1,49 @@
+import io
+import os
+import contextlib
+
+from benchmarks.corpus import make_pdf
+from utils import pdf_extraction
+from utils.pdf_extraction import iter_pdf_pages
+
+
+def test_large_pdf_stream_is_extracted_by_the_worker_pool(monkeypatch):
+    pages = [f"Page {i} is about extraction number {i}." for i in range(6)]
+    spooled = []
+    spooled_copy = pdf_extraction._spooled_copy
+
+    @contextlib.contextmanager
+    def recording_copy(stream):
+        with spooled_copy(stream) as path:
+            spooled.append(path)
+            yield path
+
+    monkeypatch.setattr(pdf_extraction, "_spooled_copy", recording_copy)
+    extracted = list(iter_pdf_pages(io.BytesIO(make_pdf(pages)), workers=2, pages_per_task=2))
+
+    assert [text.strip() for text in extracted] == pages
+    assert len(spooled) == 1
+    # The copy only lives while its pages are extracted
+    assert not os.path.exists(spooled[0])
+
+
+def test_small_pdf_stream_is_read_in_place(monkeypatch):
+    monkeypatch.setattr(pdf_extraction, "_spooled_copy", None)
+    extracted = list(iter_pdf_pages(io.BytesIO(make_pdf(["Only page."])), workers=2, pages_per_task=2))
+    assert [text.strip() for text in extracted] == ["Only page."]
+
+
+def test_worker_processes_keep_no_handle_on_extracted_files():
+    pages = [f"Page {i} of a spooled upload." for i in range(4)]
+    spooled = []
+    with pdf_extraction._spooled_copy(io.BytesIO(make_pdf(pages))) as path:
+        spooled.append(os.path.realpath(path))
+        assert len(list(iter_pdf_pages(path, workers=2, pages_per_task=1))) == 4
+
+    open_files = []
+    for pid in pdf_extraction._get_pool()._processes:
+        fd_dir = f"/proc/{pid}/fd"
+        for fd in os.listdir(fd_dir):
+            with contextlib.suppress(OSError):
+                open_files.append(os.readlink(os.path.join(fd_dir, fd)))
+    assert not [name for name in open_files if name.startswith(spooled[0])]
@@ -0,0 +1,22 @@
+import pytest
+
+from utils.request_limiter import MemoryRateLimitBackend, RateLimitBackend
+
+
+class CountOnly(RateLimitBackend):
+    def hit(self, key, limit, window, cost=1):
+        return True, 0.0
+
+
+def test_incomplete_backend_fails_when_constructed():
+    with pytest.raises(TypeError):
+        CountOnly()
+
+
+def test_memory_backend_limits_within_a_window():
+    backend = MemoryRateLimitBackend()
+    assert backend.hit("client", limit=2, window=60)[0]
+    assert backend.hit("client", limit=2, window=60)[0]
+    assert not backend.hit("client", limit=2, window=60)[0]
+    backend.reset("client")
+    assert backend.peek("client", window=60) == 0
@@ -0,0 +1,286 @@
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+from typing import List, Optional
+
+import httpx
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from utils import resilience
+from utils.embedding_pipeline import EmbeddingPipeline
+from utils.embedding_providers import HashingEmbeddingProvider
+from utils.resilience import (
+    REQUEST_DEADLINE,
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+    DeadlineMiddleware,
+    ahedged,
+    breakers,
+    call_timeout,
+    call_with_retries,
+    deadline,
+    hedged,
+    request_deadline,
+    time_left,
+)
+
+
+class RecordingProvider(HashingEmbeddingProvider):
+    """Hashing embeddings that note the deadline each batch saw and the thread it ran on."""
+
+    def __init__(self):
+        super().__init__(dimension=32)
+        self.seen: List[Optional[float]] = []
+        self.threads = set()
+
+    def embed_batch(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        self.seen.append(time_left())
+        self.threads.add(threading.current_thread().name)
+        return super().embed_batch(texts, timeout)
+
+
+def test_deadline_shortens_call_timeout():
+    assert call_timeout(30) == 30
+    with deadline(2):
+        assert 0 < call_timeout(30) <= 2
+        # An inner deadline can only shorten the outer one
+        with deadline(60):
+            assert call_timeout(30) <= 2
+    assert time_left() is None
+
+
+def test_expired_deadline_refuses_calls():
+    with deadline(-1):
+        with pytest.raises(DeadlineExceeded):
+            call_timeout(30)
+
+
+def test_deadline_reaches_parallel_embedding_batches():
+    provider = RecordingProvider()
+    pipeline = EmbeddingPipeline(provider=provider, batch_size=1, concurrency=4, use_cache=False)
+    with deadline(5):
+        pipeline.embed([f"text {i}" for i in range(8)])
+    assert any(name.startswith("embed") for name in provider.threads)
+    assert len(provider.seen) == 8
+    assert all(left is not None and 0 < left <= 5 for left in provider.seen)
+
+
+def test_deadline_reaches_budgeted_query_embedding(make_store):
+    provider = RecordingProvider()
+    store = make_store(embedder=provider, retrieval_mode="hybrid", query_budget=5)
+    store.add_documents([Document(page_content="A deadline bounds a request.", metadata={"source": "a"})])
+    provider.seen.clear()
+    provider.threads.clear()
+    with deadline(5):
+        store.similarity_search("what is a deadline?")
+    assert any(name.startswith("query-embed") for name in provider.threads)
+    assert provider.seen and all(left is not None for left in provider.seen)
+
+
+def test_ingestion_endpoints_have_no_overall_deadline():
+    seen = {}
+
+    async def endpoint(scope, receive, send):
+        seen[scope["path"]] = time_left()
+
+    middleware = DeadlineMiddleware(endpoint, seconds=60)
+    for path in ("/ask", "/upload", "/process-url"):
+        asyncio.run(middleware({"type": "http", "path": path}, None, None))
+    assert 0 < seen["/ask"] <= 60
+    assert seen["/upload"] is None and seen["/process-url"] is None
+    assert request_deadline("/upload") == 0
+    assert request_deadline("/ask") == REQUEST_DEADLINE
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def test_breaker_opens_after_consecutive_failures_and_fails_fast():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure(UpstreamError(503))
+    breaker.record_success()
+    # A success in between starts the count again
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure(UpstreamError(503))
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_breaker_ignores_errors_the_caller_caused():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    breaker.record_failure(UpstreamError(400))
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_breaker_lets_one_trial_through():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure(UpstreamError(503))
+    time.sleep(0.06)
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    # A failed trial opens the circuit again, a successful one closes it
+    breaker.record_failure(UpstreamError(503))
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.stats() == {"state": CircuitBreaker.CLOSED, "failures": 0, "opened": 2}
+
+
+def test_half_open_trial_answered_with_a_client_error_closes_the_circuit():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure(UpstreamError(503))
+    breaker.before_call()
+    breaker.record_failure(UpstreamError(400))
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_only_retryable_failures_are_retried():
+    calls = []
+
+    def failing(status: int):
+        def call(timeout: float):
+            calls.append(timeout)
+            raise UpstreamError(status)
+        return call
+
+    with pytest.raises(UpstreamError):
+        call_with_retries("test", failing(503), retries=2)
+    assert len(calls) == 3
+    calls.clear()
+    with pytest.raises(UpstreamError):
+        call_with_retries("test", failing(400), retries=2)
+    assert len(calls) == 1
+
+
+class BrokenStreamClient:
+    """Chat client whose streams send one token and then lose the connection."""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **params):
+        return BrokenStream()
+
+
+class BrokenStream:
+    def __iter__(self):
+        delta = SimpleNamespace(content="Partial ")
+        yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=delta)])
+        raise httpx.ReadError("Connection reset mid-stream")
+
+    def close(self):
+        pass
+
+
+def test_streams_failing_after_they_open_trip_the_breaker(monkeypatch, make_packer):
+    from utils import openai_utils
+
+    breaker = CircuitBreaker("chat", failure_threshold=2, reset_timeout=60)
+    monkeypatch.setitem(breakers, "chat", breaker)
+    monkeypatch.setattr(openai_utils, "client", BrokenStreamClient())
+    monkeypatch.setattr(openai_utils, "context_packer", make_packer())
+    chunks = [Document(page_content="Context for the answer.", metadata={"source": "a"})]
+
+    for _ in range(2):
+        with pytest.raises(httpx.ReadError):
+            list(openai_utils.stream_answer_from_chunks("Why?", chunks))
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        list(openai_utils.stream_answer_from_chunks("Why?", chunks))
+
+
+class FlakyUpstream:
+    """Answers successive calls after the given delays; a call whose outcome is an exception raises it."""
+
+    def __init__(self, *calls):
+        self.outcomes = list(calls)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            delay, outcome = self.outcomes[self.calls]
+            self.calls += 1
+        time.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def test_hedge_answers_when_the_first_request_is_slow():
+    upstream = FlakyUpstream((1.0, "first"), (0.0, "second"))
+    started = time.perf_counter()
+    assert hedged("embed", upstream, delay=0.05) == "second"
+    assert time.perf_counter() - started < 0.5
+
+
+def test_hedge_survives_a_slow_failure_of_the_first_request():
+    upstream = FlakyUpstream((0.1, httpx.ReadTimeout("timed out")), (0.2, "second"))
+    assert hedged("embed", upstream, delay=0.05) == "second"
+
+
+def test_hedge_fails_when_both_requests_fail():
+    upstream = FlakyUpstream((0.1, httpx.ReadTimeout("timed out")), (0.0, httpx.ConnectError("refused")))
+    with pytest.raises(httpx.HTTPError):
+        hedged("embed", upstream, delay=0.05)
+    assert upstream.calls == 2
+
+
+def test_fast_requests_are_not_hedged():
+    upstream = FlakyUpstream((0.0, "first"), (0.0, "second"))
+    assert hedged("embed", upstream, delay=0.5) == "first"
+    assert upstream.calls == 1
+
+
+def test_hedge_runs_inline_when_its_threads_are_busy(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    release = threading.Event()
+    # Freed eventually, so a hedge that waits for a thread fails the test instead of hanging it
+    pool.submit(release.wait, 2)
+    monkeypatch.setattr(resilience, "_hedge_pool", pool)
+    try:
+        caller = threading.current_thread().name
+        threads = []
+        started = time.perf_counter()
+        assert hedged("embed", lambda: threads.append(threading.current_thread().name) or "ok", delay=0.05) == "ok"
+        assert time.perf_counter() - started < 0.5
+        assert threads == [caller]
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_async_hedge_cancels_the_slower_request():
+    cancelled = []
+
+    async def slow_then_fast(delays=iter([1.0, 0.0])):
+        try:
+            await asyncio.sleep(next(delays))
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "answer"
+
+    async def run():
+        result = await ahedged("embed", slow_then_fast, delay=0.05)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == "answer"
+    assert cancelled == [True]
@@ -0,0 +1,103 @@
+import os
+
+import pytest
+from langchain_core.documents import Document
+
+from utils.ann_index import LayeredIndex
+from utils.snapshot import INDEX_FILE, read_manifest
+
+
+@pytest.fixture
+def snapshot_store(make_store, tmp_path):
+    def make(**options):
+        return make_store(snapshot_dir=str(tmp_path), compact_ratio=0, **options)
+    return make
+
+
+def chunks(source: str, count: int):
+    return [
+        Document(page_content=f"Chunk {i} of {source} covers topic {source}-{i}.", metadata={"source": source})
+        for i in range(count)
+    ]
+
+
+def index_file_id(directory: str):
+    stat = os.stat(os.path.join(directory, INDEX_FILE))
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def mapped_files():
+    with open("/proc/self/maps") as f:
+        return {line.split()[-1] for line in f if len(line.split()) == 6}
+
+
+def test_small_additions_append_to_the_index_delta(snapshot_store, tmp_path):
+    directory = str(tmp_path)
+    store = snapshot_store(index_delta_ratio=0.5)
+    store.add_documents(chunks("a", 8))
+    written = index_file_id(directory)
+
+    store.add_documents(chunks("b", 2))
+    store.add_documents(chunks("c", 2))
+    assert index_file_id(directory) == written
+    manifest = read_manifest(directory)
+    assert (manifest["index_count"], manifest["count"]) == (8, 12)
+
+    # A fresh worker sees every chunk and finds the ones only in the delta
+    reloaded = snapshot_store()
+    assert reloaded.index.ntotal == 12
+    assert reloaded.has_source("c")
+    assert reloaded.similarity_search("Chunk 1 of c covers topic c-1.", k=1)[0].metadata["source"] == "c"
+
+
+def test_index_is_checkpointed_once_the_delta_outgrows_its_ratio(snapshot_store, tmp_path):
+    directory = str(tmp_path)
+    store = snapshot_store(index_delta_ratio=0.5)
+    store.add_documents(chunks("a", 8))
+    store.add_documents(chunks("b", 4))
+    assert read_manifest(directory)["index_count"] == 8
+
+    store.add_documents(chunks("c", 1))
+    manifest = read_manifest(directory)
+    assert (manifest["index_count"], manifest["count"]) == (13, 13)
+    assert not [name for name in os.listdir(directory) if name.startswith("index_delta")]
+    assert snapshot_store().index.ntotal == 13
+
+
+def test_zero_ratio_rewrites_the_index_every_time(snapshot_store, tmp_path):
+    store = snapshot_store(index_delta_ratio=0)
+    store.add_documents(chunks("a", 8))
+    store.add_documents(chunks("b", 1))
+    manifest = read_manifest(str(tmp_path))
+    assert manifest["index_count"] == manifest["count"] == 9
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/maps"), reason="needs /proc to list mapped files")
+def test_snapshot_index_stays_mapped_while_rows_are_added(snapshot_store, tmp_path):
+    index_path = os.path.join(str(tmp_path), INDEX_FILE)
+    store = snapshot_store(index_delta_ratio=1)
+    store.add_documents(chunks("a", 8))
+    assert isinstance(store.index, LayeredIndex)
+    assert index_path in mapped_files()
+
+    reloaded = snapshot_store(index_delta_ratio=1)
+    reloaded.add_documents(chunks("b", 4))
+    # New rows went to the in-memory delta, leaving the mapped base as it was
+    assert (reloaded.index.base.ntotal, reloaded.index.delta.ntotal) == (8, 4)
+    assert index_path in mapped_files()
+    assert reloaded.similarity_search("Chunk 2 of b covers topic b-2.", k=1)[0].metadata["source"] == "b"
+
+
+def test_delta_keeps_the_original_vectors_of_a_quantized_index(snapshot_store, tmp_path):
+    store = snapshot_store(index_type="flat", quantization="int8", promotion_threshold=0, index_delta_ratio=1)
+    store.add_documents(chunks("a", 1000))
+    while store._promotion is not None:
+        store._promotion.join()
+    assert read_manifest(str(tmp_path))["quantization"] == "int8"
+
+    added = chunks("b", 3)
+    store.add_documents(added)
+    original = store.embedder.embed([doc.page_content for doc in added])
+    reloaded = snapshot_store(index_type="flat", quantization="int8")
+    assert reloaded.index.delta.ntotal == 3
+    assert (reloaded.index.reconstruct_n(1000, 3) == original).all()
@@ -0,0 +1,92 @@
+import os
+import threading
+
+from utils.startup import Startup
+
+
+def test_background_warm_up_is_ready_once_its_steps_finish():
+    startup = Startup()
+    release = threading.Event()
+    startup.add_step("load index", lambda: release.wait(5))
+    startup.add_imports("json")
+
+    startup.warm_up("background")
+    assert not startup.ready
+    assert not startup.wait(0.05)
+    assert startup.report()["ready_after"] is None
+
+    release.set()
+    assert startup.wait(5)
+    report = startup.report()
+    assert report["ready"] and report["ready_after"] is not None
+    assert [stage["name"] for stage in report["stages"]] == ["load index", "import json"]
+
+
+def test_failed_steps_are_recorded_without_blocking_the_rest():
+    startup = Startup()
+    ran = []
+    startup.add_step("client", lambda: 1 / 0)
+    startup.add_step("tokenizer", lambda: ran.append("tokenizer"))
+
+    startup.warm_up("sync")
+
+    assert startup.ready
+    assert ran == ["tokenizer"]
+    assert "division by zero" in startup.errors["client"]
+    assert "division by zero" in startup.report()["errors"]["client"]
+
+
+def test_off_skips_the_steps_and_warm_up_runs_once():
+    startup = Startup()
+    ran = []
+    startup.add_step("index", lambda: ran.append("index"))
+
+    startup.warm_up("off")
+    startup.warm_up("sync")
+
+    assert startup.ready
+    assert ran == []
+
+
+def test_stages_are_timed_in_order():
+    startup = Startup()
+    startup.mark("imports")
+    with startup.stage("app setup"):
+        pass
+
+    assert [name for name, _ in startup.stages] == ["imports", "app setup"]
+    assert all(seconds >= 0 for _, seconds in startup.stages)
+
+
+def test_fork_waits_for_the_warm_up():
+    startup = Startup()
+    startup.add_step("slow", lambda: threading.Event().wait(0.2))
+    startup.warm_up("background")
+
+    startup.before_fork()
+
+    assert startup.ready
+
+
+def test_services_start_once_per_process():
+    startup = Startup()
+    started = []
+    startup.add_service(lambda: started.append(os.getpid()))
+
+    startup.start_services()
+    startup.start_services()
+    assert started == [os.getpid()]
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # A forked worker starts its own services and reports as preloaded
+        startup.start_services()
+        startup.start_services()
+        os.write(write, f"{len(started)} {startup.report()['preloaded']}".encode())
+        os._exit(0)
+    os.close(write)
+    os.waitpid(pid, 0)
+    with os.fdopen(read) as f:
+        assert f.read() == "2 True"
+    assert started == [os.getpid()]
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+from langchain_core.documents import Document
+
+from utils.streaming import answer_events, sse_event
+
+CHUNKS = [Document(page_content="Streaming sends tokens as they arrive.", metadata={"source": "guide.txt"})]
+
+
+def parse(event: str):
+    """The name and JSON payload of one framed event."""
+    assert event.endswith("\n\n")
+    name, data = event[:-2].split("\n")
+    assert name.startswith("event: ") and data.startswith("data: ")
+    return name[len("event: "):], json.loads(data[len("data: "):])
+
+
+class TokenStream:
+    def __init__(self, tokens, fail_after=None):
+        self.tokens = tokens
+        self.fail_after = fail_after
+        self.closed = False
+
+    def __iter__(self):
+        for i, token in enumerate(self.tokens):
+            if i == self.fail_after:
+                raise RuntimeError("upstream dropped")
+            yield token
+
+    def close(self):
+        self.closed = True
+
+
+def test_events_are_framed_with_a_single_line_of_json():
+    event = sse_event("token", {"token": "line one\nline two"})
+    assert event == 'event: token\ndata: {"token": "line one\\nline two"}\n\n'
+    assert parse(event) == ("token", {"token": "line one\nline two"})
+
+
+def test_sources_come_first_then_tokens_then_done():
+    stream = TokenStream(["Tokens", " arrive", "."])
+    completed = []
+
+    events = [parse(event) for event in answer_events(CHUNKS, lambda: stream, {"remaining_requests": 4}, completed.append)]
+
+    assert events[0] == ("sources", {"sources": [{"source": "guide.txt", "preview": CHUNKS[0].page_content + "..."}]})
+    assert events[1:4] == [("token", {"token": "Tokens"}), ("token", {"token": " arrive"}), ("token", {"token": "."})]
+    assert events[4] == ("done", {"answer": "Tokens arrive.", "remaining_requests": 4})
+    assert completed == ["Tokens arrive."]
+    assert stream.closed
+
+
+def test_the_answer_is_only_requested_after_the_sources_are_sent():
+    opened = []
+    events = answer_events(CHUNKS, lambda: opened.append(True) or TokenStream(["ok"]))
+    assert parse(next(events))[0] == "sources"
+    assert opened == []
+    assert parse(next(events)) == ("token", {"token": "ok"})
+    assert opened == [True]
+
+
+def test_a_failed_stream_ends_with_an_error_event_and_is_not_cached():
+    stream = TokenStream(["Partial", " answer"], fail_after=1)
+    completed = []
+
+    events = [parse(event) for event in answer_events(CHUNKS, lambda: stream, on_complete=completed.append)]
+
+    assert [name for name, _ in events] == ["sources", "token", "error"]
+    assert "upstream dropped" in events[-1][1]["detail"]
+    assert completed == []
+    assert stream.closed
+
+
+def test_a_client_disconnect_closes_the_upstream_stream():
+    stream = TokenStream(["one", "two", "three"])
+    completed = []
+    events = answer_events(CHUNKS, lambda: stream, on_complete=completed.append)
+    next(events)
+    next(events)
+
+    events.close()
+
+    assert stream.closed
+    assert completed == []
+    with pytest.raises(StopIteration):
+        next(events)
@@ -0,0 +1,51 @@
+from fastapi.testclient import TestClient
+
+import app as fastapi_app
+
+
+def test_sync_upload_keys_chunks_and_digest_on_the_bare_file_name(monkeypatch, make_store):
+    store = make_store()
+    requested = []
+    monkeypatch.setattr(fastapi_app.namespaces, "get", lambda namespace: store)
+    monkeypatch.setattr(fastapi_app.digests, "request", lambda chunks, source: requested.append(source))
+
+    text = b"Uploads are indexed under their file name. " * 20
+    client = TestClient(fastapi_app.app)
+    response = client.post("/upload", files={"file": ("reports/2024/notes.txt", text, "text/plain")})
+
+    assert response.status_code == 200
+    assert response.json()["message"] == "Successfully processed notes.txt"
+    assert store.has_source("notes.txt")
+    assert requested == ["notes.txt"]
+
+
+def limited_echo(max_bytes):
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+
+    from utils.uploads import LimitUploadSize
+
+    async def echo(request):
+        return JSONResponse({"received": len(await request.body())})
+
+    return TestClient(LimitUploadSize(Starlette(routes=[Route("/upload", echo, methods=["POST"])]), max_bytes=max_bytes))
+
+
+def test_uploads_within_the_limit_reach_the_app():
+    assert limited_echo(100).post("/upload", content=b"x" * 100).json() == {"received": 100}
+
+
+def test_declared_oversized_uploads_are_rejected_before_reading():
+    response = limited_echo(100).post("/upload", content=b"x" * 101)
+    assert response.status_code == 413
+    assert "100 byte limit" in response.json()["detail"]
+
+
+def test_streamed_uploads_are_cut_off_once_over_the_limit():
+    def body():
+        for _ in range(10):
+            yield b"x" * 30
+
+    response = limited_echo(100).post("/upload", content=body())
+    assert response.status_code == 413
@@ -0,0 +1,75 @@
+from langchain_core.documents import Document
+
+from utils.ingestion_jobs import index_chunks
+
+
+def chunks(source, texts):
+    return [Document(page_content=text, metadata={"source": source}) for text in texts]
+
+
+MANUAL = [f"Manual section {i} covers feature{i} in depth." for i in range(6)]
+
+
+def finish_compaction(store):
+    if store._compaction is not None:
+        store._compaction.join(timeout=30)
+
+
+def test_chunks_already_held_are_not_added_again(make_store):
+    store = make_store()
+    assert store.add_documents(chunks("manual", MANUAL)) == 6
+    assert store.add_documents(chunks("manual", MANUAL + ["A new appendix."])) == 1
+    assert store.sources() == {"manual": 7}
+
+
+def test_reingesting_a_source_replaces_its_previous_version(make_store):
+    store = make_store(compact_ratio=0)
+    index_chunks(store, chunks("manual", MANUAL))
+
+    revised = MANUAL[:4] + ["Manual section 6 replaces the last two."]
+    count, _ = index_chunks(store, chunks("manual", revised))
+
+    assert count == 5
+    assert store.sources() == {"manual": 5}
+    assert store.live_count() == 5
+    # Only the new chunk was embedded and added; the dropped ones are tombstoned
+    assert len(store.documents) == 7
+    assert all(doc.page_content != MANUAL[5] for doc in store.similarity_search("feature5", k=5))
+
+
+def test_deleted_sources_disappear_from_search(make_store):
+    store = make_store(compact_ratio=0)
+    store.add_documents(chunks("manual", MANUAL))
+    store.add_documents(chunks("faq", ["The faq answers feature3 questions."]))
+
+    assert store.delete_source("manual") == 6
+    assert store.delete_source("manual") == 0
+    assert not store.has_source("manual")
+    assert [doc.metadata["source"] for doc in store.similarity_search("feature3", k=4)] == ["faq"]
+
+
+def test_compaction_drops_deleted_rows_from_the_index(make_store):
+    store = make_store(compact_ratio=0.5)
+    store.add_documents(chunks("manual", MANUAL))
+    store.add_documents(chunks("faq", ["The faq answers feature3 questions."]))
+    before = store.generation
+
+    store.delete_source("manual")
+    finish_compaction(store)
+
+    assert store.index.ntotal == len(store.documents) == 1
+    assert store._deleted == set()
+    assert store.generation != before
+    assert store.similarity_search("feature3", k=1)[0].metadata["source"] == "faq"
+
+
+def test_compaction_is_persisted_for_other_workers(make_store, tmp_path):
+    store = make_store(snapshot_dir=str(tmp_path), compact_ratio=0.5)
+    store.add_documents(chunks("manual", MANUAL))
+    store.add_documents(chunks("faq", ["The faq answers feature3 questions."]))
+    store.delete_source("manual")
+    finish_compaction(store)
+
+    reloaded = make_store(snapshot_dir=str(tmp_path))
+    assert reloaded.sources() == {"faq": 1}
+    assert reloaded.index.ntotal == 1
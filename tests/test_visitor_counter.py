@@ -0,0 +1,38 @@
+import time
+
+from utils.visitor_counter import VisitorCounter
+
+
+class UnavailableDatabase:
+    def __init__(self):
+        self.attempts = 0
+
+    def app_context(self):
+        self.attempts += 1
+        raise RuntimeError("database unavailable")
+
+
+def test_count_survives_a_failed_first_read():
+    counter = VisitorCounter(app=UnavailableDatabase())
+    assert counter.count() == 0
+    assert counter.increment() == 1
+    assert counter.count() == 1
+
+
+def test_visits_never_read_the_database():
+    database = UnavailableDatabase()
+    counter = VisitorCounter(app=database)
+    assert [counter.increment() for _ in range(5)] == [1, 2, 3, 4, 5]
+    assert database.attempts == 0
+
+
+def test_failed_reads_are_retried_once_per_cache_ttl():
+    database = UnavailableDatabase()
+    counter = VisitorCounter(app=database, cache_ttl=60)
+    for _ in range(5):
+        counter.count()
+    assert database.attempts == 1
+
+    counter._read_at = time.time() - 61
+    counter.count()
+    assert database.attempts == 2
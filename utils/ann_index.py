@@ -0,0 +1,297 @@
+import os
+import math
+import time
+import logging
+import numpy as np
+from typing import List, Dict, Any, Optional
+import faiss
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+QUANTIZATIONS = ("none", "fp16", "int8")
+
+# Index type the store promotes to once it is large enough
+VECTOR_INDEX_TYPE = os.environ.get("VECTOR_INDEX_TYPE", "flat")
+
+# Vector storage of the promoted index: "none" keeps float32, "fp16" halves it and
+# "int8" quarters it (scalar quantization). ivf_pq is already compressed and ignores it.
+VECTOR_QUANTIZATION = os.environ.get("VECTOR_QUANTIZATION", "none")
+
+# Number of vectors at which a flat index is rebuilt as VECTOR_INDEX_TYPE
+VECTOR_INDEX_PROMOTION_THRESHOLD = int(os.environ.get("VECTOR_INDEX_PROMOTION_THRESHOLD", "20000"))
+
+# Inverted lists probed per query for IVF indexes
+VECTOR_INDEX_NPROBE = int(os.environ.get("VECTOR_INDEX_NPROBE", "16"))
+
+# Neighbours per node and search breadth for HNSW
+VECTOR_INDEX_HNSW_M = int(os.environ.get("VECTOR_INDEX_HNSW_M", "32"))
+VECTOR_INDEX_HNSW_EF_SEARCH = int(os.environ.get("VECTOR_INDEX_HNSW_EF_SEARCH", "64"))
+
+# k-means wants roughly this many training points per inverted list
+_POINTS_PER_LIST = 39
+
+# Vectors sampled to learn the value range of each dimension for int8 codes
+_INT8_TRAINING_POINTS = 1000
+
+# FAISS encodings of each quantization
+_ENCODINGS = {"none": "Flat", "fp16": "SQfp16", "int8": "SQ8"}
+
+
+def default_nlist(count: int) -> int:
+    """Pick the number of IVF lists for a corpus of count vectors."""
+    nlist = int(4 * math.sqrt(max(count, 1)))
+    return max(1, min(nlist, count // _POINTS_PER_LIST))
+
+
+def _pq_subquantizers(dimension: int) -> int:
+    """Largest sub-quantizer count up to dimension/16 that divides the dimension."""
+    m = max(1, dimension // 16)
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def min_training_size(index_type: str, quantization: str = "none") -> int:
+    """Smallest corpus that can train the given index type."""
+    if index_type == "ivf_pq":
+        # 8-bit PQ codebooks need 256 centroids per sub-quantizer
+        return 256 * _POINTS_PER_LIST
+    minimum = _INT8_TRAINING_POINTS if quantization == "int8" else 1
+    if index_type == "ivf_flat":
+        return max(minimum, _POINTS_PER_LIST)
+    return minimum
+
+
+def factory_string(index_type: str, dimension: int, count: int, quantization: str = "none") -> str:
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization: {quantization}. Expected one of {', '.join(QUANTIZATIONS)}")
+    encoding = _ENCODINGS[quantization]
+    if index_type == "flat":
+        return encoding
+    if index_type == "ivf_flat":
+        return f"IVF{default_nlist(count)},{encoding}"
+    if index_type == "ivf_pq":
+        return f"IVF{default_nlist(count)},PQ{_pq_subquantizers(dimension)}"
+    if index_type == "hnsw":
+        return f"HNSW{VECTOR_INDEX_HNSW_M}" if quantization == "none" else f"HNSW{VECTOR_INDEX_HNSW_M},{encoding}"
+    raise ValueError(f"Unknown index type: {index_type}. Expected one of {', '.join(INDEX_TYPES)}")
+
+
+class LayeredIndex:
+    """A read-only base index plus an exact index of the rows added after it.
+
+    The base is typically memory-mapped from a snapshot, so FAISS cannot
+    add to it; new vectors go to an in-memory flat index under the row
+    numbers that follow the base, and searches merge both. The delta keeps
+    the original float32 vectors, so writing them out loses no precision
+    even when the base is quantized. The helpers in this module describe
+    a LayeredIndex by its base.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.delta = faiss.IndexIDMap2(faiss.IndexFlatL2(base.d))
+
+    @property
+    def d(self) -> int:
+        return self.base.d
+
+    @property
+    def ntotal(self) -> int:
+        return self.base.ntotal + self.delta.ntotal
+
+    def add(self, vectors: np.ndarray) -> None:
+        rows = np.arange(self.ntotal, self.ntotal + len(vectors), dtype=np.int64)
+        self.delta.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), rows)
+
+    def search(self, queries: np.ndarray, k: int, params=None):
+        distances, labels = self.base.search(queries, k, params=params)
+        if self.delta.ntotal == 0:
+            return distances, labels
+        # The delta is flat, so only the selector of the base's parameters applies to it
+        delta_params = faiss.SearchParameters(sel=params.sel) if params is not None else None
+        delta_distances, delta_labels = self.delta.search(queries, k, params=delta_params)
+        distances = np.hstack([distances, delta_distances])
+        labels = np.hstack([labels, delta_labels])
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+    def reconstruct_batch(self, rows: np.ndarray) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.int64)
+        vectors = np.empty((len(rows), self.d), dtype=np.float32)
+        in_base = rows < self.base.ntotal
+        if in_base.any():
+            vectors[in_base] = self.base.reconstruct_batch(rows[in_base])
+        if not in_base.all():
+            vectors[~in_base] = self.delta.reconstruct_batch(rows[~in_base])
+        return vectors
+
+    def reconstruct_n(self, start: int, count: int) -> np.ndarray:
+        return self.reconstruct_batch(np.arange(start, start + count, dtype=np.int64))
+
+    def reconstruct(self, row: int) -> np.ndarray:
+        return self.reconstruct_batch(np.array([row], dtype=np.int64))[0]
+
+    def merged(self):
+        """An in-memory FAISS index of the base with the delta rows added, for writing out."""
+        # Copied through a buffer; cloning or adding to a mapped index is not supported
+        index = faiss.deserialize_index(faiss.serialize_index(self.base))
+        if self.delta.ntotal:
+            index.add(self.reconstruct_n(self.base.ntotal, self.delta.ntotal))
+        configure_search(index)
+        return index
+
+
+def _described(index):
+    """The FAISS index that describes index: the base of a LayeredIndex, else index itself."""
+    return faiss.downcast_index(index.base if isinstance(index, LayeredIndex) else index)
+
+
+def configure_search(index, nprobe: int = VECTOR_INDEX_NPROBE, ef_search: int = VECTOR_INDEX_HNSW_EF_SEARCH) -> None:
+    """Apply query-time accuracy/speed knobs to an index."""
+    index = _described(index)
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    except RuntimeError:
+        pass
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = ef_search
+
+
+def search_parameters(index, selector):
+    """Per-query parameters restricting a search to ids accepted by selector.
+
+    Passing parameters overrides the index's own nprobe/efSearch, so they
+    are copied over to keep the configured accuracy.
+    """
+    inner = _described(index)
+    if isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=inner.nprobe)
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def empty_copy(index):
+    """Empty index of the same type, reusing trained structures (IVF centroids, PQ codebooks, SQ ranges)."""
+    if index_type_of(index) == "flat" and quantization_of(index) == "none":
+        return faiss.IndexFlatL2(index.d)
+    if isinstance(index, LayeredIndex):
+        # A mapped base cannot be cloned or reset, so copy it into memory first
+        copy = faiss.deserialize_index(faiss.serialize_index(index.base))
+    else:
+        copy = faiss.clone_index(index)
+    copy.reset()
+    configure_search(copy)
+    return copy
+
+
+def build_index(index_type: str, dimension: int, vectors: np.ndarray, quantization: str = "none"):
+    """Create an index of the given type, training it on vectors, and add them."""
+    description = factory_string(index_type, dimension, len(vectors), quantization)
+    started = time.perf_counter()
+    index = faiss.index_factory(dimension, description, faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(vectors)
+    if index_type in ("ivf_flat", "ivf_pq"):
+        # Keep reconstruct() available for snapshot merges and later rebuilds
+        faiss.extract_index_ivf(index).make_direct_map()
+    index.add(vectors)
+    configure_search(index)
+    logger.info(f"Built {description} index over {len(vectors)} vectors in {time.perf_counter() - started:.2f}s")
+    return index
+
+
+def index_type_of(index) -> str:
+    """Map a FAISS index back to one of INDEX_TYPES."""
+    index = _described(index)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, (faiss.IndexIVFFlat, faiss.IndexIVFScalarQuantizer)):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def quantization_of(index) -> str:
+    """Map a FAISS index's vector storage back to one of QUANTIZATIONS."""
+    index = _described(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16:
+            return "fp16"
+        if index.sq.qtype == faiss.ScalarQuantizer.QT_8bit:
+            return "int8"
+    return "none"
+
+
+def estimate_index_bytes(index) -> int:
+    """Approximate memory held by an index's vectors and search structures."""
+    if isinstance(index, LayeredIndex):
+        return estimate_index_bytes(index.base) + index.delta.ntotal * (index.d * 4 + 8)
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        return index.ntotal * (index.code_size + 8) + index.nlist * index.d * 4
+    if isinstance(index, faiss.IndexHNSW):
+        # Level 0 keeps 2*M neighbour ids per vector
+        code_size = getattr(faiss.downcast_index(index.storage), "code_size", index.d * 4)
+        return index.ntotal * (code_size + 2 * index.hnsw.nb_neighbors(1) * 4)
+    return index.ntotal * getattr(index, "code_size", index.d * 4)
+
+
+def evaluate_index(index, vectors: np.ndarray, queries: np.ndarray, k: int = 10) -> Dict[str, Any]:
+    """Measure recall@k against exact search and per-query latency for an index."""
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    latencies = []
+    found = np.empty_like(truth)
+    for i in range(len(queries)):
+        started = time.perf_counter()
+        _, labels = index.search(queries[i:i + 1], k)
+        latencies.append(time.perf_counter() - started)
+        found[i] = labels[0]
+
+    hits = sum(len(set(found[i]) & set(truth[i])) for i in range(len(queries)))
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "index_type": index_type_of(index),
+        "quantization": quantization_of(index),
+        "bytes": estimate_index_bytes(index),
+        "vectors": int(index.ntotal),
+        "k": k,
+        f"recall@{k}": hits / float(len(queries) * k),
+        "latency_ms_p50": float(np.percentile(latencies_ms, 50)),
+        "latency_ms_p99": float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def compare_index_types(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    index_types: Optional[List[str]] = None,
+    quantizations: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    """Build every index type (and quantization) over vectors and report its recall/latency/memory trade-off."""
+    reports = []
+    for index_type in index_types or INDEX_TYPES:
+        for quantization in quantizations or ["none"]:
+            if index_type == "ivf_pq" and quantization != "none":
+                continue
+            needed = min_training_size(index_type, quantization)
+            if len(vectors) < needed:
+                logger.warning(f"Skipping {index_type}/{quantization}: needs at least {needed} vectors")
+                continue
+            started = time.perf_counter()
+            index = build_index(index_type, vectors.shape[1], vectors, quantization)
+            report = evaluate_index(index, vectors, queries, k)
+            report["build_seconds"] = time.perf_counter() - started
+            reports.append(report)
+    return reports
@@ -0,0 +1,151 @@
+import os
+import time
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Sequence, Tuple
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Minimum cosine similarity between question embeddings for a cached answer to be reused
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+# Seconds a cached answer stays valid
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+
+# Maximum number of cached answers per worker; set to 0 to disable the cache
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+
+class _Entry:
+    __slots__ = ("namespace", "generation", "chunk_ids", "embedding", "answer", "created_at")
+
+    def __init__(self, namespace, generation, chunk_ids, embedding, answer, created_at):
+        self.namespace = namespace
+        self.generation = generation
+        self.chunk_ids = chunk_ids
+        self.embedding = embedding
+        self.answer = answer
+        self.created_at = created_at
+
+
+def _normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class SemanticAnswerCache:
+    """Reuse answers for near-identical questions over the same retrieved context.
+
+    An answer is served from the cache only when the new question's
+    embedding is within the similarity threshold of a cached question and
+    retrieval returned exactly the same chunks from the same index
+    generation. Entries for a namespace are dropped as soon as its index
+    changes.
+    """
+
+    def __init__(
+        self,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        # (namespace, chunk ids) -> entry keys, so a lookup only compares candidates with the same context
+        self._by_context: Dict[Tuple[str, Tuple[int, ...]], list] = {}
+        self._generations: Dict[str, str] = {}
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def lookup(self, namespace: str, generation: str, embedding, chunk_ids: Sequence[int]) -> Optional[str]:
+        """Return a cached answer for this question and context, if there is one."""
+        if not self.enabled or np.size(embedding) == 0:
+            return None
+        query = _normalize(embedding)
+        context = (namespace, tuple(sorted(chunk_ids)))
+        now = time.time()
+        with self._lock:
+            self._check_generation(namespace, generation)
+            best_key, best_score = None, self.threshold
+            for key in list(self._by_context.get(context, ())):
+                entry = self._entries[key]
+                if now - entry.created_at > self.ttl:
+                    self._remove(key)
+                    continue
+                score = float(np.dot(query, entry.embedding))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.misses += 1
+                metrics.inc("chatbot_cache_lookups_total", cache="answer", result="miss")
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            metrics.inc("chatbot_cache_lookups_total", cache="answer", result="hit")
+            return self._entries[best_key].answer
+
+    def store(self, namespace: str, generation: str, embedding, chunk_ids: Sequence[int], answer: str) -> None:
+        """Remember an answer generated for this question and context."""
+        if not self.enabled or np.size(embedding) == 0:
+            return
+        entry = _Entry(namespace, generation, tuple(sorted(chunk_ids)), _normalize(embedding), answer, time.time())
+        with self._lock:
+            self._check_generation(namespace, generation)
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = entry
+            self._by_context.setdefault((namespace, entry.chunk_ids), []).append(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _check_generation(self, namespace: str, generation: str) -> None:
+        """Drop a namespace's entries once its index has changed."""
+        previous = self._generations.get(namespace)
+        if previous == generation:
+            return
+        self._generations[namespace] = generation
+        if previous is None:
+            return
+        stale = [key for key, entry in self._entries.items() if entry.namespace == namespace]
+        for key in stale:
+            self._remove(key)
+        if stale:
+            self.invalidations += 1
+            logger.info(f"Invalidated {len(stale)} cached answers for namespace {namespace}")
+
+    def _remove(self, key: int) -> None:
+        entry = self._entries.pop(key)
+        context = (entry.namespace, entry.chunk_ids)
+        keys = self._by_context.get(context)
+        if keys is not None:
+            keys.remove(key)
+            if not keys:
+                del self._by_context[context]
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit-rate counters for this worker."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,136 @@
+import os
+import math
+import asyncio
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from .answer_cache import SemanticAnswerCache
+from .openai_utils import aget_answer_from_chunks, get_answer_from_chunks
+from .resilience import REQUEST_DEADLINE
+
+logger = logging.getLogger(__name__)
+
+# Most questions accepted in one /ask/batch request
+ASK_BATCH_MAX_QUESTIONS = int(os.environ.get("ASK_BATCH_MAX_QUESTIONS", "50"))
+
+# Answer completions a batch runs at once
+ASK_BATCH_CONCURRENCY = int(os.environ.get("ASK_BATCH_CONCURRENCY", "4"))
+
+# Chunks retrieved per question, as for /ask
+ASK_BATCH_K = 3
+
+NO_RESULTS_ANSWER = "I couldn't find any relevant information in the uploaded documents to answer your question."
+
+
+def parse_questions(data: Any, max_questions: int = ASK_BATCH_MAX_QUESTIONS) -> Tuple[Optional[List[str]], Optional[str]]:
+    """The questions of a batch request body, or None and the reason they were rejected."""
+    questions = data.get("questions") if isinstance(data, dict) else None
+    if not isinstance(questions, list) or not questions:
+        return None, "Provide the questions as a non-empty list"
+    if not all(isinstance(question, str) and question.strip() for question in questions):
+        return None, "Every question must be a non-empty string"
+    if len(questions) > max_questions:
+        return None, f"A batch holds at most {max_questions} questions"
+    return questions, None
+
+
+def batch_deadline(count: int, concurrency: int = ASK_BATCH_CONCURRENCY) -> float:
+    """Deadline of a batch of count questions: REQUEST_DEADLINE per round of concurrency completions."""
+    if REQUEST_DEADLINE <= 0:
+        return 0
+    return REQUEST_DEADLINE * math.ceil(count / max(1, concurrency))
+
+
+class _Batch:
+    """What answering each question of a batch needs besides the completion itself."""
+
+    def __init__(self, store, namespace: str, answer_cache: SemanticAnswerCache):
+        self.namespace = namespace
+        self.answer_cache = answer_cache
+        # Read before searching, so answers cached by this batch are dropped if the index changes meanwhile
+        self.generation = store.generation
+
+    def prepare(self, question: str, search) -> Tuple[Dict[str, Any], bool]:
+        """The result for a question, and whether it still needs a completion."""
+        chunks, chunk_ids, embedding = search
+        if not chunks:
+            return {"question": question, "answer": NO_RESULTS_ANSWER, "cached": False}, False
+        cached = self.answer_cache.lookup(self.namespace, self.generation, embedding, chunk_ids)
+        if cached is not None:
+            return {"question": question, "answer": cached, "cached": True}, False
+        return {"question": question, "cached": False}, True
+
+    def answered(self, result: Dict[str, Any], search, answer: str) -> Dict[str, Any]:
+        _, chunk_ids, embedding = search
+        self.answer_cache.store(self.namespace, self.generation, embedding, chunk_ids, answer)
+        result["answer"] = answer
+        return result
+
+    def failed(self, result: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+        logger.error(f"Error answering question: {str(error)}")
+        result["error"] = f"Error answering question: {str(error)}"
+        return result
+
+
+def answer_questions(
+    store,
+    namespace: str,
+    questions: List[str],
+    answer_cache: SemanticAnswerCache,
+    concurrency: int = ASK_BATCH_CONCURRENCY,
+) -> List[Dict[str, Any]]:
+    """Answer questions over one store, returning a result per question in order.
+
+    Every question is embedded in one request and searched in one FAISS
+    call. Answers not in the cache are generated with at most concurrency
+    completions in flight. A failed completion gives that question an
+    error instead of failing the batch.
+    """
+    batch = _Batch(store, namespace, answer_cache)
+    searches = store.similarity_search_batch(questions, k=ASK_BATCH_K)
+
+    def answer(question: str, search) -> Dict[str, Any]:
+        result, pending = batch.prepare(question, search)
+        if not pending:
+            return result
+        try:
+            text = get_answer_from_chunks(question, search[0])
+        except Exception as e:
+            return batch.failed(result, e)
+        return batch.answered(result, search, text)
+
+    workers = max(1, min(concurrency, len(questions)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ask-batch") as executor:
+        # Each completion runs in a copy of the request's context, so its timings reach Server-Timing
+        futures = [
+            executor.submit(contextvars.copy_context().run, answer, question, search)
+            for question, search in zip(questions, searches)
+        ]
+        return [future.result() for future in futures]
+
+
+async def aanswer_questions(
+    store,
+    namespace: str,
+    questions: List[str],
+    answer_cache: SemanticAnswerCache,
+    concurrency: int = ASK_BATCH_CONCURRENCY,
+) -> List[Dict[str, Any]]:
+    """Async variant of answer_questions."""
+    batch = _Batch(store, namespace, answer_cache)
+    searches = await store.asimilarity_search_batch(questions, k=ASK_BATCH_K)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def answer(question: str, search) -> Dict[str, Any]:
+        result, pending = batch.prepare(question, search)
+        if not pending:
+            return result
+        try:
+            async with semaphore:
+                text = await aget_answer_from_chunks(question, search[0])
+        except Exception as e:
+            return batch.failed(result, e)
+        return batch.answered(result, search, text)
+
+    return list(await asyncio.gather(*(answer(question, search) for question, search in zip(questions, searches))))
@@ -0,0 +1,110 @@
+import json
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from langchain_core.documents import Document
+
+# Metadata keys kept in per-row columns; every other key is shared by the chunks of a source
+_START_INDEX = "start_index"
+_CHUNK_ID = "chunk_id"
+
+# Chunk ids are 32 hex digits, stored as 16 bytes
+_CHUNK_ID_BYTES = 16
+
+# array typecode whose items are 32-bit signed integers
+_INT32 = "i" if array("i").itemsize == 4 else "l"
+
+
+def _pack_chunk_id(chunk_id: Any) -> Optional[bytes]:
+    """The 16 bytes of a chunk id, or None if it is not in the usual lowercase hex form."""
+    if not isinstance(chunk_id, str) or len(chunk_id) != 2 * _CHUNK_ID_BYTES:
+        return None
+    try:
+        packed = bytes.fromhex(chunk_id)
+    except ValueError:
+        return None
+    return packed if packed.hex() == chunk_id else None
+
+
+class ChunkTable:
+    """Chunks stored column-wise, building Documents only when they are read.
+
+    Texts live in one UTF-8 buffer with an array of end offsets. Chunks of
+    the same source share one metadata dict, while their start_index and
+    chunk id go in fixed-width columns. Beyond its text, a chunk costs 36
+    bytes here, where a Document held in a list costs several hundred.
+    """
+
+    def __init__(self, documents: Iterable[Document] = ()):
+        self._texts = bytearray()
+        self._text_ends = array("q")
+        self._metadata_ids = array(_INT32)
+        self._start_indexes = array("q")
+        self._chunk_ids = bytearray()
+        # Distinct shared metadata, with whether its rows have a chunk id
+        self._metadata: List[Tuple[Dict[str, Any], bool]] = []
+        self._metadata_keys: Dict[str, int] = {}
+        self.extend(documents)
+
+    def __len__(self) -> int:
+        return len(self._text_ends)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("document index out of range")
+        return Document(page_content=self.text(idx), metadata=self.metadata(idx))
+
+    def __iter__(self) -> Iterator[Document]:
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the texts plus the per-row columns."""
+        columns = (self._text_ends, self._metadata_ids, self._start_indexes)
+        return len(self._texts) + len(self._chunk_ids) + sum(len(column) * column.itemsize for column in columns)
+
+    def text(self, idx: int) -> str:
+        start = self._text_ends[idx - 1] if idx > 0 else 0
+        return self._texts[start:self._text_ends[idx]].decode("utf-8")
+
+    def metadata(self, idx: int) -> Dict[str, Any]:
+        shared, has_chunk_id = self._metadata[self._metadata_ids[idx]]
+        metadata = dict(shared)
+        if self._start_indexes[idx] >= 0:
+            metadata[_START_INDEX] = self._start_indexes[idx]
+        if has_chunk_id:
+            start = idx * _CHUNK_ID_BYTES
+            metadata[_CHUNK_ID] = self._chunk_ids[start:start + _CHUNK_ID_BYTES].hex()
+        return metadata
+
+    def _intern(self, shared: Dict[str, Any], has_chunk_id: bool) -> int:
+        key = json.dumps([shared, has_chunk_id], sort_keys=True, separators=(",", ":"))
+        metadata_id = self._metadata_keys.get(key)
+        if metadata_id is None:
+            metadata_id = self._metadata_keys[key] = len(self._metadata)
+            self._metadata.append((dict(shared), has_chunk_id))
+        return metadata_id
+
+    def append(self, document: Document) -> None:
+        metadata = document.metadata
+        start_index = metadata.get(_START_INDEX)
+        if not (type(start_index) is int and start_index >= 0):
+            start_index = -1
+        chunk_id = _pack_chunk_id(metadata.get(_CHUNK_ID))
+        shared = {
+            key: value for key, value in metadata.items()
+            if not (key == _START_INDEX and start_index >= 0 or key == _CHUNK_ID and chunk_id is not None)
+        }
+        self._texts += document.page_content.encode("utf-8")
+        self._text_ends.append(len(self._texts))
+        self._metadata_ids.append(self._intern(shared, chunk_id is not None))
+        self._start_indexes.append(start_index)
+        self._chunk_ids += chunk_id or bytes(_CHUNK_ID_BYTES)
+
+    def extend(self, documents: Iterable[Document]) -> None:
+        for document in documents:
+            self.append(document)
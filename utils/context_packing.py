@@ -0,0 +1,164 @@
+import os
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Most tokens of retrieved context sent with a question; 0 sends everything retrieved
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "3000"))
+
+# Separator between passages in the prompt
+PASSAGE_SEPARATOR = "\n\n"
+
+
+class TokenCounter:
+    """Count tokens with the model's tiktoken encoding.
+
+    The encoding file is downloaded on first use unless it is already in
+    tiktoken's cache, so create counters during warm-up rather than at import.
+    """
+
+    def __init__(self, model: str):
+        try:
+            import tiktoken
+        except ImportError as e:
+            raise ImportError("tiktoken is required to count context tokens; install it with pip install tiktoken") from e
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("o200k_base")
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, tokens: int) -> str:
+        """The longest prefix of text that fits in the given number of tokens."""
+        return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:max(0, tokens)])
+
+
+def merge_chunks(chunks: List[Document]) -> List[Tuple[int, Document]]:
+    """Merge retrieved chunks of the same source that overlap or touch.
+
+    chunks are in order of relevance. Positions come from the start_index
+    metadata set at chunking time, and an overlap is only merged when the
+    texts really agree, so stale positions cannot splice unrelated text.
+    Returns (rank of the best chunk, passage) pairs, most relevant first.
+    """
+    runs: List[Tuple[int, Document]] = []
+    by_source: Dict[str, List[Tuple[int, Document]]] = {}
+    for rank, chunk in enumerate(chunks):
+        if chunk.metadata.get("start_index") is None:
+            runs.append((rank, chunk))
+        else:
+            by_source.setdefault(chunk.metadata.get("source", ""), []).append((rank, chunk))
+
+    for source, ranked in by_source.items():
+        ranked.sort(key=lambda item: item[1].metadata["start_index"])
+        best, start, text, merged = None, 0, "", 0
+        for rank, chunk in ranked:
+            offset = chunk.metadata["start_index"] - start
+            shared = len(text) - offset
+            overlapping = 0 <= offset < len(text) and (
+                text[offset:offset + len(chunk.page_content)] == chunk.page_content[:shared]
+            )
+            if best is not None and overlapping:
+                # Overlapping (or contained); only the new tail is added
+                text += chunk.page_content[shared:]
+            elif best is not None and 0 <= -shared <= 2:
+                # Adjacent; the splitter only dropped the whitespace (at most a blank line) between them
+                text += "\n" * -shared + chunk.page_content
+            else:
+                if best is not None:
+                    runs.append((best, _passage(source, start, text, merged)))
+                best, start, text, merged = rank, chunk.metadata["start_index"], chunk.page_content, 0
+                continue
+            best, merged = min(best, rank), merged + 1
+        runs.append((best, _passage(source, start, text, merged)))
+
+    runs.sort(key=lambda item: item[0])
+    return runs
+
+
+def _passage(source: str, start: int, text: str, merged: int) -> Document:
+    return Document(page_content=text, metadata={"source": source, "start_index": start, "merged_chunks": merged + 1})
+
+
+class PackedContext:
+    __slots__ = ("text", "passages", "tokens", "tokens_saved")
+
+    def __init__(self, text: str, passages: List[Document], tokens: int, tokens_saved: int):
+        self.text = text
+        self.passages = passages
+        self.tokens = tokens
+        self.tokens_saved = tokens_saved
+
+
+class ContextPacker:
+    """Assemble retrieved chunks into prompt context under a token budget.
+
+    Overlapping and adjacent chunks of a source are merged so their shared
+    text is sent once, then passages are added in order of relevance while
+    they fit the budget. Totals of tokens sent and saved are kept for
+    reporting.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        budget: int = CONTEXT_TOKEN_BUDGET,
+        separator: str = PASSAGE_SEPARATOR,
+        counter: Optional[TokenCounter] = None,
+    ):
+        self.counter = counter or TokenCounter(model)
+        self.budget = budget
+        self.separator = separator
+        self._lock = threading.Lock()
+        self.packed = 0
+        self.tokens_sent = 0
+        self.tokens_saved = 0
+
+    def pack(self, chunks: List[Document], budget: Optional[int] = None) -> PackedContext:
+        budget = self.budget if budget is None else budget
+        count = self.counter.count
+        before = count(self.separator.join(chunk.page_content for chunk in chunks))
+
+        separator_tokens = count(self.separator)
+        selected: List[Document] = []
+        used = 0
+        for _, passage in merge_chunks(chunks):
+            cost = count(passage.page_content) + (separator_tokens if selected else 0)
+            if budget <= 0 or used + cost <= budget:
+                selected.append(passage)
+                used += cost
+            elif not selected:
+                # Even the best passage is too long; send as much of it as fits
+                text = self.counter.truncate(passage.page_content, budget)
+                selected.append(Document(page_content=text, metadata=dict(passage.metadata, truncated=True)))
+                used = count(text)
+            # Otherwise keep looking for less relevant passages that still fit
+
+        text = self.separator.join(passage.page_content for passage in selected)
+        tokens = count(text)
+        saved = max(0, before - tokens)
+        with self._lock:
+            self.packed += 1
+            self.tokens_sent += tokens
+            self.tokens_saved += saved
+        metrics.inc("chatbot_context_tokens_total", tokens, kind="sent")
+        metrics.inc("chatbot_context_tokens_total", saved, kind="saved")
+        logger.info(
+            f"Packed {len(chunks)} chunks into {len(selected)} passages: {tokens} context tokens, {saved} saved"
+        )
+        return PackedContext(text, selected, tokens, saved)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "budget": self.budget,
+                "contexts_packed": self.packed,
+                "tokens_sent": self.tokens_sent,
+                "tokens_saved": self.tokens_saved,
+            }
@@ -0,0 +1,406 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+from urllib.robotparser import RobotFileParser
+import urllib3
+
+logger = logging.getLogger(__name__)
+
+# Pages fetched from one site per crawl
+CRAWL_MAX_PAGES = int(os.environ.get("CRAWL_MAX_PAGES", "100"))
+
+# Links followed away from the start page
+CRAWL_MAX_DEPTH = int(os.environ.get("CRAWL_MAX_DEPTH", "3"))
+
+# Requests in flight at once across all hosts
+CRAWL_CONCURRENCY = int(os.environ.get("CRAWL_CONCURRENCY", "8"))
+
+# Minimum seconds between two requests to the same host
+CRAWL_HOST_DELAY = float(os.environ.get("CRAWL_HOST_DELAY", "0.5"))
+
+# Seconds before a page request is abandoned
+CRAWL_TIMEOUT = float(os.environ.get("CRAWL_TIMEOUT", "15"))
+
+# Pages larger than this many bytes (after decompression) are skipped without being read whole
+CRAWL_MAX_PAGE_BYTES = int(os.environ.get("CRAWL_MAX_PAGE_BYTES", str(5 * 1024 * 1024)))
+
+# Processes extracting text from fetched pages; 0 or 1 extracts in the fetching thread
+CRAWL_EXTRACT_WORKERS = int(os.environ.get("CRAWL_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# ETag, Last-Modified and content hash of every crawled page, for conditional re-crawls
+CRAWL_STATE_DB = os.environ.get("CRAWL_STATE_DB", os.path.join("instance", "crawl_state.db"))
+
+CRAWL_USER_AGENT = os.environ.get("CRAWL_USER_AGENT", "JocoBot/1.0 (+document Q&A crawler)")
+
+# Query parameters that only track where a visitor came from
+_TRACKING_PREFIXES = ("utm_", "mc_")
+_TRACKING_PARAMS = ("fbclid", "gclid", "ref")
+
+_SKIPPED_EXTENSIONS = (
+    ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".ico", ".css", ".js", ".zip", ".gz",
+    ".tar", ".mp3", ".mp4", ".avi", ".mov", ".woff", ".woff2", ".ttf", ".eot", ".xml", ".json",
+)
+
+
+def canonicalize_url(url: str, base: Optional[str] = None) -> Optional[str]:
+    """Normalize a URL so the same page always maps to the same string.
+
+    Resolves it against base, lowercases the scheme and host, drops default
+    ports, fragments and tracking parameters, and sorts the query. Returns
+    None for anything that is not an http(s) page.
+    """
+    if base:
+        url = urljoin(base, url.strip())
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https") or not parts.hostname:
+        return None
+    host = parts.hostname.lower()
+    port = parts.port
+    if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+    path = parts.path or "/"
+    if path.lower().endswith(_SKIPPED_EXTENSIONS):
+        return None
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(_TRACKING_PREFIXES) and key.lower() not in _TRACKING_PARAMS
+    ))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def extract_page(url: str, html: str) -> Tuple[Optional[str], List[str]]:
+    """Main text and outgoing links of a page; runs in an extraction worker."""
+    import trafilatura
+    import lxml.html
+
+    text = trafilatura.extract(html)
+    links = []
+    try:
+        document = lxml.html.fromstring(html)
+        for element in document.iter("a"):
+            href = element.get("href")
+            if href:
+                link = canonicalize_url(href, base=url)
+                if link:
+                    links.append(link)
+    except Exception as e:
+        logger.warning(f"Could not parse links from {url}: {str(e)}")
+    return text, links
+
+
+class CrawlState:
+    """Validators and links of crawled pages, kept per scope (e.g. namespace)."""
+
+    def __init__(self, path: str = CRAWL_STATE_DB):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "scope TEXT NOT NULL, "
+            "url TEXT NOT NULL, "
+            "etag TEXT, "
+            "last_modified TEXT, "
+            "content_hash TEXT, "
+            "links TEXT, "
+            "fetched_at REAL NOT NULL, "
+            "PRIMARY KEY (scope, url))"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, scope: str, url: str) -> Optional[sqlite3.Row]:
+        return self._connection().execute(
+            "SELECT * FROM pages WHERE scope = ? AND url = ?", (scope, url)
+        ).fetchone()
+
+    def put(
+        self,
+        scope: str,
+        url: str,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        content_hash: Optional[str],
+        links: List[str],
+    ) -> None:
+        self._connection().execute(
+            "INSERT OR REPLACE INTO pages (scope, url, etag, last_modified, content_hash, links, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (scope, url, etag, last_modified, content_hash, json.dumps(links), time.time()),
+        )
+
+
+class CrawledPage(NamedTuple):
+    url: str
+    depth: int
+    text: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    content_hash: Optional[str]
+    links: List[str]
+
+
+class CrawlCheckpoint:
+    """Saves the validators of crawled pages once their chunks are indexed.
+
+    Saved any earlier, they would make a page whose indexing failed look
+    unchanged to every later crawl. Pages are added in the order their
+    chunks were yielded, with the number of chunks each produced; indexed
+    takes the running count of indexed chunks, as index_chunks reports it,
+    and saves every page whose chunks are all in the store.
+    """
+
+    def __init__(self, scope: str = "", state: Optional[CrawlState] = None):
+        self.scope = scope
+        self.state = state if state is not None else CrawlState()
+        self._pending: deque = deque()
+        self._chunks = 0
+
+    def add(self, page: CrawledPage, chunks: int) -> None:
+        self._chunks += chunks
+        self._pending.append((self._chunks, page))
+
+    def indexed(self, chunks: int) -> None:
+        while self._pending and self._pending[0][0] <= chunks:
+            _, page = self._pending.popleft()
+            self.state.put(self.scope, page.url, page.etag, page.last_modified, page.content_hash, page.links)
+
+
+class _HostGate:
+    """Spaces out requests to each host by at least delay seconds."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host: str) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, 0.0))
+            self._next[host] = slot + self.delay
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+
+def _get_extract_pool(workers: int) -> ProcessPoolExecutor:
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            _extract_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _extract_pool
+
+
+class SiteCrawler:
+    """Breadth-first crawl of one site with bounded concurrency.
+
+    Pages are fetched over a shared keep-alive connection pool, no faster
+    than host_delay per host, and only below the start URL's directory.
+    Pages whose ETag/Last-Modified or extracted text are unchanged since
+    the last crawl in the same scope are not yielded again, but their
+    stored links are still followed. The validators of yielded pages are
+    saved by a CrawlCheckpoint once they are indexed; indexed, if given,
+    tells whether the store still holds a page, and the validators of
+    pages it does not (deleted sources, failed jobs) are ignored.
+    """
+
+    def __init__(
+        self,
+        start_url: str,
+        scope: str = "",
+        max_pages: int = CRAWL_MAX_PAGES,
+        max_depth: int = CRAWL_MAX_DEPTH,
+        concurrency: int = CRAWL_CONCURRENCY,
+        host_delay: float = CRAWL_HOST_DELAY,
+        timeout: float = CRAWL_TIMEOUT,
+        extract_workers: int = CRAWL_EXTRACT_WORKERS,
+        max_page_bytes: int = CRAWL_MAX_PAGE_BYTES,
+        state: Optional[CrawlState] = None,
+        indexed: Optional[Callable[[str], bool]] = None,
+        http: Optional[urllib3.PoolManager] = None,
+    ):
+        self.start_url = canonicalize_url(start_url)
+        if self.start_url is None:
+            raise ValueError(f"Cannot crawl {start_url}")
+        parts = urlsplit(self.start_url)
+        self.host = parts.netloc
+        self.prefix = f"{parts.scheme}://{parts.netloc}{parts.path[:parts.path.rfind('/') + 1]}"
+        self.scope = scope
+        self.max_pages = max(1, max_pages)
+        self.max_depth = max(0, max_depth)
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.extract_workers = extract_workers
+        self.max_page_bytes = max_page_bytes
+        self.state = state if state is not None else CrawlState()
+        self.indexed = indexed
+        self.http = http or urllib3.PoolManager(
+            num_pools=4,
+            maxsize=self.concurrency,
+            block=True,
+            headers={"User-Agent": CRAWL_USER_AGENT},
+            retries=urllib3.Retry(total=2, backoff_factor=0.5, redirect=5),
+        )
+        self._gate = _HostGate(host_delay)
+        self._robots: Optional[RobotFileParser] = None
+        self.stats = {"fetched": 0, "not_modified": 0, "unchanged": 0, "failed": 0, "disallowed": 0}
+
+    def in_scope(self, url: str) -> bool:
+        return url.startswith(self.prefix)
+
+    def _allowed(self, url: str) -> bool:
+        if self._robots is None:
+            robots = RobotFileParser()
+            try:
+                response = self.http.request(
+                    "GET", urljoin(self.start_url, "/robots.txt"), timeout=self.timeout, preload_content=True
+                )
+                robots.parse(response.data.decode("utf-8", "replace").splitlines() if response.status == 200 else [])
+            except Exception as e:
+                logger.warning(f"Could not read robots.txt for {self.host}: {str(e)}")
+                robots.parse([])
+            self._robots = robots
+        return self._robots.can_fetch(CRAWL_USER_AGENT, url)
+
+    def _read(self, response: urllib3.BaseHTTPResponse) -> Optional[bytes]:
+        """The decoded body, or None as soon as it grows past max_page_bytes."""
+        length = response.headers.get("Content-Length", "")
+        if length.isdigit() and int(length) > self.max_page_bytes:
+            return None
+        body = bytearray()
+        for block in response.stream(64 * 1024):
+            body += block
+            if len(body) > self.max_page_bytes:
+                return None
+        return bytes(body)
+
+    def _fetch(self, url: str) -> Dict[str, Any]:
+        """Fetch and extract one page; runs in a crawler thread."""
+        previous = self.state.get(self.scope, url)
+        if previous is not None and self.indexed is not None and not self.indexed(url):
+            # Unchanged or not, the page has to be indexed again
+            previous = None
+        headers = {}
+        if previous is not None:
+            if previous["etag"]:
+                headers["If-None-Match"] = previous["etag"]
+            if previous["last_modified"]:
+                headers["If-Modified-Since"] = previous["last_modified"]
+
+        self._gate.wait(self.host)
+        response = self.http.request("GET", url, headers=headers, timeout=self.timeout, preload_content=False)
+        body = None
+        try:
+            if response.status == 304 and previous is not None:
+                return {"status": "not_modified", "links": json.loads(previous["links"] or "[]")}
+            if response.status != 200:
+                return {"status": "failed", "reason": f"HTTP {response.status}", "links": []}
+            content_type = response.headers.get("Content-Type", "")
+            if "html" not in content_type and "text" not in content_type:
+                return {"status": "failed", "reason": f"unsupported content type {content_type}", "links": []}
+            body = self._read(response)
+            if body is None:
+                return {"status": "failed", "reason": f"larger than {self.max_page_bytes} bytes", "links": []}
+        finally:
+            if body is None and response.status not in (204, 304):
+                # An unread body would be left on the connection, so it is closed rather than reused
+                response.close()
+            response.release_conn()
+
+        charset = "utf-8"
+        if "charset=" in content_type:
+            charset = content_type.split("charset=")[-1].split(";")[0].strip().strip('"') or charset
+        try:
+            html = body.decode(charset, "replace")
+        except LookupError:
+            html = body.decode("utf-8", "replace")
+        if self.extract_workers > 1:
+            text, links = _get_extract_pool(self.extract_workers).submit(extract_page, url, html).result()
+        else:
+            text, links = extract_page(url, html)
+
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest() if text else None
+        if previous is not None and content_hash and previous["content_hash"] == content_hash:
+            # The store already holds this text, so the new validators can be saved straight away
+            self.state.put(self.scope, url, etag, last_modified, content_hash, links)
+            return {"status": "unchanged", "links": links}
+        return {
+            "status": "fetched", "text": text, "links": links,
+            "etag": etag, "last_modified": last_modified, "content_hash": content_hash,
+        }
+
+    def crawl(self) -> Iterator[CrawledPage]:
+        """Yield new or changed pages as soon as each one has been extracted."""
+        seen = {self.start_url}
+        frontier = deque([(self.start_url, 0)])
+        scheduled = 0
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="crawl") as executor:
+            in_flight = {}
+            while frontier or in_flight:
+                while frontier and len(in_flight) < self.concurrency and scheduled < self.max_pages:
+                    url, depth = frontier.popleft()
+                    if not self._allowed(url):
+                        self.stats["disallowed"] += 1
+                        continue
+                    in_flight[executor.submit(self._fetch, url)] = (url, depth)
+                    scheduled += 1
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, depth = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.warning(f"Failed to crawl {url}: {str(e)}")
+                        self.stats["failed"] += 1
+                        continue
+
+                    self.stats[result["status"]] += 1
+                    if depth < self.max_depth:
+                        for link in result["links"]:
+                            if link not in seen and self.in_scope(link):
+                                seen.add(link)
+                                frontier.append((link, depth + 1))
+                    if result["status"] == "failed":
+                        logger.info(f"Skipped {url}: {result['reason']}")
+                    elif result["status"] == "fetched" and result["text"] and result["text"].strip():
+                        yield CrawledPage(
+                            url, depth, result["text"], result["etag"], result["last_modified"],
+                            result["content_hash"], result["links"],
+                        )
+
+        logger.info(
+            f"Crawled {scheduled} pages from {self.prefix} in {time.perf_counter() - started:.2f}s: {self.stats}"
+        )
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from langchain_core.documents import Document
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# SQLite database holding document digests; shared by every worker on the host
+DIGESTS_DB = os.environ.get("DIGESTS_DB", os.path.join("instance", "digests.db"))
+
+# Background threads per worker process generating digests
+DIGEST_WORKERS = int(os.environ.get("DIGEST_WORKERS", "2"))
+
+# A digest still pending after this long is assumed abandoned and generated again
+DIGEST_STALE_SECONDS = float(os.environ.get("DIGEST_STALE_SECONDS", "120"))
+
+# Opening chunks of a document the digest is generated from
+DIGEST_HEAD_CHUNKS = 3
+
+
+def digest_key(chunks: List[Document], num_questions: int) -> str:
+    """Identify a digest by the text it is generated from, so identical uploads share one."""
+    digest = hashlib.sha256(str(num_questions).encode("utf-8"))
+    for chunk in chunks[:DIGEST_HEAD_CHUNKS]:
+        digest.update(b"\0")
+        digest.update(chunk.page_content.encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+class DigestStore:
+    """Summaries and suggested questions generated once per document.
+
+    Digests are requested when a document is indexed and generated by a
+    small thread pool, so uploads return without waiting on the LLM. The
+    result is kept in SQLite under a hash of the document's opening text;
+    uploading the same document again finds it there and costs no calls.
+    """
+
+    def __init__(
+        self,
+        path: str = DIGESTS_DB,
+        generate: Optional[Callable[[List[Document], int], Dict[str, Any]]] = None,
+        num_questions: int = 3,
+        workers: int = DIGEST_WORKERS,
+    ):
+        self.path = path
+        self.generate = generate
+        self.num_questions = num_questions
+        self.workers = max(1, workers)
+        self._local = threading.local()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS digests ("
+            "key TEXT PRIMARY KEY, "
+            "source TEXT NOT NULL, "
+            "summary TEXT, "
+            "questions TEXT, "
+            "status TEXT NOT NULL, "
+            "error TEXT, "
+            "created_at REAL NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="digest")
+            return self._pool
+
+    def request(self, chunks: List[Document], source: str) -> Optional[Dict[str, Any]]:
+        """Return the digest of a document, starting its generation if there is none yet.
+
+        Only one worker generates a given digest; a failed one, or one whose
+        worker went away, is tried again by the next request.
+        """
+        head = chunks[:DIGEST_HEAD_CHUNKS]
+        if not head:
+            return None
+        key = digest_key(head, self.num_questions)
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT * FROM digests WHERE key = ?", (key,)).fetchone()
+            claim = row is None or row["status"] == "failed" or (
+                row["status"] == "pending" and row["updated_at"] < now - DIGEST_STALE_SECONDS
+            )
+            if claim:
+                conn.execute(
+                    "INSERT OR REPLACE INTO digests (key, source, status, created_at, updated_at) "
+                    "VALUES (?, ?, 'pending', ?, ?)",
+                    (key, source, row["created_at"] if row is not None else now, now),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        metrics.inc("chatbot_cache_lookups_total", cache="digest", result="miss" if claim else "hit")
+        if not claim:
+            logger.info(f"Reusing {row['status']} digest {key} for {source}")
+            return self.get(key)
+        self._get_pool().submit(self._generate, key, head, source)
+        return self.get(key)
+
+    def _generate(self, key: str, chunks: List[Document], source: str) -> None:
+        generate = self.generate
+        if generate is None:
+            from .openai_utils import generate_document_digest as generate
+        start = time.time()
+        try:
+            digest = generate(chunks, self.num_questions)
+            self._update(key, status="ready", summary=digest["summary"], questions=json.dumps(digest["questions"]), error=None)
+            logger.info(f"Generated digest {key} for {source} in {time.time() - start:.2f}s")
+        except Exception as e:
+            logger.error(f"Error generating digest for {source}: {str(e)}")
+            self._update(key, status="failed", error=str(e))
+
+    def _update(self, key: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._connection().execute(f"UPDATE digests SET {assignments} WHERE key = ?", (*fields.values(), key))
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute("SELECT * FROM digests WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "digest_id": row["key"],
+            "source": row["source"],
+            "status": row["status"],
+            "summary": row["summary"],
+            "questions": json.loads(row["questions"]) if row["questions"] else [],
+            "error": row["error"],
+            "updated_at": row["updated_at"],
+        }
+
+
+def response_fields(digest: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Fields added to an ingestion response so the client can show or poll for questions."""
+    if digest is None:
+        # Nothing new was indexed, so there is nothing to ask about
+        return {"sample_questions": []}
+    if digest["status"] == "ready":
+        questions = digest["questions"]
+    elif digest["status"] == "failed":
+        from .openai_utils import FALLBACK_QUESTIONS
+        questions = list(FALLBACK_QUESTIONS)
+    else:
+        questions = []
+    return {
+        "sample_questions": questions,
+        "digest_id": digest["digest_id"],
+        "digest_status": digest["status"],
+        "digest_url": f"/digests/{digest['digest_id']}",
+    }
@@ -2,52 +2,74 @@ import os
 import logging
 import tempfile
 import re
-from typing import List, Optional
-import PyPDF2
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.schema import Document
+from typing import TYPE_CHECKING, BinaryIO, Callable, Iterator, List, Optional, Union
+from langchain_core.documents import Document
 from utils.web_scraper import get_website_text_content
+from utils.pdf_extraction import iter_pdf_pages
+from utils.crawler import CrawlCheckpoint, SiteCrawler
+from utils.metrics import timed, timed_iter
+
+if TYPE_CHECKING:
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# Splitter settings shared by whole-text and streamed chunking
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
 
 logger = logging.getLogger(__name__)
 
-def read_pdf_file(file_path: str) -> str:
-    """Extract text from a PDF file."""
-    logger.info(f"Reading PDF file: {file_path}")
-    text = ""
+def read_pdf_file(source: Union[str, BinaryIO], on_page: Optional[Callable[[int], None]] = None) -> str:
+    """Extract text from a PDF file path or binary stream.
+    
+    on_page, if given, is called with the number of pages extracted so far.
+    Prefer iter_document_chunks for large files; this holds the whole text.
+    """
+    logger.info(f"Reading PDF file: {getattr(source, 'name', source)}")
     try:
-        with open(file_path, "rb") as f:
-            pdf_reader = PyPDF2.PdfReader(f)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
+        return "".join(text + "\n" for text in iter_pdf_pages(source, on_page=on_page))
     except Exception as e:
         logger.error(f"Error reading PDF file: {str(e)}")
         raise e
-    return text
 
-def read_text_file(file_path: str) -> str:
-    """Read a text file."""
-    logger.info(f"Reading text file: {file_path}")
+def decode_text(data: bytes) -> str:
+    """Decode uploaded text, falling back to latin-1 when it is not utf-8."""
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
+        return data.decode("utf-8")
     except UnicodeDecodeError:
         # Try different encoding if utf-8 fails
-        with open(file_path, "r", encoding="latin-1") as f:
-            return f.read()
+        return data.decode("latin-1")
+
+def read_text_file(source: Union[str, BinaryIO]) -> str:
+    """Read a text file from a path or binary stream."""
+    logger.info(f"Reading text file: {getattr(source, 'name', source)}")
+    try:
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                return decode_text(f.read())
+        source.seek(0)
+        return decode_text(source.read())
     except Exception as e:
         logger.error(f"Error reading text file: {str(e)}")
         raise e
 
+def make_text_splitter() -> "RecursiveCharacterTextSplitter":
+    # Imported here since loading the splitters takes most of a second
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        # Lets overlapping chunks be merged again when the prompt is assembled
+        add_start_index=True,
+        length_function=len,
+    )
+
 def chunk_text(text: str, filename: str) -> List[Document]:
     """Split text into manageable chunks."""
     logger.info(f"Chunking text from {filename}")
     
     # Create text splitter
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-    )
+    text_splitter = make_text_splitter()
     
     # Split text into chunks
     chunks = text_splitter.create_documents([text], metadatas=[{"source": filename}])
@@ -55,6 +77,49 @@ def chunk_text(text: str, filename: str) -> List[Document]:
     
     return chunks
 
+def piece_offsets(text: str, pieces: List[str]) -> List[int]:
+    """Where each split piece starts in text, found the way the splitter's add_start_index does."""
+    starts = []
+    index = 0
+    previous = 0
+    for piece in pieces:
+        index = max(0, text.find(piece, max(0, index + previous - CHUNK_OVERLAP)))
+        starts.append(index)
+        previous = len(piece)
+    return starts
+
+def chunk_pages(pages: Iterator[str], filename: str) -> Iterator[Document]:
+    """Chunk a stream of page texts, yielding chunks as soon as they are final.
+    
+    Only a few pages of text are buffered at a time. The last chunk of each
+    split is carried over and re-split with the following pages, so chunks
+    still span page boundaries.
+    """
+    text_splitter = make_text_splitter()
+    metadata = {"source": filename}
+    buffer = ""
+    buffer_start = 0
+    count = 0
+    for page in pages:
+        buffer += page + "\n"
+        if len(buffer) < 4 * CHUNK_SIZE:
+            continue
+        pieces = text_splitter.split_text(buffer)
+        starts = piece_offsets(buffer, pieces)
+        for piece, start in zip(pieces[:-1], starts):
+            count += 1
+            yield Document(page_content=piece, metadata=dict(metadata, start_index=buffer_start + start))
+        # Carry over the text from the last piece on, keeping the whitespace
+        # after it so words are not glued to the next page
+        start = starts[-1] if pieces else len(buffer)
+        buffer = buffer[start:]
+        buffer_start += start
+    pieces = text_splitter.split_text(buffer)
+    for piece, start in zip(pieces, piece_offsets(buffer, pieces)):
+        count += 1
+        yield Document(page_content=piece, metadata=dict(metadata, start_index=buffer_start + start))
+    logger.info(f"Created {count} chunks from {filename}")
+
 def is_valid_url(url: str) -> bool:
     """Check if a string is a valid URL."""
     # Simple URL validation regex
@@ -81,37 +146,80 @@ def process_url(url: str) -> Optional[List[Document]]:
             url = 'https://' + url
         
         # Get text content from the URL
-        text = get_website_text_content(url)
+        with timed("fetch"):
+            text = get_website_text_content(url)
         
         if text is None or not text.strip():
             logger.error(f"Failed to extract content from URL: {url}")
             return None
         
         # Create chunks from the text
-        chunks = chunk_text(text, url)
+        with timed("chunk"):
+            chunks = chunk_text(text, url)
         return chunks
     
     except Exception as e:
         logger.error(f"Error processing URL: {str(e)}")
         return None
 
-def process_document(file_path: str, original_filename: str) -> List[Document]:
-    """Process a document file (PDF or TXT) into chunks."""
+def iter_site_chunks(
+    url: str,
+    scope: str = "",
+    on_page: Optional[Callable[[str], None]] = None,
+    checkpoint: Optional[CrawlCheckpoint] = None,
+    **crawl_options,
+) -> Iterator[Document]:
+    """Crawl a site and yield chunks of each new or changed page as it arrives.
+    
+    on_page, if given, is called with the URL of each page that produced
+    chunks; each page is added to checkpoint, which saves its validators
+    once its chunks are indexed. crawl_options are passed on to SiteCrawler.
+    """
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    crawler = SiteCrawler(url, scope=scope, **crawl_options)
+    for page in timed_iter("crawl", crawler.crawl()):
+        with timed("chunk"):
+            chunks = chunk_text(page.text, page.url)
+        yield from chunks
+        if checkpoint is not None:
+            checkpoint.add(page, len(chunks))
+        if on_page:
+            on_page(page.url)
+
+def iter_document_chunks(
+    source: Union[str, BinaryIO],
+    original_filename: str,
+    on_page: Optional[Callable[[int], None]] = None,
+) -> Iterator[Document]:
+    """Yield a document's chunks while later PDF pages are still being extracted.
+    
+    source is a path or a seekable binary stream such as an upload.
+    """
     logger.info(f"Processing document: {original_filename}")
     
     try:
-        # Read the file based on extension
         if original_filename.endswith('.pdf'):
-            text = read_pdf_file(file_path)
+            # Extraction and chunking are interleaved; each is timed on its own
+            pages = timed_iter("extract", iter_pdf_pages(source, on_page=on_page))
+            yield from timed_iter("chunk", chunk_pages(pages, original_filename), exclude=pages)
         elif original_filename.endswith('.txt'):
-            text = read_text_file(file_path)
+            with timed("extract"):
+                text = read_text_file(source)
+            with timed("chunk"):
+                chunks = chunk_text(text, original_filename)
+            yield from chunks
         else:
             raise ValueError(f"Unsupported file type: {original_filename}")
-        
-        # Create chunks from the text
-        chunks = chunk_text(text, original_filename)
-        return chunks
     
     except Exception as e:
         logger.error(f"Error processing document: {str(e)}")
         raise e
+
+def process_document(
+    source: Union[str, BinaryIO],
+    original_filename: str,
+    on_page: Optional[Callable[[int], None]] = None,
+) -> List[Document]:
+    """Process a document (PDF or TXT) from a path or binary stream into chunks."""
+    return list(iter_document_chunks(source, original_filename, on_page=on_page))
@@ -0,0 +1,203 @@
+import os
+import math
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+from typing import List, Dict, Optional
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Location of the shared cache file; set to an empty string to disable caching
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", os.path.join("instance", "embedding_cache.db"))
+
+# Evict least recently used vectors once the cache holds more than this many bytes
+EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# SQLite caps the number of bound parameters per statement
+_QUERY_CHUNK = 500
+
+# Only refresh the access time of a hit when it is older than this (seconds)
+_TOUCH_INTERVAL = 60.0
+
+# Most rows evicted per transaction, so writers in other workers wait for one short batch at most
+_EVICT_BATCH = 500
+
+
+def cache_key(text: str, model: str) -> str:
+    """Content address for a chunk under a given embedding model."""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent embedding cache shared by every worker on the host.
+
+    Vectors live in a SQLite database in WAL mode, so concurrent gunicorn
+    workers can read while one of them writes.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._bytes_since_check = 0
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, "
+            "vector BLOB NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "last_access REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)")
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get_many(self, texts: List[str], model: str) -> Dict[int, np.ndarray]:
+        """Return cached vectors keyed by their position in texts."""
+        keys = [cache_key(text, model) for text in texts]
+        positions: Dict[str, List[int]] = {}
+        for i, key in enumerate(keys):
+            positions.setdefault(key, []).append(i)
+
+        found: Dict[int, np.ndarray] = {}
+        stale = []
+        now = time.time()
+        conn = self._connection()
+        unique = list(positions)
+        try:
+            for start in range(0, len(unique), _QUERY_CHUNK):
+                batch = unique[start:start + _QUERY_CHUNK]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, vector, last_access FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, blob, last_access in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    for i in positions[key]:
+                        found[i] = vector
+                    if now - last_access > _TOUCH_INTERVAL:
+                        stale.append((now, key))
+            if stale:
+                conn.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?", stale)
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache read failed: {str(e)}")
+            return {}
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        metrics.inc("chatbot_cache_lookups_total", len(found), cache="embedding", result="hit")
+        metrics.inc("chatbot_cache_lookups_total", len(texts) - len(found), cache="embedding", result="miss")
+        return found
+
+    def put_many(self, texts: List[str], model: str, vectors: np.ndarray) -> None:
+        """Store vectors for texts, evicting old entries if the cache is full."""
+        now = time.time()
+        rows = []
+        added = 0
+        for text, vector in zip(texts, vectors):
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((cache_key(text, model), blob, len(blob), now))
+            added += len(blob)
+        conn = self._connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_access) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache write failed: {str(e)}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            return
+
+        with self._lock:
+            self._bytes_since_check += added
+            check = self._bytes_since_check >= self.max_bytes // 20
+            if check:
+                self._bytes_since_check = 0
+        if check:
+            self.evict()
+
+    def evict(self) -> int:
+        """Drop least recently used vectors until the cache is under 90% of max_bytes.
+
+        Rows are deleted a batch at a time, each batch in its own short
+        transaction, so other workers can write in between.
+        """
+        conn = self._connection()
+        removed = 0
+        freed = 0
+        try:
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings").fetchone()
+            if total <= self.max_bytes:
+                return 0
+            target = total - int(self.max_bytes * 0.9)
+            average = total / count
+            while freed < target:
+                limit = max(1, min(_EVICT_BATCH, math.ceil((target - freed) / average)))
+                conn.execute("BEGIN IMMEDIATE")
+                oldest = "SELECT key FROM embeddings ORDER BY last_access LIMIT ?"
+                rows, size = conn.execute(
+                    f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({oldest})", (limit,)
+                ).fetchone()
+                conn.execute(f"DELETE FROM embeddings WHERE key IN ({oldest})", (limit,))
+                conn.execute("COMMIT")
+                if not rows:
+                    break
+                removed += rows
+                freed += size
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache eviction failed: {str(e)}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+        if removed:
+            logger.info(f"Evicted {removed} cached embeddings ({freed} bytes)")
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit and miss counts for this process."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+_default_cache: Optional[EmbeddingCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> Optional[EmbeddingCache]:
+    """Return the process-wide cache, or None when caching is disabled."""
+    global _default_cache
+    if not EMBEDDING_CACHE_PATH:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            try:
+                _default_cache = EmbeddingCache()
+            except (sqlite3.Error, OSError) as e:
+                logger.warning(f"Embedding cache unavailable: {str(e)}")
+                return None
+        return _default_cache
@@ -0,0 +1,264 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Callable, Optional, Tuple
+from .embedding_cache import EmbeddingCache, get_default_cache
+from .embedding_providers import EmbeddingProvider, get_default_provider
+from .resilience import backoff_delay, call_timeout, is_retryable, time_left
+
+logger = logging.getLogger(__name__)
+
+# The embeddings endpoint accepts at most 2048 inputs per request
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "256"))
+
+# Rough upper bound on characters per request (~4 characters per token)
+EMBEDDING_BATCH_CHARS = int(os.environ.get("EMBEDDING_BATCH_CHARS", "400000"))
+
+# Number of batches in flight at once
+EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", "4"))
+
+# Attempts per batch before the whole call fails; only timeouts, throttling and server errors are retried
+EMBEDDING_MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", "3"))
+
+# Seconds before a single embeddings request is abandoned and retried
+EMBEDDING_TIMEOUT = float(os.environ.get("EMBEDDING_TIMEOUT", "30"))
+
+
+def make_batches(texts: List[str], batch_size: int, max_chars: int) -> List[Tuple[int, int]]:
+    """Split texts into contiguous (start, end) ranges bounded by count and size."""
+    batches = []
+    start = 0
+    chars = 0
+    for i, text in enumerate(texts):
+        size = len(text)
+        if i > start and (i - start >= batch_size or chars + size > max_chars):
+            batches.append((start, i))
+            start = i
+            chars = 0
+        chars += size
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
+class EmbeddingPipeline:
+    """Batched, concurrent embedding requests that preserve input order.
+
+    Each batch goes to the embedding provider, which defaults to the one
+    configured by EMBEDDING_PROVIDER; aembed uses the provider's async
+    variant. Texts already present in the embedding cache never reach it.
+    """
+
+    def __init__(
+        self,
+        provider: Optional[EmbeddingProvider] = None,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_batch_chars: int = EMBEDDING_BATCH_CHARS,
+        concurrency: int = EMBEDDING_CONCURRENCY,
+        max_retries: int = EMBEDDING_MAX_RETRIES,
+        timeout: float = EMBEDDING_TIMEOUT,
+        backoff: float = 0.5,
+        cache: Optional[EmbeddingCache] = None,
+        use_cache: bool = True,
+    ):
+        self._provider = provider
+        self.batch_size = max(1, batch_size)
+        self.max_batch_chars = max(1, max_batch_chars)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max(1, max_retries)
+        self.timeout = timeout
+        self.backoff = backoff
+        self.cache = cache if cache is not None or not use_cache else get_default_cache()
+        self._lock = threading.Lock()
+        self._totals = {"texts": 0, "cached": 0, "batches": 0, "retries": 0, "failures": 0, "seconds": 0.0}
+        self._last_run: Dict[str, Any] = {}
+
+    @property
+    def provider(self) -> EmbeddingProvider:
+        if self._provider is None:
+            self._provider = get_default_provider()
+        return self._provider
+
+    @property
+    def model(self) -> str:
+        return self.provider.model
+
+    @property
+    def dimension(self) -> int:
+        return self.provider.dimension
+
+    def embed(self, texts: List[str], on_progress: Optional[Callable[[int], None]] = None) -> np.ndarray:
+        """Embed texts and return a float32 matrix with one row per input, in order.
+
+        on_progress, if given, is called with the number of texts embedded so
+        far (cache hits included) each time a batch completes.
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        started = time.perf_counter()
+        cached = self.cache.get_many(texts, self.provider.cache_key) if self.cache else {}
+        missing = [i for i in range(len(texts)) if i not in cached]
+        pending = [texts[i] for i in missing]
+        if on_progress:
+            on_progress(len(cached))
+        if not pending:
+            embeddings = np.stack([cached[i] for i in range(len(texts))])
+            self._record(len(texts), 0, 0, time.perf_counter() - started, len(cached))
+            return embeddings
+
+        batches = make_batches(pending, self.batch_size, self.max_batch_chars)
+        results: List[Optional[np.ndarray]] = [None] * len(batches)
+        retries = [0] * len(batches)
+        progress = {"done": len(cached)}
+        progress_lock = threading.Lock()
+
+        def run(batch_no: int) -> None:
+            start, end = batches[batch_no]
+            results[batch_no], retries[batch_no] = self._embed_batch(pending[start:end])
+            if on_progress:
+                with progress_lock:
+                    progress["done"] += end - start
+                    done = progress["done"]
+                on_progress(done)
+
+        workers = min(self.concurrency, len(batches))
+        if workers == 1:
+            for batch_no in range(len(batches)):
+                run(batch_no)
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed") as executor:
+                # Each batch runs in a copy of the caller's context, so it keeps the request's deadline
+                futures = [
+                    executor.submit(contextvars.copy_context().run, run, batch_no) for batch_no in range(len(batches))
+                ]
+                # Re-raises the first batch that exhausted its retries
+                for future in futures:
+                    future.result()
+
+        fresh = np.concatenate(results)
+        if self.cache:
+            self.cache.put_many(pending, self.provider.cache_key, fresh)
+
+        embeddings = self._merge(len(texts), missing, fresh, cached)
+        self._record(len(texts), len(batches), sum(retries), time.perf_counter() - started, len(cached))
+        return embeddings
+
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        """Async variant of embed for use on an event loop.
+
+        Batches go through the async client with at most ``concurrency`` in
+        flight, and the cache is read and written from a worker thread.
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        started = time.perf_counter()
+        cached = await asyncio.to_thread(self.cache.get_many, texts, self.provider.cache_key) if self.cache else {}
+        missing = [i for i in range(len(texts)) if i not in cached]
+        pending = [texts[i] for i in missing]
+        if not pending:
+            embeddings = np.stack([cached[i] for i in range(len(texts))])
+            self._record(len(texts), 0, 0, time.perf_counter() - started, len(cached))
+            return embeddings
+
+        batches = make_batches(pending, self.batch_size, self.max_batch_chars)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(start: int, end: int) -> Tuple[np.ndarray, int]:
+            async with semaphore:
+                return await self._aembed_batch(pending[start:end])
+
+        outcomes = await asyncio.gather(*(run(start, end) for start, end in batches))
+
+        fresh = np.concatenate([batch for batch, _ in outcomes])
+        if self.cache:
+            await asyncio.to_thread(self.cache.put_many, pending, self.provider.cache_key, fresh)
+
+        embeddings = self._merge(len(texts), missing, fresh, cached)
+        retries = sum(attempts for _, attempts in outcomes)
+        self._record(len(texts), len(batches), retries, time.perf_counter() - started, len(cached))
+        return embeddings
+
+    @staticmethod
+    def _merge(count: int, missing: List[int], fresh: np.ndarray, cached: Dict[int, np.ndarray]) -> np.ndarray:
+        """Interleave freshly embedded rows with cache hits in input order."""
+        if not cached:
+            return fresh
+        embeddings = np.empty((count, fresh.shape[1]), dtype=np.float32)
+        embeddings[missing] = fresh
+        for i, vector in cached.items():
+            embeddings[i] = vector
+        return embeddings
+
+    def _retry_delay(self, batch: List[str], error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying a failed batch, or None once it should fail."""
+        delay = backoff_delay(attempt, error, base=self.backoff)
+        left = time_left()
+        if attempt >= self.max_retries or not is_retryable(error) or (left is not None and delay >= left):
+            with self._lock:
+                self._totals["failures"] += 1
+            logger.error(f"Embedding batch of {len(batch)} failed after {attempt} attempts: {str(error)}")
+            return None
+        logger.warning(f"Embedding batch of {len(batch)} failed ({str(error)}), retrying in {delay:.1f}s")
+        return delay
+
+    def _embed_batch(self, batch: List[str]) -> Tuple[np.ndarray, int]:
+        """Embed one batch, retrying it alone with jittered exponential backoff."""
+        attempt = 0
+        while True:
+            try:
+                return self.provider.embed_batch(batch, timeout=call_timeout(self.timeout)), attempt
+            except Exception as e:
+                attempt += 1
+                delay = self._retry_delay(batch, e, attempt)
+                if delay is None:
+                    raise e
+                time.sleep(delay)
+
+    async def _aembed_batch(self, batch: List[str]) -> Tuple[np.ndarray, int]:
+        """Async variant of _embed_batch."""
+        attempt = 0
+        while True:
+            try:
+                return await self.provider.aembed_batch(batch, timeout=call_timeout(self.timeout)), attempt
+            except Exception as e:
+                attempt += 1
+                delay = self._retry_delay(batch, e, attempt)
+                if delay is None:
+                    raise e
+                await asyncio.sleep(delay)
+
+    def _record(self, texts: int, batches: int, retries: int, seconds: float, cached: int = 0) -> None:
+        with self._lock:
+            self._totals["texts"] += texts
+            self._totals["cached"] += cached
+            self._totals["batches"] += batches
+            self._totals["retries"] += retries
+            self._totals["seconds"] += seconds
+            self._last_run = {
+                "texts": texts,
+                "cached": cached,
+                "batches": batches,
+                "retries": retries,
+                "seconds": seconds,
+                "texts_per_second": texts / seconds if seconds > 0 else 0.0,
+            }
+        logger.info(
+            f"Embedded {texts} texts ({cached} cached) in {batches} batches "
+            f"({retries} retries) in {seconds:.2f}s"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Return throughput numbers for the last run and since startup."""
+        with self._lock:
+            totals = dict(self._totals)
+            last_run = dict(self._last_run)
+        seconds = totals["seconds"]
+        totals["texts_per_second"] = totals["texts"] / seconds if seconds > 0 else 0.0
+        return {"last_run": last_run, "totals": totals}
@@ -0,0 +1,370 @@
+import os
+import re
+import abc
+import zlib
+import asyncio
+import hashlib
+import logging
+import itertools
+import threading
+import numpy as np
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+from .metrics import count_api_call
+from .resilience import EMBEDDING_HEDGE_DELAY, ahedged, breakers, hedged
+
+logger = logging.getLogger(__name__)
+
+# Which provider embeds chunks and queries: "openai", "local" or "hashing"
+EMBEDDING_PROVIDER = os.environ.get("EMBEDDING_PROVIDER", "openai")
+
+# Vector size: shortens text-embedding-3 vectors, sets the hashing provider's size (default 256)
+EMBEDDING_DIMENSIONS = int(os.environ.get("EMBEDDING_DIMENSIONS", "0"))
+
+# Static embedding model (.npz) loaded by the local provider
+EMBEDDING_MODEL_PATH = os.environ.get("EMBEDDING_MODEL_PATH", os.path.join("instance", "embedding_model.npz"))
+
+# Native output size of OpenAI's embedding models
+OPENAI_EMBEDDING_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+
+# Token vectors gathered at once by the local provider, bounding its scratch memory
+_GATHER_ROWS = 16384
+
+_WORD = re.compile(r"\w+")
+
+
+def words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+@lru_cache(maxsize=65536)
+def _hash(token: str) -> int:
+    # crc32 rather than hash(), which is salted per process
+    return zlib.crc32(token.encode("utf-8"))
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length in place; rows of zeros (texts without words) stay zero."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+class EmbeddingMismatchError(ValueError):
+    """Raised when vectors from one embedding model meet an index built by another."""
+
+
+class EmbeddingProvider(abc.ABC):
+    """Turns a batch of texts into a float32 matrix with one row per text.
+
+    EmbeddingPipeline handles batching, retries and caching around it, so
+    a provider only embeds the batch it is given. name and model identify
+    what built an index; vectors from different ones are not comparable.
+    Subclasses implement model, dimension and embed_batch.
+    """
+
+    name = ""
+
+    @property
+    @abc.abstractmethod
+    def model(self) -> str:
+        """Name of the model the vectors come from."""
+
+    @property
+    @abc.abstractmethod
+    def dimension(self) -> int:
+        """Length of each vector."""
+
+    @property
+    def cache_key(self) -> str:
+        """Model name the embedding cache files vectors under."""
+        return self.model
+
+    def signature(self) -> Dict[str, Any]:
+        """What an index records about the embeddings it holds."""
+        return {"embedding_provider": self.name, "embedding_model": self.model, "dimension": self.dimension}
+
+    @abc.abstractmethod
+    def embed_batch(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        """Embed texts as one float32 row each, giving up after timeout seconds if set."""
+
+    async def aembed_batch(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        """Async variant of embed_batch; CPU providers run in a worker thread."""
+        return await asyncio.to_thread(self.embed_batch, texts, timeout)
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """Embeddings from the OpenAI API, one request per batch.
+
+    Clients and model default to the ones in openai_utils; any object with
+    an ``embeddings.create(input=..., model=...)`` method can stand in for a
+    client, so a local fake works when offline.
+    Requests go through the embeddings circuit breaker, and with a
+    hedge_delay a second request is raced against one that is slow to answer.
+    """
+
+    name = "openai"
+
+    def __init__(
+        self,
+        client=None,
+        async_client=None,
+        model: Optional[str] = None,
+        dimension: Optional[int] = None,
+        hedge_delay: float = EMBEDDING_HEDGE_DELAY,
+    ):
+        self._client = client
+        self._async_client = async_client
+        self._model = model
+        self._dimension = dimension or None
+        self.hedge_delay = hedge_delay
+
+    @property
+    def client(self):
+        if self._client is None:
+            from .openai_utils import get_client
+            self._client = get_client()
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            from .openai_utils import get_async_client
+            self._async_client = get_async_client()
+        return self._async_client
+
+    @property
+    def model(self) -> str:
+        if self._model is None:
+            from .openai_utils import EMBEDDING_MODEL
+            self._model = EMBEDDING_MODEL
+        return self._model
+
+    @property
+    def dimension(self) -> int:
+        if self._dimension:
+            return self._dimension
+        if self.model not in OPENAI_EMBEDDING_DIMENSIONS:
+            raise ValueError(f"Unknown size of {self.model} embeddings; set EMBEDDING_DIMENSIONS")
+        return OPENAI_EMBEDDING_DIMENSIONS[self.model]
+
+    def _shortened(self) -> bool:
+        return self._dimension is not None and self._dimension != OPENAI_EMBEDDING_DIMENSIONS.get(self.model)
+
+    @property
+    def cache_key(self) -> str:
+        return f"{self.model}@{self._dimension}" if self._shortened() else self.model
+
+    def _params(self, texts: List[str], timeout: Optional[float]) -> Dict[str, Any]:
+        params = {"input": texts, "model": self.model, "timeout": timeout}
+        if self._shortened():
+            params["dimensions"] = self._dimension
+        return params
+
+    @staticmethod
+    def _matrix(response, count: int) -> np.ndarray:
+        data = sorted(response.data, key=lambda item: item.index)
+        if len(data) != count:
+            raise ValueError(f"Expected {count} embeddings, got {len(data)}")
+        return np.array([item.embedding for item in data], dtype=np.float32)
+
+    def embed_batch(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        params = self._params(texts, timeout)
+        breaker = breakers["embeddings"]
+        breaker.before_call()
+        try:
+            response = hedged("embeddings", lambda: self.client.embeddings.create(**params), self.hedge_delay)
+            vectors = self._matrix(response, len(texts))
+        except Exception as e:
+            breaker.record_failure(e)
+            count_api_call("embeddings", outcome="error")
+            raise
+        breaker.record_success()
+        count_api_call("embeddings", response)
+        return vectors
+
+    async def aembed_batch(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        params = self._params(texts, timeout)
+        breaker = breakers["embeddings"]
+        breaker.before_call()
+        try:
+            response = await ahedged("embeddings", lambda: self.async_client.embeddings.create(**params), self.hedge_delay)
+            vectors = self._matrix(response, len(texts))
+        except Exception as e:
+            breaker.record_failure(e)
+            count_api_call("embeddings", outcome="error")
+            raise
+        breaker.record_success()
+        count_api_call("embeddings", response)
+        return vectors
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """Static embeddings computed on the CPU from a model file, with no network calls.
+
+    The file is an .npz holding ``tokens`` (the vocabulary) and ``vectors``
+    (one row per token, optionally followed by ``buckets`` rows that unknown
+    words are hashed into), plus optional per-token ``weights`` and a
+    ``model`` name. Vectors distilled from a sentence encoder, or word
+    vectors such as GloVe, can be exported to it with save_static_model.
+
+    A text's embedding is the weighted sum of its tokens' vectors scaled
+    to unit length, computed for a whole batch with one gather and one
+    segmented sum.
+    """
+
+    name = "local"
+
+    def __init__(self, path: str = EMBEDDING_MODEL_PATH):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Embedding model not found: {path}; set EMBEDDING_MODEL_PATH")
+        with np.load(path, allow_pickle=False) as data:
+            tokens = data["tokens"].tolist()
+            vectors = data["vectors"].astype(np.float32)
+            if "weights" in data.files:
+                # Pooling is a sum, so the weights are folded into the vectors once
+                vectors[:len(tokens)] *= data["weights"].astype(np.float32)[:, None]
+            self.buckets = int(data["buckets"]) if "buckets" in data.files else 0
+            name = str(data["model"]) if "model" in data.files else os.path.splitext(os.path.basename(path))[0]
+        if len(vectors) != len(tokens) + self.buckets:
+            raise ValueError(f"{path} has {len(vectors)} vectors for {len(tokens)} tokens and {self.buckets} buckets")
+
+        self.path = path
+        self.vectors = vectors
+        self.vocabulary = {token: i for i, token in enumerate(tokens)}
+        # Models are told apart by content, so retraining under the same name is caught
+        self._model = f"{name}-{self._fingerprint(path)}"
+        logger.info(f"Loaded embedding model {self._model}: {len(tokens)} tokens, {vectors.shape[1]} dimensions")
+
+    @staticmethod
+    def _fingerprint(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()[:12]
+
+    @property
+    def model(self) -> str:
+        return self._model
+
+    @property
+    def dimension(self) -> int:
+        return self.vectors.shape[1]
+
+    def token_ids(self, text: str) -> List[int]:
+        vocabulary = self.vocabulary
+        if not self.buckets:
+            return [vocabulary[word] for word in words(text) if word in vocabulary]
+        offset = len(vocabulary)
+        return [vocabulary.get(word, offset + _hash(word) % self.buckets) for word in words(text)]
+
+    def embed_batch(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        ids = [self.token_ids(text) for text in texts]
+        start = 0
+        while start < len(texts):
+            # Take texts until their tokens fill the gather buffer
+            end, rows = start, 0
+            while end < len(texts) and (end == start or rows + len(ids[end]) <= _GATHER_ROWS):
+                rows += len(ids[end])
+                end += 1
+            lengths = np.fromiter((len(ids[i]) for i in range(start, end)), dtype=np.int64, count=end - start)
+            present = lengths > 0
+            if rows:
+                flat = np.fromiter(itertools.chain.from_iterable(ids[start:end]), dtype=np.int64, count=rows)
+                offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))[present]
+                embeddings[start:end][present] = np.add.reduceat(self.vectors[flat], offsets, axis=0)
+            start = end
+        return _normalize(embeddings)
+
+
+def save_static_model(
+    path: str,
+    tokens: List[str],
+    vectors: np.ndarray,
+    weights: Optional[np.ndarray] = None,
+    buckets: int = 0,
+    model: Optional[str] = None,
+) -> None:
+    """Write a model file for LocalEmbeddingProvider.
+
+    vectors has one row per token followed by buckets rows for unknown
+    words; they are stored as float16, which halves the file and the
+    precision loss does not change rankings in practice.
+    """
+    if len(vectors) != len(tokens) + buckets:
+        raise ValueError(f"Expected {len(tokens) + buckets} vectors, got {len(vectors)}")
+    arrays = {
+        "tokens": np.array(tokens, dtype=str),
+        "vectors": np.asarray(vectors, dtype=np.float16),
+        "buckets": np.array(buckets),
+    }
+    if weights is not None:
+        arrays["weights"] = np.asarray(weights, dtype=np.float32)
+    if model:
+        arrays["model"] = np.array(model)
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """Deterministic bag-of-words vectors from feature hashing.
+
+    Each word adds +1 or -1 to the position its hash picks. Needs no model
+    or network, and texts sharing words land near each other, which is
+    enough for tests and offline development but not for real retrieval.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dimension: int = 256):
+        if dimension <= 0:
+            raise ValueError("Hashing embeddings need a positive dimension")
+        self._dimension = dimension
+
+    @property
+    def model(self) -> str:
+        return f"hashing-{self._dimension}"
+
+    @property
+    def dimension(self) -> int:
+        return self._dimension
+
+    def embed_batch(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        hashes = [[_hash(word) for word in words(text)] for text in texts]
+        lengths = [len(h) for h in hashes]
+        flat = np.fromiter(itertools.chain.from_iterable(hashes), dtype=np.int64, count=sum(lengths))
+        rows = np.repeat(np.arange(len(texts)), lengths)
+        signs = np.where(flat & (1 << 31), -1.0, 1.0).astype(np.float32)
+        embeddings = np.zeros((len(texts), self._dimension), dtype=np.float32)
+        np.add.at(embeddings, (rows, flat % self._dimension), signs)
+        return _normalize(embeddings)
+
+
+def create_provider(name: str = EMBEDDING_PROVIDER) -> EmbeddingProvider:
+    """Build the provider selected by name with its settings from the environment."""
+    if name == "openai":
+        return OpenAIEmbeddingProvider(dimension=EMBEDDING_DIMENSIONS or None)
+    if name == "local":
+        return LocalEmbeddingProvider(EMBEDDING_MODEL_PATH)
+    if name == "hashing":
+        return HashingEmbeddingProvider(EMBEDDING_DIMENSIONS or 256)
+    raise ValueError(f"Unknown embedding provider: {name}. Expected openai, local or hashing")
+
+
+_default_provider: Optional[EmbeddingProvider] = None
+_default_provider_lock = threading.Lock()
+
+
+def get_default_provider() -> EmbeddingProvider:
+    """The configured provider, created on first use and shared by every store in the process."""
+    global _default_provider
+    with _default_provider_lock:
+        if _default_provider is None:
+            _default_provider = create_provider()
+        return _default_provider
@@ -0,0 +1,380 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import logging
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, Any, Iterable, List, Optional, BinaryIO, Set, Tuple
+from langchain_core.documents import Document
+from .digests import DigestStore, response_fields
+
+if TYPE_CHECKING:
+    from .vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+# SQLite database holding the job queue; shared by every worker on the host
+INGESTION_JOBS_DB = os.environ.get("INGESTION_JOBS_DB", os.path.join("instance", "ingestion_jobs.db"))
+
+# Uploaded files wait here until their job has run
+INGESTION_SPOOL_DIR = os.environ.get("INGESTION_SPOOL_DIR", os.path.join("instance", "uploads"))
+
+# Background ingestion threads per worker process
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", "2"))
+
+# Submissions are rejected once this many jobs are waiting
+INGESTION_MAX_QUEUED = int(os.environ.get("INGESTION_MAX_QUEUED", "100"))
+
+# A running job whose worker has not reported progress for this long is requeued
+INGESTION_STALE_SECONDS = float(os.environ.get("INGESTION_STALE_SECONDS", "300"))
+
+# Attempts before a job that keeps getting requeued is marked failed
+INGESTION_MAX_ATTEMPTS = int(os.environ.get("INGESTION_MAX_ATTEMPTS", "3"))
+
+# Chunks embedded and indexed together while the rest of a document is still being extracted
+INGESTION_INDEX_BATCH = int(os.environ.get("INGESTION_INDEX_BATCH", "256"))
+
+# Seconds between polls for jobs submitted by other workers
+_POLL_INTERVAL = 2.0
+
+
+class QueueFullError(Exception):
+    """Raised when too many ingestion jobs are already waiting."""
+
+
+def index_chunks(
+    store: "VectorStore",
+    chunks: Iterable[Document],
+    batch_size: int = INGESTION_INDEX_BATCH,
+    on_indexed: Optional[Callable[[int], None]] = None,
+    keep: int = 3,
+) -> Tuple[int, List[Document]]:
+    """Add a stream of chunks to the store a batch at a time.
+
+    Each source in the stream replaces its previous version: chunks the
+    store already holds are not embedded again, and once the stream ends
+    the source's chunks that did not reappear are deleted.
+    Returns the number of chunks indexed and the first keep chunks, which
+    is all that is needed to digest the document.
+    on_indexed is called with the running total after each batch.
+    """
+    from .vector_store import chunk_id
+
+    batch: List[Document] = []
+    head: List[Document] = []
+    seen: Dict[str, Set[str]] = {}
+    count = 0
+    for chunk in chunks:
+        if len(head) < keep:
+            head.append(chunk)
+        seen.setdefault(chunk.metadata.get("source", ""), set()).add(chunk_id(chunk))
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            store.add_documents(batch)
+            count += len(batch)
+            batch = []
+            if on_indexed:
+                on_indexed(count)
+    if batch:
+        store.add_documents(batch)
+        count += len(batch)
+        if on_indexed:
+            on_indexed(count)
+    if seen:
+        store.retain_chunks(seen)
+    return count, head
+
+
+class IngestionJobs:
+    """Durable ingestion queue processed by a bounded pool of background threads.
+
+    Jobs and their progress live in SQLite, so any worker can report on a
+    job and a job interrupted by a restart is picked up again. A job is done
+    once its document is indexed; the document's digest is requested from
+    digests and finishes on its own.
+    """
+
+    def __init__(
+        self,
+        get_store: Callable[[str], "VectorStore"],
+        path: str = INGESTION_JOBS_DB,
+        spool_dir: str = INGESTION_SPOOL_DIR,
+        workers: int = INGESTION_WORKERS,
+        max_queued: int = INGESTION_MAX_QUEUED,
+        digests: Optional[DigestStore] = None,
+    ):
+        self.get_store = get_store
+        self.digests = digests if digests is not None else DigestStore()
+        self.path = path
+        self.spool_dir = spool_dir
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._last_reap = 0.0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        os.makedirs(spool_dir, exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, "
+            "namespace TEXT NOT NULL, "
+            "kind TEXT NOT NULL, "
+            "payload TEXT NOT NULL, "
+            "status TEXT NOT NULL, "
+            "progress TEXT NOT NULL, "
+            "result TEXT, "
+            "error TEXT, "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "worker TEXT, "
+            "created_at REAL NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def start(self) -> None:
+        """Start the background threads for this process."""
+        if self._threads:
+            return
+        # Claims are recorded under the process that runs the job, not the one that imported the app
+        self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run_forever, name=f"ingest-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} ingestion workers")
+
+    def submit_file(self, namespace: str, stream: BinaryIO, filename: str) -> str:
+        """Spool an uploaded file to disk and queue it for ingestion."""
+        job_id = uuid.uuid4().hex
+        path = os.path.join(self.spool_dir, job_id)
+        with open(path, "wb") as f:
+            shutil.copyfileobj(stream, f)
+        try:
+            self._insert(job_id, namespace, "file", {"path": path, "filename": filename})
+        except Exception:
+            os.unlink(path)
+            raise
+        return job_id
+
+    def submit_url(self, namespace: str, url: str) -> str:
+        """Queue a website URL for ingestion."""
+        job_id = uuid.uuid4().hex
+        self._insert(job_id, namespace, "url", {"url": url})
+        return job_id
+
+    def submit_crawl(self, namespace: str, url: str, **crawl_options) -> str:
+        """Queue a crawl of the site below url; crawl_options go to SiteCrawler."""
+        job_id = uuid.uuid4().hex
+        self._insert(job_id, namespace, "crawl", {"url": url, "options": crawl_options})
+        return job_id
+
+    def _insert(self, job_id: str, namespace: str, kind: str, payload: Dict[str, Any]) -> None:
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                raise QueueFullError(f"{queued} ingestion jobs are already waiting")
+            conn.execute(
+                "INSERT INTO jobs (id, namespace, kind, payload, status, progress, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, namespace, kind, json.dumps(payload), json.dumps({"stage": "queued"}), now, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        logger.info(f"Queued {kind} ingestion job {job_id}")
+        self._wakeup.set()
+
+    def get(self, job_id: str, namespace: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Return a job's status and progress, optionally only if it belongs to namespace."""
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (namespace is not None and row["namespace"] != namespace):
+            return None
+        return {
+            "job_id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "progress": json.loads(row["progress"]),
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    def _update(self, job_id: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._connection().execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _requeue_stale(self) -> None:
+        """Return jobs abandoned by a crashed or restarted worker to the queue."""
+        conn = self._connection()
+        cutoff = time.time() - INGESTION_STALE_SECONDS
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            abandoned = conn.execute(
+                "SELECT id, payload FROM jobs WHERE status = 'running' AND updated_at < ? AND attempts >= ?",
+                (cutoff, INGESTION_MAX_ATTEMPTS),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET status = 'failed', error = 'Gave up after repeated interruptions' WHERE id = ?",
+                [(row["id"],) for row in abandoned],
+            )
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND updated_at < ?",
+                (cutoff,),
+            ).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        for row in abandoned:
+            logger.error(f"Ingestion job {row['id']} failed after repeated interruptions")
+            _remove_spool(json.loads(row["payload"]))
+        if requeued:
+            logger.warning(f"Requeued {requeued} stale ingestion jobs")
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """Atomically take the oldest queued job."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, updated_at = ? "
+                    "WHERE id = ?",
+                    (self._worker_id, time.time(), row["id"]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _run_forever(self) -> None:
+        while True:
+            try:
+                if time.time() - self._last_reap > _POLL_INTERVAL * 15:
+                    self._last_reap = time.time()
+                    self._requeue_stale()
+                row = self._claim()
+            except sqlite3.Error as e:
+                logger.error(f"Ingestion queue unavailable: {str(e)}")
+                row = None
+            if row is None:
+                self._wakeup.wait(_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._process(row)
+
+    def _process(self, row: sqlite3.Row) -> None:
+        """Run one job, recording progress after each stage."""
+        from .crawler import CrawlCheckpoint
+        from .document_processor import iter_document_chunks, iter_site_chunks, process_url
+
+        job_id = row["id"]
+        payload = json.loads(row["payload"])
+        progress: Dict[str, Any] = {"stage": "extracting"}
+
+        def report(**changes) -> None:
+            progress.update(changes)
+            self._update(job_id, progress=json.dumps(progress))
+
+        def on_page(pages: int) -> None:
+            # Record every page in memory but only write every tenth to the database
+            progress["pages_extracted"] = pages
+            if pages % 10 == 0:
+                report()
+
+        try:
+            report()
+            store = self.get_store(row["namespace"])
+            if row["kind"] == "file":
+                # Earlier chunks are embedded while later pages are still being extracted
+                chunks = iter_document_chunks(payload["path"], payload["filename"], on_page=on_page)
+                source = payload["filename"]
+                # Extraction carries on meanwhile, so pages_extracted keeps growing during this stage
+                count, head = index_chunks(
+                    store, chunks, on_indexed=lambda done: report(stage="embedding", chunks_embedded=done)
+                )
+                if not count:
+                    raise ValueError("No text could be extracted from the document")
+            elif row["kind"] == "crawl":
+                # Pages are chunked and indexed as the crawl reaches them
+                report(stage="crawling", pages_crawled=0)
+                checkpoint = CrawlCheckpoint(scope=row["namespace"])
+                chunks = iter_site_chunks(
+                    payload["url"],
+                    scope=row["namespace"],
+                    on_page=lambda url: report(pages_crawled=progress["pages_crawled"] + 1),
+                    checkpoint=checkpoint,
+                    state=checkpoint.state,
+                    indexed=store.has_source,
+                    **payload.get("options", {}),
+                )
+                source = payload["url"]
+
+                def on_indexed(done: int) -> None:
+                    checkpoint.indexed(done)
+                    report(chunks_embedded=done)
+
+                count, head = index_chunks(store, chunks, on_indexed=on_indexed)
+                checkpoint.indexed(count)
+            else:
+                chunks = process_url(payload["url"])
+                if not chunks:
+                    raise ValueError("Failed to extract content from the URL")
+                source = payload["url"]
+                report(stage="embedding", chunks_total=len(chunks), chunks_embedded=0)
+                count, head = index_chunks(store, chunks, on_indexed=lambda done: report(chunks_embedded=done))
+
+            # Summary and questions are generated in the background, or reused if already known
+            digest = self.digests.request(head, source)
+
+            report(stage="done", chunks_total=count, chunks_embedded=count, indexed=True)
+            result = {
+                "message": f"Successfully processed {source}",
+                "chunks_count": count,
+                **response_fields(digest),
+            }
+            self._update(job_id, status="done", result=json.dumps(result))
+            logger.info(f"Finished ingestion job {job_id}")
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {str(e)}")
+            self._update(job_id, status="failed", error=str(e))
+        finally:
+            _remove_spool(payload)
+
+
+def _remove_spool(payload: Dict[str, Any]) -> None:
+    """Delete a file job's spooled upload once the job is done with it."""
+    path = payload.get("path")
+    if path and os.path.exists(path):
+        try:
+            os.unlink(path)
+        except OSError as e:
+            logger.warning(f"Could not delete spooled upload: {str(e)}")
@@ -0,0 +1,199 @@
+import os
+import re
+import math
+import logging
+import numpy as np
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# BM25 term-frequency saturation and document-length normalisation
+BM25_K1 = float(os.environ.get("BM25_K1", "1.2"))
+BM25_B = float(os.environ.get("BM25_B", "0.75"))
+
+# Constant added to every rank in reciprocal rank fusion; larger values flatten the top ranks
+RRF_K = int(os.environ.get("RRF_K", "60"))
+
+_TOKEN = re.compile(r"\w+")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how i if in into is it its of on or "
+    "that the their there these this to was were what when where which who why will with".split()
+)
+
+# array typecode whose items are 32-bit signed integers
+_INT32 = "i" if array("i").itemsize == 4 else "l"
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens without the most common English stopwords."""
+    return [token for token in _TOKEN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = RRF_K) -> List[int]:
+    """Merge ranked id lists by summing 1 / (k + rank) for every list an id appears in."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            scores[row] = scores.get(row, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class LexicalIndex:
+    """BM25 inverted index over positional rows.
+
+    Each term keeps two parallel int32 arrays, the rows containing it (in
+    increasing order, since rows are only ever appended) and the term's
+    frequency in each. Removed rows stay in the postings and are masked out
+    at query time until the index is compacted.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._lengths = array(_INT32)
+        self._total_length = 0
+        self._removed = set()
+        self._removed_length = 0
+        self._removed_rows: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        """Number of rows indexed, removed ones included."""
+        return len(self._lengths)
+
+    @property
+    def nbytes(self) -> int:
+        postings = sum(rows.itemsize * len(rows) * 2 for rows, _ in self._postings.values())
+        return postings + self._lengths.itemsize * len(self._lengths)
+
+    def add(self, texts: Iterable[str]) -> None:
+        """Index texts as the next rows."""
+        for text in texts:
+            row = len(self._lengths)
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = (array(_INT32), array(_INT32))
+                postings[0].append(row)
+                postings[1].append(tf)
+            length = sum(counts.values())
+            self._lengths.append(length)
+            self._total_length += length
+
+    def remove(self, rows: Iterable[int]) -> None:
+        """Exclude rows from searches and from the corpus statistics."""
+        for row in rows:
+            if 0 <= row < len(self._lengths) and row not in self._removed:
+                self._removed.add(row)
+                self._removed_length += self._lengths[row]
+                self._removed_rows = None
+
+    def truncate(self, count: int) -> None:
+        """Drop rows from count onwards, e.g. ones written after a snapshot's manifest."""
+        if count >= len(self._lengths):
+            return
+        for term in list(self._postings):
+            rows, tfs = self._postings[term]
+            keep = int(np.searchsorted(np.frombuffer(rows, dtype=np.int32), count))
+            if keep == 0:
+                del self._postings[term]
+            elif keep < len(rows):
+                del rows[keep:]
+                del tfs[keep:]
+        dropped = {row for row in self._removed if row >= count}
+        self._removed -= dropped
+        self._removed_length -= sum(self._lengths[row] for row in dropped)
+        self._removed_rows = None
+        self._total_length -= sum(self._lengths[count:])
+        del self._lengths[count:]
+
+    def search(self, query: str, k: int) -> List[int]:
+        """Rows of the k best BM25 matches for query, best first."""
+        terms = set(tokenize(query))
+        count = len(self._lengths)
+        live = count - len(self._removed)
+        if not terms or live <= 0 or k <= 0:
+            return []
+
+        lengths = np.frombuffer(self._lengths, dtype=np.int32)
+        average = max(1.0, (self._total_length - self._removed_length) / live)
+        scores = np.zeros(count, dtype=np.float32)
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            rows = np.frombuffer(postings[0], dtype=np.int32)
+            tfs = np.frombuffer(postings[1], dtype=np.int32).astype(np.float32)
+            df = min(len(rows), live)
+            idf = math.log(1.0 + (live - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * lengths[rows] / average)
+            # Rows are unique within a term's postings, so fancy-index addition is safe
+            scores[rows] += idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+        del lengths
+
+        if self._removed:
+            if self._removed_rows is None:
+                self._removed_rows = np.fromiter(self._removed, dtype=np.int64, count=len(self._removed))
+            scores[self._removed_rows] = 0.0
+
+        matches = int(np.count_nonzero(scores))
+        if matches == 0:
+            return []
+        k = min(k, matches)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [int(row) for row in top[np.argsort(-scores[top], kind="stable")]]
+
+    def compact(self, rows: np.ndarray) -> "LexicalIndex":
+        """Copy holding only the given rows, renumbered from zero in order."""
+        mapping = np.full(len(self._lengths), -1, dtype=np.int32)
+        mapping[rows] = np.arange(len(rows), dtype=np.int32)
+        compacted = LexicalIndex(self.k1, self.b)
+        for term, (term_rows, tfs) in self._postings.items():
+            new_rows = mapping[np.frombuffer(term_rows, dtype=np.int32)]
+            keep = new_rows >= 0
+            if keep.any():
+                compacted._postings[term] = (
+                    array(_INT32, new_rows[keep].tobytes()),
+                    array(_INT32, np.frombuffer(tfs, dtype=np.int32)[keep].tobytes()),
+                )
+        lengths = np.frombuffer(self._lengths, dtype=np.int32)[rows]
+        compacted._lengths = array(_INT32, lengths.tobytes())
+        compacted._total_length = int(lengths.sum())
+        return compacted
+
+    def write(self, path: str) -> None:
+        """Save the postings and row lengths; removed rows are recorded by the caller."""
+        terms = list(self._postings)
+        sizes = np.array([len(self._postings[term][0]) for term in terms], dtype=np.int64)
+        empty = np.zeros(0, dtype=np.int32)
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                terms=np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8),
+                sizes=sizes,
+                rows=np.concatenate([np.frombuffer(self._postings[t][0], dtype=np.int32) for t in terms] or [empty]),
+                tfs=np.concatenate([np.frombuffer(self._postings[t][1], dtype=np.int32) for t in terms] or [empty]),
+                lengths=np.frombuffer(self._lengths, dtype=np.int32),
+            )
+
+    @classmethod
+    def read(cls, path: str) -> "LexicalIndex":
+        index = cls()
+        with np.load(path) as data:
+            terms = data["terms"].tobytes().decode("utf-8").split("\n") if len(data["terms"]) else []
+            ends = np.cumsum(data["sizes"])
+            rows, tfs = data["rows"], data["tfs"]
+            start = 0
+            for term, end in zip(terms, ends):
+                index._postings[term] = (
+                    array(_INT32, rows[start:end].tobytes()),
+                    array(_INT32, tfs[start:end].tobytes()),
+                )
+                start = end
+            index._lengths = array(_INT32, data["lengths"].tobytes())
+        index._total_length = sum(index._lengths)
+        return index
@@ -0,0 +1,531 @@
+import os
+import re
+import abc
+import time
+import uuid
+import atexit
+import bisect
+import sqlite3
+import logging
+import threading
+import contextvars
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+# Set to 0 to turn instrumentation off; timers and counters then do nothing
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+
+# SQLite database the workers on a host add their metrics to; empty keeps them per process
+METRICS_DB = os.environ.get("METRICS_DB", os.path.join("instance", "metrics.db"))
+
+# Seconds between flushes of this worker's buffered metrics to the database
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "10"))
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Type and help text of every metric, as shown on /metrics
+METRICS = {
+    "chatbot_stage_duration_seconds": ("histogram", "Time spent in each stage of handling a request"),
+    "chatbot_http_request_duration_seconds": ("histogram", "Time to handle an HTTP request, up to the response headers"),
+    "chatbot_http_requests_total": ("counter", "HTTP requests handled"),
+    "chatbot_openai_requests_total": ("counter", "Requests made to the OpenAI API"),
+    "chatbot_openai_tokens_total": ("counter", "Tokens reported used by the OpenAI API"),
+    "chatbot_openai_retries_total": ("counter", "OpenAI calls retried after a timeout, throttling or server error"),
+    "chatbot_openai_hedged_requests_total": ("counter", "Second embeddings requests sent because the first was slow"),
+    "chatbot_circuit_rejections_total": ("counter", "Calls failed fast because the upstream's circuit was open"),
+    "chatbot_circuit_state": ("gauge", "Upstream circuit state: 0 closed, 0.5 half-open, 1 open"),
+    "chatbot_cache_lookups_total": ("counter", "Cache lookups by cache and result"),
+    "chatbot_rate_limit_rejections_total": ("counter", "Questions rejected by the rate limit"),
+    "chatbot_context_tokens_total": ("counter", "Context tokens sent with questions, and saved by merging and the budget"),
+    "chatbot_index_vectors": ("gauge", "Vectors held by this worker's loaded namespaces, deleted ones excluded"),
+    "chatbot_namespaces_loaded": ("gauge", "Namespaces loaded in this worker"),
+    "chatbot_vector_store_memory_bytes": ("gauge", "Estimated bytes held by this worker's loaded namespaces"),
+    "chatbot_process_resident_memory_bytes": ("gauge", "Resident memory of this worker process"),
+}
+
+_HISTOGRAM_SUFFIXES = ("_bucket", "_sum", "_count")
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+T = TypeVar("T")
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels: Labels) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class MetricsStore(abc.ABC):
+    """Where workers add their metrics so any of them can report the totals.
+
+    Counter and histogram samples are only ever added to, so each worker
+    contributes deltas and the stored values are totals over every worker
+    that ever ran. Gauges are kept per worker and dropped once it stops
+    reporting.
+    """
+
+    @abc.abstractmethod
+    def add(self, samples: Dict[Tuple[str, str], float]) -> None:
+        """Add samples to the stored totals."""
+
+    @abc.abstractmethod
+    def samples(self) -> Dict[Tuple[str, str], float]:
+        """Stored totals of every counter and histogram sample."""
+
+    @abc.abstractmethod
+    def set_gauges(self, worker: str, gauges: Dict[Tuple[str, str], float], ttl: float) -> None:
+        """Replace a worker's gauges and forget those of workers silent for longer than ttl."""
+
+    @abc.abstractmethod
+    def gauges(self) -> Dict[Tuple[str, str], float]:
+        """Current gauges of every worker still reporting."""
+
+
+class MemoryMetricsStore(MetricsStore):
+    """Totals for this process only."""
+
+    def __init__(self):
+        self._samples: Dict[Tuple[str, str], float] = {}
+        self._gauges: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, samples: Dict[Tuple[str, str], float]) -> None:
+        with self._lock:
+            for key, value in samples.items():
+                self._samples[key] = self._samples.get(key, 0.0) + value
+
+    def samples(self) -> Dict[Tuple[str, str], float]:
+        with self._lock:
+            return dict(self._samples)
+
+    def set_gauges(self, worker: str, gauges: Dict[Tuple[str, str], float], ttl: float) -> None:
+        with self._lock:
+            self._gauges = dict(gauges)
+
+    def gauges(self) -> Dict[Tuple[str, str], float]:
+        with self._lock:
+            return dict(self._gauges)
+
+
+class SQLiteMetricsStore(MetricsStore):
+    """Totals in a SQLite database shared by every worker on the host."""
+
+    def __init__(self, path: str = METRICS_DB):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS metric_samples ("
+            "name TEXT NOT NULL, "
+            "labels TEXT NOT NULL, "
+            "value REAL NOT NULL, "
+            "PRIMARY KEY (name, labels))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS metric_gauges ("
+            "worker TEXT NOT NULL, "
+            "name TEXT NOT NULL, "
+            "labels TEXT NOT NULL, "
+            "value REAL NOT NULL, "
+            "updated_at REAL NOT NULL, "
+            "PRIMARY KEY (worker, name, labels))"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Losing the last flush in a power cut is acceptable for metrics
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add(self, samples: Dict[Tuple[str, str], float]) -> None:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO metric_samples (name, labels, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                [(name, labels, value) for (name, labels), value in samples.items()],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def samples(self) -> Dict[Tuple[str, str], float]:
+        rows = self._connection().execute("SELECT name, labels, value FROM metric_samples").fetchall()
+        return {(name, labels): value for name, labels, value in rows}
+
+    def set_gauges(self, worker: str, gauges: Dict[Tuple[str, str], float], ttl: float) -> None:
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM metric_gauges WHERE worker = ? OR updated_at < ?", (worker, now - ttl))
+            conn.executemany(
+                "INSERT INTO metric_gauges (worker, name, labels, value, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(worker, name, labels, value, now) for (name, labels), value in gauges.items()],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def gauges(self) -> Dict[Tuple[str, str], float]:
+        rows = self._connection().execute("SELECT name, labels, value FROM metric_gauges").fetchall()
+        return {(name, labels): value for name, labels, value in rows}
+
+
+class Metrics:
+    """Process-wide registry of counters, latency histograms and gauges.
+
+    Recording only updates dictionaries in memory under a lock. A
+    background thread adds what has been recorded since the last flush to
+    the store every flush_interval seconds, so /metrics on any worker
+    reports totals for all of them; gauges come from collector callbacks
+    run at flush time.
+    """
+
+    def __init__(
+        self,
+        store: Optional[MetricsStore] = None,
+        flush_interval: float = METRICS_FLUSH_INTERVAL,
+        enabled: bool = METRICS_ENABLED,
+    ):
+        self._store = store
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self.worker = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        self._unflushed: Dict[Tuple[str, str], float] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, float, Dict[str, Any]]]]] = []
+        self._thread = None
+        # monotonic time of the last flush, so scrapes between flushes read the store as it is
+        self._flushed_at: Optional[float] = None
+
+    @property
+    def store(self) -> MetricsStore:
+        """The store, opened on first use so importing instrumented modules touches no files."""
+        with self._flush_lock:
+            if self._store is None:
+                self._store = create_store()
+            return self._store
+
+    def start(self) -> None:
+        """Start the flush thread and register the final flush."""
+        if self._thread is not None or not self.enabled:
+            return
+        # Workers forked from a preloaded app would otherwise share the id chosen at import
+        self.worker = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._thread = threading.Thread(target=self._flush_forever, name="metrics-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        slot = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # One count per bucket plus +Inf, then the sum
+                histogram = self._histograms[key] = [0.0] * (len(LATENCY_BUCKETS) + 2)
+            histogram[slot] += 1
+            histogram[-1] += seconds
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, float, Dict[str, Any]]]]) -> None:
+        """Register a callback returning (name, value, labels) gauge readings."""
+        self._collectors.append(collector)
+
+    def _drain(self) -> Dict[Tuple[str, str], float]:
+        """Take what was recorded since the last flush as additive exposition samples."""
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            histograms, self._histograms = self._histograms, {}
+        samples: Dict[Tuple[str, str], float] = {}
+        for (name, labels), value in counters.items():
+            samples[(name, format_labels(labels))] = value
+        for (name, labels), histogram in histograms.items():
+            cumulative = 0.0
+            for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), histogram):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples[(f"{name}_bucket", format_labels(labels + (("le", le),)))] = cumulative
+            samples[(f"{name}_sum", format_labels(labels))] = histogram[-1]
+            samples[(f"{name}_count", format_labels(labels))] = cumulative
+        return samples
+
+    def _collect(self) -> Dict[Tuple[str, str], float]:
+        gauges: Dict[Tuple[str, str], float] = {}
+        rss = _resident_memory()
+        readings: List[Tuple[str, float, Dict[str, Any]]] = []
+        if rss is not None:
+            readings.append(("chatbot_process_resident_memory_bytes", rss, {}))
+        for collector in self._collectors:
+            try:
+                readings.extend(collector())
+            except Exception as e:
+                logger.error(f"Error collecting metrics: {str(e)}")
+        for name, value, labels in readings:
+            labels = dict(labels, worker=self.worker)
+            gauges[(name, format_labels(tuple(sorted((k, str(v)) for k, v in labels.items()))))] = value
+        return gauges
+
+    def flush(self) -> None:
+        """Add what was recorded since the last flush to the store and refresh this worker's gauges."""
+        if not self.enabled:
+            return
+        store = self.store
+        with self._flush_lock:
+            self._flushed_at = time.monotonic()
+            samples = self._drain()
+            # Samples a failed flush could not store are retried with the new ones
+            for key, value in self._unflushed.items():
+                samples[key] = samples.get(key, 0.0) + value
+            self._unflushed = {}
+            try:
+                if samples:
+                    store.add(samples)
+            except Exception as e:
+                logger.error(f"Error flushing {len(samples)} metric samples: {str(e)}")
+                self._unflushed = samples
+            try:
+                store.set_gauges(self.worker, self._collect(), ttl=3 * self.flush_interval)
+            except Exception as e:
+                logger.error(f"Error flushing gauges: {str(e)}")
+
+    def close(self) -> None:
+        """Flush a last time and withdraw this worker's gauges."""
+        self.flush()
+        try:
+            self.store.set_gauges(self.worker, {}, ttl=3 * self.flush_interval)
+        except Exception as e:
+            logger.error(f"Error removing gauges: {str(e)}")
+
+    def _flush_forever(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def render(self) -> str:
+        """Every worker's metrics in the Prometheus text format, as of their last flushes.
+
+        This worker only flushes here when its flush thread has not done so
+        within flush_interval, so frequent scrapes do not each write to the store.
+        """
+        if not self.enabled:
+            return ""
+        flushed_at = self._flushed_at
+        if flushed_at is None or time.monotonic() - flushed_at >= self.flush_interval:
+            self.flush()
+        series = self.store.samples()
+        series.update(self.store.gauges())
+
+        families: Dict[str, List[Tuple[str, str, float]]] = {}
+        for (name, labels), value in series.items():
+            family = name
+            for suffix in _HISTOGRAM_SUFFIXES:
+                if name.endswith(suffix) and METRICS.get(name[:-len(suffix)], ("",))[0] == "histogram":
+                    family = name[:-len(suffix)]
+            families.setdefault(family, []).append((name, labels, value))
+
+        lines = []
+        for family in sorted(families):
+            kind, description = METRICS.get(family, ("untyped", ""))
+            if description:
+                lines.append(f"# HELP {family} {description}")
+            lines.append(f"# TYPE {family} {kind}")
+            for name, labels, value in sorted(families[family], key=_sample_order):
+                lines.append(f"{name}{{{labels}}} {_format_value(value)}" if labels else f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+_LE = re.compile(r',?le="([^"]*)"')
+
+
+def _sample_order(sample: Tuple[str, str, float]) -> Tuple[str, int, float]:
+    """Order samples by series, with a histogram's buckets in increasing order, then its sum and count."""
+    name, labels, _ = sample
+    match = _LE.search(labels)
+    if match is not None:
+        labels = labels[:match.start()] + labels[match.end():]
+        return labels, 0, float(match.group(1).replace("+Inf", "inf"))
+    for position, suffix in enumerate(_HISTOGRAM_SUFFIXES):
+        if name.endswith(suffix):
+            return labels, position, 0.0
+    return labels, 0, 0.0
+
+
+def _resident_memory() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as f:
+            return float(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE"))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def create_store(path: str = METRICS_DB) -> MetricsStore:
+    if not path:
+        return MemoryMetricsStore()
+    return SQLiteMetricsStore(path)
+
+
+metrics = Metrics()
+
+# Stage durations of the request being handled, for its Server-Timing header
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+def begin_request() -> None:
+    """Start collecting stage durations for the Server-Timing header of the current request."""
+    if metrics.enabled:
+        _request_timings.set({})
+
+
+def server_timing(total: Optional[float] = None) -> str:
+    """Server-Timing header value for the stages timed so far in this request."""
+    timings = _request_timings.get() or {}
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    metrics.observe("chatbot_stage_duration_seconds", seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        # Stages run more than once in a request (such as embedding batches) are summed
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def record_request(method: str, route: str, status: int, seconds: float) -> None:
+    metrics.observe("chatbot_http_request_duration_seconds", seconds, method=method, route=route)
+    metrics.inc("chatbot_http_requests_total", method=method, route=route, status=status)
+
+
+def count_api_call(operation: str, response: Any = None, outcome: str = "ok") -> None:
+    """Count an OpenAI request and the tokens its response reports using."""
+    if not metrics.enabled:
+        return
+    metrics.inc("chatbot_openai_requests_total", operation=operation, outcome=outcome)
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        prompt = getattr(usage, "prompt_tokens", None) or 0
+        completion = getattr(usage, "completion_tokens", None) or 0
+        if prompt:
+            metrics.inc("chatbot_openai_tokens_total", prompt, operation=operation, type="prompt")
+        if completion:
+            metrics.inc("chatbot_openai_tokens_total", completion, operation=operation, type="completion")
+
+
+class timed:
+    """Time a block as a stage: ``with timed("search"): ...``."""
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self) -> "timed":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if metrics.enabled:
+            record_stage(self.stage, time.perf_counter() - self.start)
+
+
+class timed_iter:
+    """Iterate while timing only the time spent producing items, recorded once when exhausted.
+
+    Pass the timed_iter wrapping an inner iterator as exclude to leave its
+    time out, so streamed stages (such as extraction feeding chunking) are
+    each measured on their own.
+    """
+
+    def __init__(self, stage: str, iterable: Iterable[T], exclude: Optional["timed_iter"] = None):
+        self.stage = stage
+        self.iterator = iter(iterable)
+        self.exclude = exclude
+        self.seconds = 0.0
+
+    def __iter__(self) -> Iterator[T]:
+        return self
+
+    def __next__(self) -> T:
+        start = time.perf_counter()
+        try:
+            item = next(self.iterator)
+        except StopIteration:
+            self.seconds += time.perf_counter() - start
+            if metrics.enabled:
+                seconds = self.seconds - (self.exclude.seconds if self.exclude is not None else 0.0)
+                record_stage(self.stage, max(0.0, seconds))
+            raise
+        self.seconds += time.perf_counter() - start
+        return item
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware recording request latency and adding a Server-Timing header.
+
+    The header lists the stages timed before the response started, so a
+    streamed answer reports retrieval but not generation.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        begin_request()
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                elapsed = time.perf_counter() - started
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(elapsed).encode("latin-1")))
+                message = dict(message, headers=headers)
+                # The router records the matched route in the scope; unmatched paths share one label
+                route = getattr(scope.get("route"), "path", "unmatched")
+                record_request(scope["method"], route, message["status"], elapsed)
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
@@ -0,0 +1,163 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, Any, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the estimated memory held by loaded namespaces in one worker
+VECTOR_STORE_MEMORY_BUDGET = int(os.environ.get("VECTOR_STORE_MEMORY_BUDGET", str(1024 * 1024 * 1024)))
+
+# Where evicted namespaces are spilled; set to an empty string to drop them instead
+VECTOR_STORE_NAMESPACE_DIR = os.environ.get("VECTOR_STORE_NAMESPACE_DIR", os.path.join("instance", "namespaces"))
+
+# Request header carrying a tenant id set by a trusted proxy; empty means per-session namespaces
+TENANT_HEADER = os.environ.get("TENANT_HEADER", "")
+
+DEFAULT_NAMESPACE = "default"
+
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9_-]")
+
+
+def normalize_namespace(name: Optional[str]) -> str:
+    """Turn a session or tenant id into a name that is safe to use as a directory.
+
+    The readable prefix alone would let different ids share a store, so
+    the name ends with a hash of the id as given.
+    """
+    name = (name or "").strip()
+    if not name:
+        return DEFAULT_NAMESPACE
+    prefix = _UNSAFE_CHARS.sub("_", name)[:32]
+    return f"{prefix}-{hashlib.sha256(name.encode('utf-8')).hexdigest()}"
+
+
+def _default_store(snapshot_dir: Optional[str]) -> "VectorStore":
+    # Imported with the first store, so FAISS is not loaded before an index is needed
+    from .vector_store import VectorStore
+
+    return VectorStore(snapshot_dir=snapshot_dir)
+
+
+class NamespaceManager:
+    """Per-session or per-tenant vector stores under a shared memory budget.
+
+    Each namespace gets its own index and document table. When the loaded
+    namespaces exceed the budget, the least recently used ones are written
+    to disk and unloaded, then loaded again the next time they are used.
+    Loading and spilling run outside the manager's lock, so a slow disk
+    only holds up requests for the namespace being loaded or spilled.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int = VECTOR_STORE_MEMORY_BUDGET,
+        spill_dir: Optional[str] = VECTOR_STORE_NAMESPACE_DIR,
+        store_factory: Optional[Callable[[Optional[str]], "VectorStore"]] = None,
+    ):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir or None
+        self._factory = store_factory or _default_store
+        self._stores: "OrderedDict[str, VectorStore]" = OrderedDict()
+        # Namespaces being loaded or spilled; requests for them wait for the event
+        self._busy: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, namespace: Optional[str]) -> "VectorStore":
+        """Return the store for a namespace, loading it from disk if needed."""
+        name = normalize_namespace(namespace)
+        while True:
+            with self._lock:
+                store = self._stores.get(name)
+                if store is not None:
+                    self._stores.move_to_end(name)
+                    break
+                busy = self._busy.get(name)
+                if busy is None:
+                    busy = self._busy[name] = threading.Event()
+                    break
+            busy.wait()
+
+        if store is None:
+            try:
+                store = self._factory(os.path.join(self.spill_dir, name) if self.spill_dir else None)
+            finally:
+                with self._lock:
+                    del self._busy[name]
+                    if store is not None:
+                        self._stores[name] = store
+                        self.loads += 1
+                busy.set()
+
+        self._enforce_budget(keep=name)
+        # Another worker may have ingested into this namespace
+        store.refresh()
+        return store
+
+    def memory_usage(self) -> int:
+        """Estimated bytes held by all loaded namespaces."""
+        with self._lock:
+            return sum(store.memory_usage() for store in self._stores.values())
+
+    def _enforce_budget(self, keep: str) -> None:
+        """Evict least recently used namespaces until the budget is met.
+
+        Victims are picked under the lock and spilled after releasing it;
+        until a spill is done, requests for that namespace wait for it
+        rather than loading a snapshot that is still being written.
+        """
+        victims = []
+        with self._lock:
+            usage = {name: store.memory_usage() for name, store in self._stores.items()}
+            total = sum(usage.values())
+            for name in list(self._stores):
+                if total <= self.memory_budget:
+                    break
+                if name == keep:
+                    continue
+                busy = self._busy[name] = threading.Event()
+                victims.append((name, self._stores.pop(name), busy))
+                total -= usage[name]
+                self.evictions += 1
+                logger.info(f"Evicting namespace {name} ({usage[name]} bytes), {total} bytes still loaded")
+
+        for name, store, busy in victims:
+            try:
+                store.close()
+                if self.spill_dir:
+                    store.save_snapshot()
+                else:
+                    logger.warning(f"Dropping namespace {name} with no spill directory configured")
+            finally:
+                with self._lock:
+                    del self._busy[name]
+                busy.set()
+
+    def gauges(self) -> List[Tuple[str, float, Dict[str, Any]]]:
+        """Index size and memory readings for the metrics endpoint."""
+        with self._lock:
+            stores = list(self._stores.values())
+        return [
+            ("chatbot_namespaces_loaded", len(stores), {}),
+            ("chatbot_index_vectors", sum(store.live_count() for store in stores), {}),
+            ("chatbot_vector_store_memory_bytes", sum(store.memory_usage() for store in stores), {}),
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        """Report loaded namespaces and cache behaviour for this worker."""
+        with self._lock:
+            return {
+                "loaded": len(self._stores),
+                "memory_bytes": sum(store.memory_usage() for store in self._stores.values()),
+                "memory_budget": self.memory_budget,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
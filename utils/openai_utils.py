@@ -1,13 +1,23 @@
 import os
+import json
+import time
 import logging
-from typing import List, Dict, Any
-from langchain.schema import Document
-from openai import OpenAI
+import threading
+from typing import List, Dict, Any, Iterator, AsyncIterator
+from langchain_core.documents import Document
+from .context_packing import ContextPacker
+from .metrics import count_api_call, record_stage, timed
+from .resilience import (
+    OPENAI_CONNECT_TIMEOUT, OPENAI_TIMEOUT, acall_with_retries, breakers, call_with_retries
+)
 
 # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
 # do not change this unless explicitly requested by the user
 MODEL = "gpt-4o"
 
+# Used when EMBEDDING_PROVIDER is "openai"; a model other than the three OpenAI ones needs EMBEDDING_DIMENSIONS
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-ada-002")
+
 logger = logging.getLogger(__name__)
 
 # Get API key from environment variable
@@ -15,45 +25,168 @@ OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
 if not OPENAI_API_KEY:
     logger.warning("OPENAI_API_KEY not found in environment variables. API calls will fail.")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Connections each client keeps to the API, shared by every in-flight request
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "200"))
+OPENAI_MAX_KEEPALIVE = int(os.environ.get("OPENAI_MAX_KEEPALIVE", "50"))
+
+# Seconds an idle connection is kept for reuse, saving a TLS handshake on the next call
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "30"))
+
+# Created on first use by get_client/get_async_client, so importing this module stays cheap
+client = None
+async_client = None
+_clients_lock = threading.Lock()
+
+def _client_options(httpx, http_client_class) -> Dict[str, Any]:
+    """Pool and timeout settings shared by both clients; retries are left to utils.resilience."""
+    return {
+        "api_key": OPENAI_API_KEY,
+        "max_retries": 0,
+        "timeout": httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+        "http_client": http_client_class(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+            )
+        ),
+    }
+
+def get_client():
+    """The shared OpenAI client, importing the SDK the first time it is needed."""
+    global client
+    if client is None:
+        with _clients_lock:
+            if client is None:
+                import httpx
+                from openai import OpenAI, DefaultHttpxClient
+                client = OpenAI(**_client_options(httpx, DefaultHttpxClient))
+    return client
+
+def get_async_client():
+    """The shared async client, used by the FastAPI app so waiting on OpenAI never blocks the event loop."""
+    global async_client
+    if async_client is None:
+        with _clients_lock:
+            if async_client is None:
+                import httpx
+                from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+                async_client = AsyncOpenAI(**_client_options(httpx, DefaultAsyncHttpxClient))
+    return async_client
+
+# Assembles retrieved chunks into the prompt context; created by get_context_packer, as loading
+# the tokenizer may download its encoding
+context_packer = None
+
+def get_context_packer() -> ContextPacker:
+    """The shared context packer, loading the model's tokenizer the first time it is needed."""
+    global context_packer
+    if context_packer is None:
+        with _clients_lock:
+            if context_packer is None:
+                context_packer = ContextPacker(MODEL)
+    return context_packer
+
+DIGEST_SYSTEM_PROMPT = (
+    "You are a helpful assistant that summarizes documents and generates insightful questions "
+    "about their content. You always reply with a single JSON object."
+)
+
+# Generic but content-focused questions used when generation fails
+FALLBACK_QUESTIONS = [
+    "What are the main ideas presented in this document?",
+    "Can you explain the key concepts mentioned in this document?",
+    "What conclusions or insights can be drawn from this document?"
+]
+
+def complete(operation: str, **params):
+    """Create a chat completion, timed as the llm_<operation> stage and counted with its token usage."""
+    with timed(f"llm_{operation}"):
+        try:
+            response = call_with_retries(
+                operation,
+                lambda timeout: get_client().chat.completions.create(model=MODEL, timeout=timeout, **params),
+                breakers["chat"],
+            )
+        except Exception:
+            count_api_call(operation, outcome="error")
+            raise
+    count_api_call(operation, response)
+    return response
+
+async def acomplete(operation: str, **params):
+    """Async variant of complete."""
+    with timed(f"llm_{operation}"):
+        try:
+            response = await acall_with_retries(
+                operation,
+                lambda timeout: get_async_client().chat.completions.create(model=MODEL, timeout=timeout, **params),
+                breakers["chat"],
+            )
+        except Exception:
+            count_api_call(operation, outcome="error")
+            raise
+    count_api_call(operation, response)
+    return response
 
 def get_embeddings(text: str) -> List[float]:
     """Get embeddings for the provided text."""
     try:
-        response = client.embeddings.create(
-            input=text,
-            model="text-embedding-ada-002",
+        response = call_with_retries(
+            "embeddings",
+            lambda timeout: get_client().embeddings.create(input=text, model=EMBEDDING_MODEL, timeout=timeout),
+            breakers["embeddings"],
+        )
+        return response.data[0].embedding
+    except Exception as e:
+        logger.error(f"Error getting embeddings: {str(e)}")
+        raise e
+
+async def aget_embeddings(text: str) -> List[float]:
+    """Get embeddings for the provided text without blocking the event loop."""
+    try:
+        response = await acall_with_retries(
+            "embeddings",
+            lambda timeout: get_async_client().embeddings.create(input=text, model=EMBEDDING_MODEL, timeout=timeout),
+            breakers["embeddings"],
         )
         return response.data[0].embedding
     except Exception as e:
         logger.error(f"Error getting embeddings: {str(e)}")
         raise e
 
+def build_answer_messages(question: str, chunks: List[Document]) -> List[Dict[str, str]]:
+    """Build the chat messages asking the model to answer from the chunks only."""
+    # Merge overlapping chunks and fit them to the context token budget
+    with timed("build_prompt"):
+        context = get_context_packer().pack(chunks).text
+    
+    # Create the prompt
+    prompt = f"""Answer the following question based on the provided context only. 
+    If you don't know the answer or the answer is not in the context, just say so.
+    
+    Context:
+    {context}
+    
+    Question: {question}
+    
+    Answer:"""
+    
+    return [
+        {"role": "system", "content": "You are a helpful assistant that provides answers based solely on the provided context."},
+        {"role": "user", "content": prompt}
+    ]
+
 def get_answer_from_chunks(question: str, chunks: List[Document]) -> str:
     """Generate an answer for the question based on the document chunks."""
     try:
-        # Combine the chunks
-        context = "\n\n".join([chunk.page_content for chunk in chunks])
-        
-        # Create the prompt
-        prompt = f"""Answer the following question based on the provided context only. 
-        If you don't know the answer or the answer is not in the context, just say so.
-        
-        Context:
-        {context}
-        
-        Question: {question}
-        
-        Answer:"""
+        messages = build_answer_messages(question, chunks)
         
         # Call OpenAI to generate response
-        logger.info(f"Sending prompt to OpenAI: {prompt[:100]}...")
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that provides answers based solely on the provided context."},
-                {"role": "user", "content": prompt}
-            ],
+        logger.info(f"Sending prompt to OpenAI: {messages[1]['content'][:100]}...")
+        response = complete(
+            "answer",
+            messages=messages,
             temperature=0.3,  # Lower temperature for more factual responses
             max_tokens=500
         )
@@ -64,46 +197,218 @@ def get_answer_from_chunks(question: str, chunks: List[Document]) -> str:
         logger.error(f"Error generating answer: {str(e)}")
         raise e
 
-
-def generate_content_specific_questions(document_summary: str, num_questions: int = 3) -> List[str]:
-    """Generate content-specific questions based on the document summary."""
+async def aget_answer_from_chunks(question: str, chunks: List[Document]) -> str:
+    """Async variant of get_answer_from_chunks."""
     try:
-        prompt = f"""Based on the following document summary, generate {num_questions} specific, 
-        insightful questions that could be asked about this content. Make the questions 
-        specific to the unique concepts, ideas, or information in this document:
-        
-        Document Summary:
-        {document_summary}
-        
-        Create questions that would demonstrate understanding of the key concepts in this specific document.
-        Return exactly {num_questions} questions, separated by newlines. 
-        Don't prefix with numbers or bullet points."""
+        messages = build_answer_messages(question, chunks)
         
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that generates insightful questions based on document content."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,  # Higher temperature for more creative questions
-            max_tokens=300
+        logger.info(f"Sending prompt to OpenAI: {messages[1]['content'][:100]}...")
+        response = await acomplete(
+            "answer",
+            messages=messages,
+            temperature=0.3,
+            max_tokens=500
         )
         
-        # Parse the response into a list of questions
-        questions_text = response.choices[0].message.content.strip()
-        questions = [q.strip() for q in questions_text.split('\n') if q.strip()]
-        
-        # Ensure we have the requested number of questions
-        while len(questions) < num_questions:
-            questions.append(f"What else can you tell me about this document?")
-            
-        return questions[:num_questions]  # Limit to exactly num_questions
+        return response.choices[0].message.content.strip()
     
     except Exception as e:
-        logger.error(f"Error generating content-specific questions: {str(e)}")
+        logger.error(f"Error generating answer: {str(e)}")
+        raise e
+
+def stream_answer_from_chunks(question: str, chunks: List[Document]) -> Iterator[str]:
+    """Yield answer tokens as the model generates them.
+    
+    Closing the generator early (for example when the client disconnects)
+    closes the upstream HTTP response, which cancels the completion.
+    """
+    messages = build_answer_messages(question, chunks)
+    logger.info(f"Streaming prompt to OpenAI: {messages[1]['content'][:100]}...")
+    started = time.perf_counter()
+    try:
+        # Only opening the stream is retried; once tokens have been sent it is too late
+        stream = call_with_retries(
+            "answer",
+            lambda timeout: get_client().chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=500,
+                stream=True,
+                # The last event then reports the tokens used
+                stream_options={"include_usage": True},
+                timeout=timeout,
+            ),
+            breakers["chat"],
+            # The stream is judged by how it ends, below
+            record_success=False,
+        )
+    except Exception:
+        count_api_call("answer", outcome="error")
+        raise
+    final = None
+    first_token = True
+    outcome = "cancelled"
+    try:
+        for event in stream:
+            if getattr(event, "usage", None):
+                final = event
+            if not event.choices:
+                continue
+            token = event.choices[0].delta.content
+            if token:
+                if first_token:
+                    record_stage("llm_answer_first_token", time.perf_counter() - started)
+                    first_token = False
+                yield token
+        outcome = "ok"
+    except Exception as e:
+        outcome = "error"
+        # A stream failing after it opened counts against the circuit like a failed call
+        breakers["chat"].record_failure(e)
+        raise
+    finally:
+        if outcome != "error":
+            # A stream the client abandoned was still being answered
+            breakers["chat"].record_success()
+        stream.close()
+        record_stage("llm_answer", time.perf_counter() - started)
+        count_api_call("answer", final, outcome)
+
+async def astream_answer_from_chunks(question: str, chunks: List[Document]) -> AsyncIterator[str]:
+    """Async variant of stream_answer_from_chunks; aclose() cancels the completion."""
+    messages = build_answer_messages(question, chunks)
+    logger.info(f"Streaming prompt to OpenAI: {messages[1]['content'][:100]}...")
+    started = time.perf_counter()
+    try:
+        # Only opening the stream is retried; once tokens have been sent it is too late
+        stream = await acall_with_retries(
+            "answer",
+            lambda timeout: get_async_client().chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=500,
+                stream=True,
+                # The last event then reports the tokens used
+                stream_options={"include_usage": True},
+                timeout=timeout,
+            ),
+            breakers["chat"],
+            # The stream is judged by how it ends, below
+            record_success=False,
+        )
+    except Exception:
+        count_api_call("answer", outcome="error")
+        raise
+    final = None
+    first_token = True
+    outcome = "cancelled"
+    try:
+        async for event in stream:
+            if getattr(event, "usage", None):
+                final = event
+            if not event.choices:
+                continue
+            token = event.choices[0].delta.content
+            if token:
+                if first_token:
+                    record_stage("llm_answer_first_token", time.perf_counter() - started)
+                    first_token = False
+                yield token
+        outcome = "ok"
+    except Exception as e:
+        outcome = "error"
+        # A stream failing after it opened counts against the circuit like a failed call
+        breakers["chat"].record_failure(e)
+        raise
+    finally:
+        if outcome != "error":
+            # A stream the client abandoned was still being answered
+            breakers["chat"].record_success()
+        await stream.close()
+        record_stage("llm_answer", time.perf_counter() - started)
+        count_api_call("answer", final, outcome)
+
+
+def build_digest_messages(chunks: List[Document], num_questions: int) -> List[Dict[str, str]]:
+    """Build the chat messages asking for a summary and questions as one JSON object."""
+    context = get_context_packer().pack(chunks).text
+    prompt = f"""Read the opening of the document below and return a JSON object with two keys:
+    "summary": a brief summary of the key topics and concepts in the document,
+    "questions": a list of exactly {num_questions} specific, insightful questions that
+    could be asked about this content, specific to its unique concepts, ideas or information.
+    Don't prefix the questions with numbers or bullet points.
+    
+    Document:
+    {context}"""
+    
+    return [
+        {"role": "system", "content": DIGEST_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+def parse_digest(digest_text: str, num_questions: int) -> Dict[str, Any]:
+    """Read the model's JSON reply into a summary and exactly num_questions questions."""
+    try:
+        data = json.loads(digest_text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Digest is not valid JSON: {str(e)}")
+    if not isinstance(data, dict):
+        raise ValueError("Digest is not a JSON object")
+    
+    questions = data.get("questions")
+    questions = [str(q).strip() for q in questions if str(q).strip()] if isinstance(questions, list) else []
+    
+    # Ensure we have the requested number of questions
+    while len(questions) < num_questions:
+        questions.append("What else can you tell me about this document?")
+    
+    return {"summary": str(data.get("summary") or "").strip(), "questions": questions[:num_questions]}
+
+def generate_document_digest(chunks: List[Document], num_questions: int = 3) -> Dict[str, Any]:
+    """Summarize the opening chunks of a document and suggest questions about it in one call."""
+    try:
+        response = complete(
+            "digest",
+            messages=build_digest_messages(chunks, num_questions),
+            response_format={"type": "json_object"},
+            temperature=0.7,  # Higher temperature for more creative questions
+            max_tokens=600
+        )
+        return parse_digest(response.choices[0].message.content, num_questions)
+    except Exception as e:
+        logger.error(f"Error generating document digest: {str(e)}")
+        raise e
+
+async def agenerate_document_digest(chunks: List[Document], num_questions: int = 3) -> Dict[str, Any]:
+    """Async variant of generate_document_digest."""
+    try:
+        response = await acomplete(
+            "digest",
+            messages=build_digest_messages(chunks, num_questions),
+            response_format={"type": "json_object"},
+            temperature=0.7,
+            max_tokens=600
+        )
+        return parse_digest(response.choices[0].message.content, num_questions)
+    except Exception as e:
+        logger.error(f"Error generating document digest: {str(e)}")
+        raise e
+
+
+def suggest_questions_for_chunks(chunks: List[Document], num_questions: int = 3) -> List[str]:
+    """Suggest questions about a document from its opening chunks."""
+    try:
+        return generate_document_digest(chunks[:3], num_questions)["questions"]
+    except Exception:
         # Fallback to generic but content-focused questions
-        return [
-            "What are the main ideas presented in this document?",
-            "Can you explain the key concepts mentioned in this document?",
-            "What conclusions or insights can be drawn from this document?"
-        ]
+        return list(FALLBACK_QUESTIONS)
+
+
+async def asuggest_questions_for_chunks(chunks: List[Document], num_questions: int = 3) -> List[str]:
+    """Async variant of suggest_questions_for_chunks."""
+    try:
+        return (await agenerate_document_digest(chunks[:3], num_questions))["questions"]
+    except Exception:
+        return list(FALLBACK_QUESTIONS)
@@ -0,0 +1,158 @@
+import os
+import shutil
+import logging
+import tempfile
+import threading
+import contextlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, BinaryIO, Callable, Iterator, List, Optional, Union
+
+if TYPE_CHECKING:
+    import PyPDF2
+
+logger = logging.getLogger(__name__)
+
+# Processes extracting PDF pages in parallel; 0 or 1 extracts in the calling thread
+PDF_EXTRACTION_WORKERS = int(os.environ.get("PDF_EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Pages handed to a worker process at a time
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", "8"))
+
+# Tasks queued ahead of the consumer per worker; bounds the text held in memory
+PDF_TASKS_AHEAD = int(os.environ.get("PDF_TASKS_AHEAD", "2"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Shared extraction pool, started on first use.
+
+    Workers are spawned rather than forked so they do not inherit the web
+    server's threads, locks or FAISS indexes.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACTION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _pdf_reader(stream: BinaryIO) -> "PyPDF2.PdfReader":
+    # PyPDF2 is only imported once there is a PDF to read
+    import PyPDF2
+
+    return PyPDF2.PdfReader(stream)
+
+
+def _page_text(reader: "PyPDF2.PdfReader", page_index: int) -> str:
+    text = reader.pages[page_index].extract_text() or ""
+    # The reader caches every object it has parsed, content streams included
+    reader.resolved_objects.clear()
+    return text
+
+
+def _extract_pages(file_path: str, start: int, end: int) -> List[str]:
+    """Extract the text of pages [start, end); runs in a worker process.
+
+    The file is opened per task, so a long-lived worker holds no handle to
+    a spooled upload once its pages are done and deleting it frees the space.
+    """
+    # Read from an open file rather than a path, which would load the whole file
+    with open(file_path, "rb") as f:
+        reader = _pdf_reader(f)
+        return [_page_text(reader, i) for i in range(start, end)]
+
+
+def _page_count(reader: "PyPDF2.PdfReader") -> int:
+    # len(reader.pages) would parse every page dictionary first
+    return int(reader.trailer["/Root"]["/Pages"]["/Count"])
+
+
+def count_pages(file_path: str) -> int:
+    """Number of pages in a PDF, read from the root of its page tree."""
+    with open(file_path, "rb") as f:
+        return _page_count(_pdf_reader(f))
+
+
+def _iter_reader_pages(reader: "PyPDF2.PdfReader", on_page: Optional[Callable[[int], None]]) -> Iterator[str]:
+    for page_index in range(_page_count(reader)):
+        yield _page_text(reader, page_index)
+        if on_page:
+            on_page(page_index + 1)
+
+
+@contextlib.contextmanager
+def _spooled_copy(stream: BinaryIO) -> Iterator[str]:
+    """Copy a stream to a temporary file that worker processes can open; removed on exit."""
+    with tempfile.NamedTemporaryFile(prefix="upload-", suffix=".pdf", delete=False) as f:
+        stream.seek(0)
+        shutil.copyfileobj(stream, f)
+    try:
+        yield f.name
+    finally:
+        os.unlink(f.name)
+
+
+def iter_pdf_pages(
+    source: Union[str, BinaryIO],
+    on_page: Optional[Callable[[int], None]] = None,
+    workers: int = PDF_EXTRACTION_WORKERS,
+    pages_per_task: int = PDF_PAGES_PER_TASK,
+) -> Iterator[str]:
+    """Yield the text of each page in order while later pages are extracted in parallel.
+
+    Only a few tasks are queued ahead of the consumer, so memory stays
+    bounded by the pages in flight rather than the size of the file.
+    source is a path or a seekable binary stream. Worker processes cannot
+    share a stream, so one with pages for more than a single task (such as
+    a large sync upload) is first copied to a temporary file; smaller ones
+    are read in the calling thread.
+    on_page, if given, is called with the number of pages yielded so far.
+    """
+    if not isinstance(source, str):
+        source.seek(0)
+        reader = _pdf_reader(source)
+        if workers <= 1 or _page_count(reader) <= max(1, pages_per_task):
+            yield from _iter_reader_pages(reader, on_page)
+            return
+        with _spooled_copy(source) as file_path:
+            yield from iter_pdf_pages(file_path, on_page, workers, pages_per_task)
+        return
+
+    file_path = source
+    total = count_pages(file_path)
+    pages_per_task = max(1, pages_per_task)
+    ranges = [(start, min(start + pages_per_task, total)) for start in range(0, total, pages_per_task)]
+
+    if workers <= 1 or len(ranges) <= 1:
+        # Not worth shipping to another process
+        with open(file_path, "rb") as f:
+            yield from _iter_reader_pages(_pdf_reader(f), on_page)
+        return
+
+    pool = _get_pool()
+    path = os.path.abspath(file_path)
+    window = deque()
+    next_range = 0
+    page_number = 0
+    try:
+        while next_range < len(ranges) or window:
+            while next_range < len(ranges) and len(window) < workers * max(1, PDF_TASKS_AHEAD):
+                window.append(pool.submit(_extract_pages, path, *ranges[next_range]))
+                next_range += 1
+            for text in window.popleft().result():
+                page_number += 1
+                yield text
+                if on_page:
+                    on_page(page_number)
+    finally:
+        # Stop work nobody is waiting for if the consumer gave up early
+        for future in window:
+            future.cancel()
+    logger.info(f"Extracted {page_number} pages from {file_path} with {workers} workers")
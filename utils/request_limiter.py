@@ -1,84 +1,293 @@
-import logging
+import os
+import abc
 import time
-from datetime import datetime, timedelta
-from collections import defaultdict
-from typing import Dict, Tuple, List
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+from .metrics import metrics
 
 logger = logging.getLogger(__name__)
 
-# Store usage limits: IP+User Agent -> [(timestamp, count), ...]
-# Using in-memory storage for simplicity; in production, use Redis or database
-usage_tracker = defaultdict(list)
-
 # Maximum allowed requests per user
-MAX_REQUESTS = 10
+MAX_REQUESTS = int(os.environ.get("RATE_LIMIT_MAX_REQUESTS", "10"))
 
 # Time window for tracking (24 hours)
-TIME_WINDOW = 24 * 60 * 60  # seconds
+TIME_WINDOW = int(os.environ.get("RATE_LIMIT_WINDOW", str(24 * 60 * 60)))  # seconds
+
+# "sqlite" shares counts between every worker on the host; "memory" is per process
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "sqlite")
+
+# SQLite database used by the sqlite backend
+RATE_LIMIT_DB = os.environ.get("RATE_LIMIT_DB", os.path.join("instance", "rate_limits.db"))
+
+# Clients tracked by the memory backend before the least recently seen are dropped
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000"))
+
+# Seconds between sweeps removing clients idle for more than two windows
+RATE_LIMIT_EXPIRE_INTERVAL = float(os.environ.get("RATE_LIMIT_EXPIRE_INTERVAL", "300"))
+
+
+def sliding_window_count(window_start: float, current: float, previous: float, now: float, window: float) -> Tuple[float, float, float]:
+    """Roll a client's counters forward to now.
+
+    Returns the start of the current fixed window, the count in it and the
+    count in the window before. A sliding-window estimate is
+    ``previous * (1 - elapsed / window) + current``.
+    """
+    start = now - (now % window)
+    if start == window_start:
+        return start, current, previous
+    if start - window_start == window:
+        return start, 0.0, current
+    return start, 0.0, 0.0
+
+
+def estimate(start: float, current: float, previous: float, now: float, window: float) -> float:
+    """Requests counted in the sliding window ending at now."""
+    return previous * (1.0 - (now - start) / window) + current
+
+
+class RateLimitBackend(abc.ABC):
+    """Storage for per-client sliding-window counters.
+
+    Every operation touches a single key, so checks cost the same no matter
+    how many clients are tracked.
+    """
+
+    @abc.abstractmethod
+    def hit(self, key: str, limit: int, window: float, cost: int = 1) -> Tuple[bool, float]:
+        """Count cost requests if they fit under limit; return (allowed, estimate afterwards)."""
+
+    @abc.abstractmethod
+    def peek(self, key: str, window: float) -> float:
+        """Requests currently counted for key."""
+
+    @abc.abstractmethod
+    def reset(self, key: str) -> None:
+        """Forget the requests counted for key."""
+
+    @abc.abstractmethod
+    def expire(self, window: float) -> int:
+        """Forget clients idle for more than two windows; return how many."""
+
+    @abc.abstractmethod
+    def dump(self) -> Dict[str, Dict[str, Any]]:
+        """Usage of every tracked client, keyed by client."""
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """Per-process counters in a bounded LRU dictionary."""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max(1, max_keys)
+        self._counters: "OrderedDict[str, Tuple[float, float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, limit: int, window: float, cost: int = 1) -> Tuple[bool, float]:
+        now = time.time()
+        with self._lock:
+            start, current, previous = sliding_window_count(*self._counters.get(key, (0.0, 0.0, 0.0)), now, window)
+            count = estimate(start, current, previous, now, window)
+            allowed = count + cost <= limit
+            if allowed:
+                current += cost
+                count += cost
+            self._counters[key] = (start, current, previous)
+            self._counters.move_to_end(key)
+            while len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+        return allowed, count
+
+    def peek(self, key: str, window: float) -> float:
+        now = time.time()
+        with self._lock:
+            counters = self._counters.get(key)
+        if counters is None:
+            return 0.0
+        return estimate(*sliding_window_count(*counters, now, window), now, window)
+
+    def reset(self, key: str) -> None:
+        with self._lock:
+            self._counters.pop(key, None)
+
+    def expire(self, window: float) -> int:
+        cutoff = time.time() - 2 * window
+        with self._lock:
+            idle = [key for key, (start, _, _) in self._counters.items() if start < cutoff]
+            for key in idle:
+                del self._counters[key]
+        return len(idle)
+
+    def dump(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            items = list(self._counters.items())
+        return {
+            key: {"window_start": datetime.fromtimestamp(start), "current": current, "previous": previous}
+            for key, (start, current, previous) in items
+        }
+
+
+class SQLiteRateLimitBackend(RateLimitBackend):
+    """Counters in a SQLite table shared by every worker on the host."""
+
+    def __init__(self, path: str = RATE_LIMIT_DB):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits ("
+            "key TEXT PRIMARY KEY, "
+            "window_start REAL NOT NULL, "
+            "current REAL NOT NULL, "
+            "previous REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Losing the last few counts in a power cut is acceptable for a rate limit
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def hit(self, key: str, limit: int, window: float, cost: int = 1) -> Tuple[bool, float]:
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT window_start, current, previous FROM rate_limits WHERE key = ?", (key,)
+            ).fetchone()
+            start, current, previous = sliding_window_count(*(row or (0.0, 0.0, 0.0)), now, window)
+            count = estimate(start, current, previous, now, window)
+            allowed = count + cost <= limit
+            if allowed:
+                current += cost
+                count += cost
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (key, window_start, current, previous) VALUES (?, ?, ?, ?)",
+                (key, start, current, previous),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, count
+
+    def peek(self, key: str, window: float) -> float:
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT window_start, current, previous FROM rate_limits WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return 0.0
+        return estimate(*sliding_window_count(*row, now, window), now, window)
+
+    def reset(self, key: str) -> None:
+        self._connection().execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+    def expire(self, window: float) -> int:
+        cutoff = time.time() - 2 * window
+        return self._connection().execute("DELETE FROM rate_limits WHERE window_start < ?", (cutoff,)).rowcount
+
+    def dump(self) -> Dict[str, Dict[str, Any]]:
+        rows = self._connection().execute("SELECT key, window_start, current, previous FROM rate_limits").fetchall()
+        return {
+            key: {"window_start": datetime.fromtimestamp(start), "current": current, "previous": previous}
+            for key, start, current, previous in rows
+        }
+
+
+def create_backend(name: str = RATE_LIMIT_BACKEND) -> RateLimitBackend:
+    if name == "memory":
+        return MemoryRateLimitBackend()
+    if name == "sqlite":
+        return SQLiteRateLimitBackend()
+    raise ValueError(f"Unknown rate limit backend: {name}. Expected memory or sqlite")
+
+
+_backend: Optional[RateLimitBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> RateLimitBackend:
+    """The process-wide backend, created with its expiry thread on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend = create_backend()
+                threading.Thread(target=_expire_forever, args=(backend,), name="rate-limit-expiry", daemon=True).start()
+                _backend = backend
+    return _backend
+
+
+def set_backend(backend: RateLimitBackend) -> None:
+    """Swap in a different backend, e.g. a memory one for local testing."""
+    global _backend
+    _backend = backend
+
+
+def _expire_forever(backend: RateLimitBackend) -> None:
+    while True:
+        time.sleep(RATE_LIMIT_EXPIRE_INTERVAL)
+        try:
+            expired = backend.expire(TIME_WINDOW)
+            if expired:
+                logger.info(f"Expired {expired} idle rate limit entries")
+        except Exception as e:
+            logger.error(f"Error expiring rate limit entries: {str(e)}")
+
 
 class RequestLimiter:
     @staticmethod
     def get_client_identifier(request) -> str:
         """Create a unique identifier based on IP and user agent"""
-        ip = request.remote_addr
+        # Flask requests carry remote_addr, Starlette requests the client address
+        ip = getattr(request, "remote_addr", None) or (request.client.host if getattr(request, "client", None) else None)
         user_agent = request.headers.get('User-Agent', 'Unknown')
-        # Create a simple hash for the client
-        return f"{ip}_{hash(user_agent)}"
+        # hash() is salted per process, so workers would disagree on the key
+        return f"{ip}_{hashlib.sha1(user_agent.encode('utf-8')).hexdigest()[:16]}"
 
     @staticmethod
-    def can_make_request(request) -> Tuple[bool, int]:
+    def can_make_request(request, cost: int = 1) -> Tuple[bool, int]:
         """
         Check if the client can make a request based on their usage.
         Returns (allowed, requests_remaining)
         """
         client_id = RequestLimiter.get_client_identifier(request)
-        now = time.time()
-        
-        # Remove old entries beyond the time window
-        current_usage = usage_tracker[client_id]
-        current_usage = [entry for entry in current_usage if now - entry[0] < TIME_WINDOW]
-        usage_tracker[client_id] = current_usage
-        
-        # Count requests in the time window
-        request_count = len(current_usage)
-        
+        allowed, count = get_backend().hit(client_id, MAX_REQUESTS, TIME_WINDOW, cost)
+
         # Check if user has hit the limit
-        if request_count >= MAX_REQUESTS:
+        if not allowed:
             logger.warning(f"Request limit reached for client {client_id}")
+            metrics.inc("chatbot_rate_limit_rejections_total")
             return False, 0
-        
-        # Update usage tracker with the current request
-        usage_tracker[client_id].append((now, request_count + 1))
-        
+
         # Return allowed status and remaining requests
-        return True, MAX_REQUESTS - (request_count + 1)
+        return True, max(0, int(MAX_REQUESTS - count))
 
     @staticmethod
-    def get_usage_data() -> Dict[str, List[Tuple[datetime, int]]]:
+    def get_usage_data() -> Dict[str, Dict[str, Any]]:
         """Get all usage data for debugging"""
-        return {k: [(datetime.fromtimestamp(ts), count) for ts, count in v] 
-                for k, v in usage_tracker.items()}
-                
+        return get_backend().dump()
+
     @staticmethod
     def reset_for_client(request) -> None:
         """Reset usage for a specific client - for testing only"""
-        client_id = RequestLimiter.get_client_identifier(request)
-        if client_id in usage_tracker:
-            del usage_tracker[client_id]
-            
+        get_backend().reset(RequestLimiter.get_client_identifier(request))
+
     @staticmethod
     def get_remaining_requests(request) -> int:
         """Get remaining requests for a client"""
         client_id = RequestLimiter.get_client_identifier(request)
-        now = time.time()
-        
-        # Remove old entries beyond the time window
-        current_usage = usage_tracker.get(client_id, [])
-        current_usage = [entry for entry in current_usage if now - entry[0] < TIME_WINDOW]
-        
-        if not current_usage:
-            return MAX_REQUESTS
-            
-        # Count requests in the time window
-        request_count = len(current_usage)
-        return max(0, MAX_REQUESTS - request_count)
\ No newline at end of file
+        return max(0, int(MAX_REQUESTS - get_backend().peek(client_id, TIME_WINDOW)))
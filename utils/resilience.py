@@ -0,0 +1,396 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Seconds an HTTP request may spend waiting on OpenAI in total; 0 leaves only the per-call timeout
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", "60"))
+
+# Sync ingestion makes as many embedding calls as the document needs, so it gets no overall
+# deadline; each call keeps its own timeout and retries. /ask/batch sets a budget scaled to its size.
+DEADLINE_EXEMPT_PATHS = ("/upload", "/process-url")
+
+# Seconds a single OpenAI call may take, and to establish its connection
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", "30"))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", "5"))
+
+# Retries of a failed call (on connection errors, timeouts, 408, 409, 429 and 5xx only),
+# after a random delay of up to base * 2^attempt seconds, capped
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", "2"))
+OPENAI_RETRY_BASE = float(os.environ.get("OPENAI_RETRY_BASE", "0.25"))
+OPENAI_RETRY_CAP = float(os.environ.get("OPENAI_RETRY_CAP", "4"))
+
+# Seconds before a second, identical embeddings request is sent if the first has not answered; 0 disables hedging
+EMBEDDING_HEDGE_DELAY = float(os.environ.get("EMBEDDING_HEDGE_DELAY", "0"))
+
+# Consecutive failed calls that open the circuit, and seconds it stays open before a trial call
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# Statuses worth trying again, as the OpenAI SDK's own retry logic uses
+RETRYABLE_STATUSES = frozenset({408, 409, 429})
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised instead of calling upstream once the request's deadline has passed."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling upstream while its circuit is open."""
+
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+def set_deadline(seconds: float = REQUEST_DEADLINE) -> None:
+    """Give the current request seconds to finish its upstream calls; 0 removes the deadline."""
+    _deadline.set(time.monotonic() + seconds if seconds > 0 else None)
+
+
+def request_deadline(path: str, seconds: float = REQUEST_DEADLINE) -> float:
+    """The overall deadline of a request to path: seconds, or 0 for the exempt paths."""
+    return 0 if path in DEADLINE_EXEMPT_PATHS else seconds
+
+
+@contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    """Limit upstream calls in the block to seconds, or less if an outer deadline is sooner."""
+    current = _deadline.get()
+    token = _deadline.set(min(time.monotonic() + seconds, current or float("inf")))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_left() -> Optional[float]:
+    """Seconds until the current deadline, or None without one."""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def call_timeout(default: float = OPENAI_TIMEOUT) -> float:
+    """Timeout for the next upstream call: default, shortened to what is left of the deadline."""
+    left = time_left()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded before calling upstream")
+    return min(default, left)
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    return getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed call may succeed if repeated: network trouble, timeouts, throttling and server errors."""
+    if isinstance(error, (DeadlineExceeded, CircuitOpenError)):
+        return False
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUSES or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # Connection errors, timeouts and errors sent mid-stream carry no status, nor do
+    # transport errors raised while reading a stream; both libraries are loaded once a call failed
+    try:
+        import httpx
+        import openai
+    except ImportError:
+        return False
+    return isinstance(error, (openai.APIError, httpx.TransportError))
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, error: Optional[BaseException] = None,
+                  base: float = OPENAI_RETRY_BASE, cap: float = OPENAI_RETRY_CAP) -> float:
+    """Seconds to wait before retry number attempt (from 1), with full jitter.
+
+    A Retry-After the server sent is respected when it is within the cap.
+    """
+    retry_after = _retry_after(error) if error is not None else None
+    if retry_after is not None and 0 <= retry_after <= cap:
+        return retry_after
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """Fail fast while an upstream is failing, then let one trial call through.
+
+    After failure_threshold consecutive retryable failures the circuit
+    opens and calls raise CircuitOpenError without reaching upstream. Once
+    reset_timeout has passed a single call is let through (half-open): its
+    success closes the circuit, its failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.failure_threshold > 0
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a call may go ahead now."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_running = False
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+            wait_for = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+        metrics.inc("chatbot_circuit_rejections_total", upstream=self.name)
+        raise CircuitOpenError(f"{self.name} circuit is open after repeated failures; retry in {wait_for:.0f}s")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._close()
+
+    def _close(self) -> None:
+        """Close the circuit; caller holds the lock."""
+        if self.state != self.CLOSED:
+            logger.info(f"{self.name} circuit closed")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_running = False
+
+    def record_failure(self, error: BaseException) -> None:
+        """Count a failed call; errors the caller caused (bad requests, auth) leave the circuit alone."""
+        if not self.enabled:
+            return
+        retryable = is_retryable(error)
+        with self._lock:
+            if not retryable:
+                if self.state == self.HALF_OPEN:
+                    # The trial reached upstream and got an answer, so upstream is up
+                    self._close()
+                return
+            self.failures += 1
+            self._trial_running = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"{self.name} circuit opened after {self.failures} failures: {str(error)}")
+                    self.opened += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "opened": self.opened}
+
+
+# One circuit per kind of upstream call, so slow completions do not cut off embeddings
+breakers = {"chat": CircuitBreaker("chat"), "embeddings": CircuitBreaker("embeddings")}
+
+
+def circuit_gauges() -> List[Tuple[str, float, Dict[str, Any]]]:
+    """Circuit states for the metrics endpoint: 0 closed, 0.5 half-open, 1 open."""
+    levels = {CircuitBreaker.CLOSED: 0.0, CircuitBreaker.HALF_OPEN: 0.5, CircuitBreaker.OPEN: 1.0}
+    return [("chatbot_circuit_state", levels[breaker.state], {"upstream": name}) for name, breaker in breakers.items()]
+
+
+metrics.add_collector(circuit_gauges)
+
+
+def _retrying(operation: str, error: BaseException, attempt: int, retries: int) -> Optional[float]:
+    """The delay before retrying a failed attempt, or None if it must not be retried."""
+    if attempt > retries or not is_retryable(error):
+        return None
+    delay = backoff_delay(attempt, error)
+    left = time_left()
+    if left is not None and delay >= left:
+        return None
+    metrics.inc("chatbot_openai_retries_total", operation=operation)
+    logger.warning(f"OpenAI {operation} call failed ({str(error)}), retry {attempt} of {retries} in {delay:.2f}s")
+    return delay
+
+
+def call_with_retries(
+    operation: str,
+    call: Callable[[float], T],
+    breaker: Optional[CircuitBreaker] = None,
+    retries: int = OPENAI_MAX_RETRIES,
+    timeout: float = OPENAI_TIMEOUT,
+    record_success: bool = True,
+) -> T:
+    """Run call(timeout) through the breaker, retrying retryable failures with jittered backoff.
+
+    Each attempt's timeout is cut to what is left of the request's deadline,
+    and no retry is started that could not finish before it. Without
+    record_success a call that returns is not yet counted as a success,
+    for callers such as streams that can still fail afterwards.
+    """
+    attempt = 0
+    while True:
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            result = call(call_timeout(timeout))
+        except Exception as e:
+            if breaker is not None:
+                breaker.record_failure(e)
+            attempt += 1
+            delay = _retrying(operation, e, attempt, retries)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+        if breaker is not None and record_success:
+            breaker.record_success()
+        return result
+
+
+async def acall_with_retries(
+    operation: str,
+    call: Callable[[float], Awaitable[T]],
+    breaker: Optional[CircuitBreaker] = None,
+    retries: int = OPENAI_MAX_RETRIES,
+    timeout: float = OPENAI_TIMEOUT,
+    record_success: bool = True,
+) -> T:
+    """Async variant of call_with_retries."""
+    attempt = 0
+    while True:
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            result = await call(call_timeout(timeout))
+        except Exception as e:
+            if breaker is not None:
+                breaker.record_failure(e)
+            attempt += 1
+            delay = _retrying(operation, e, attempt, retries)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        if breaker is not None and record_success:
+            breaker.record_success()
+        return result
+
+
+_hedge_pool: Optional[ThreadPoolExecutor] = None
+_hedge_pool_lock = threading.Lock()
+
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    global _hedge_pool
+    with _hedge_pool_lock:
+        if _hedge_pool is None:
+            # Room for two requests from each of many concurrent callers
+            _hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+        return _hedge_pool
+
+
+def hedged(operation: str, call: Callable[[], T], delay: float) -> T:
+    """Run call, starting an identical second one if the first has not finished after delay seconds.
+
+    The first to succeed wins; the loser is left to finish in the
+    background, bounded by its timeout. Fails only if both fail. When no
+    hedge thread frees up within delay, call runs once on the caller's thread.
+    """
+    if delay <= 0:
+        return call()
+    pool = _get_hedge_pool()
+    context = contextvars.copy_context()
+    started = threading.Event()
+
+    def first_call() -> T:
+        started.set()
+        return call()
+
+    first = pool.submit(context.copy().run, first_call)
+    # The delay counts from when the request is sent, not from when it was queued for a thread
+    if not started.wait(delay) and first.cancel():
+        # Every hedge thread is busy, so a second request would queue too; make this one here instead
+        return call()
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+    metrics.inc("chatbot_openai_hedged_requests_total", operation=operation)
+    pending = {first, pool.submit(context.copy().run, call)}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+async def ahedged(operation: str, call: Callable[[], Awaitable[T]], delay: float) -> T:
+    """Async variant of hedged; the losing request is cancelled."""
+    if delay <= 0:
+        return await call()
+    first = asyncio.ensure_future(call())
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+    metrics.inc("chatbot_openai_hedged_requests_total", operation=operation)
+    pending = {first, asyncio.ensure_future(call())}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+    finally:
+        for task in pending:
+            task.cancel()
+    raise error
+
+
+class DeadlineMiddleware:
+    """ASGI middleware giving each HTTP request REQUEST_DEADLINE seconds for its upstream calls.
+
+    Requests to DEADLINE_EXEMPT_PATHS get no overall deadline.
+    """
+
+    def __init__(self, app, seconds: float = REQUEST_DEADLINE):
+        self.app = app
+        self.seconds = seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            set_deadline(request_deadline(scope["path"], self.seconds))
+        await self.app(scope, receive, send)
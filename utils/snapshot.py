@@ -0,0 +1,353 @@
+import os
+import json
+import mmap
+import fcntl
+import logging
+import contextlib
+import numpy as np
+from typing import List, Optional, Dict, Any, Iterator
+import faiss
+from langchain_core.documents import Document
+from .ann_index import LayeredIndex
+from .chunk_table import ChunkTable
+from .lexical_index import LexicalIndex
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.faiss"
+INDEX_DELTA_FILE = "index_delta.bin"
+TEXTS_FILE = "texts.bin"
+TEXT_OFFSETS_FILE = "text_offsets.bin"
+METADATA_FILE = "metadata.jsonl"
+METADATA_OFFSETS_FILE = "metadata_offsets.bin"
+LEXICAL_FILE = "lexical.npz"
+LOCK_FILE = ".lock"
+
+_OFFSET_DTYPE = np.dtype("<i8")
+_VECTOR_DTYPE = np.dtype("<f4")
+
+
+def snapshot_path(directory: str, name: str, epoch: int = 0) -> str:
+    """Path of a chunk file; compaction rewrites chunks under a new epoch's names."""
+    if not epoch:
+        return os.path.join(directory, name)
+    base, ext = os.path.splitext(name)
+    return os.path.join(directory, f"{base}.{epoch}{ext}")
+
+
+_CHUNK_FILES = (TEXTS_FILE, TEXT_OFFSETS_FILE, METADATA_FILE, METADATA_OFFSETS_FILE, LEXICAL_FILE)
+
+
+def _map_file(path: str) -> Optional[mmap.mmap]:
+    """Memory-map a file read-only; empty or missing files map to None."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _map_offsets(path: str, count: int) -> np.ndarray:
+    if count == 0:
+        return np.zeros(0, dtype=_OFFSET_DTYPE)
+    return np.memmap(path, dtype=_OFFSET_DTYPE, mode="r", shape=(count,))
+
+
+class MappedDocuments:
+    """List-like view over snapshot chunks that builds Documents on access.
+
+    Chunk texts and metadata stay in the page cache and are shared by every
+    process that maps the same snapshot. Chunks added after loading are
+    kept in a ChunkTable until the next snapshot is written.
+    """
+
+    def __init__(self, directory: str, count: int, epoch: int = 0):
+        self._count = count
+        self._texts = _map_file(snapshot_path(directory, TEXTS_FILE, epoch))
+        self._text_ends = _map_offsets(snapshot_path(directory, TEXT_OFFSETS_FILE, epoch), count)
+        self._metadata = _map_file(snapshot_path(directory, METADATA_FILE, epoch))
+        self._metadata_ends = _map_offsets(snapshot_path(directory, METADATA_OFFSETS_FILE, epoch), count)
+        self._extra = ChunkTable()
+
+    def __len__(self) -> int:
+        return self._count + len(self._extra)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("document index out of range")
+        if idx >= self._count:
+            return self._extra[idx - self._count]
+        return Document(page_content=self.text(idx), metadata=self.metadata(idx))
+
+    def __iter__(self) -> Iterator[Document]:
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the mapped chunk texts plus documents held in memory."""
+        mapped = int(self._text_ends[-1]) if self._count else 0
+        return mapped + self._extra.nbytes
+
+    def text(self, idx: int) -> str:
+        if idx >= self._count:
+            return self._extra.text(idx - self._count)
+        start = int(self._text_ends[idx - 1]) if idx > 0 else 0
+        end = int(self._text_ends[idx])
+        return self._texts[start:end].decode("utf-8") if end > start else ""
+
+    def metadata(self, idx: int) -> Dict[str, Any]:
+        if idx >= self._count:
+            return self._extra.metadata(idx - self._count)
+        start = int(self._metadata_ends[idx - 1]) if idx > 0 else 0
+        end = int(self._metadata_ends[idx])
+        return json.loads(self._metadata[start:end]) if end > start else {}
+
+    def append(self, document: Document) -> None:
+        self._extra.append(document)
+
+    def extend(self, documents: List[Document]) -> None:
+        self._extra.extend(documents)
+
+
+def read_manifest(directory: str) -> Optional[Dict[str, Any]]:
+    """Return the snapshot manifest, or None if no snapshot has been written."""
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {manifest.get('version')}")
+    return manifest
+
+
+@contextlib.contextmanager
+def snapshot_lock(directory: str):
+    """Hold an exclusive cross-process lock on a snapshot directory."""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), "a") as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def _append_records(path: str, offsets_path: str, records: List[bytes], start: int) -> None:
+    """Append records to a blob file and its end-offset table from position start.
+
+    Anything past the committed position (left behind by an interrupted
+    write) is truncated first.
+    """
+    committed = 0
+    if start > 0:
+        with open(offsets_path, "rb") as f:
+            f.seek((start - 1) * _OFFSET_DTYPE.itemsize)
+            committed = int(np.frombuffer(f.read(_OFFSET_DTYPE.itemsize), dtype=_OFFSET_DTYPE)[0])
+
+    ends = np.cumsum([len(r) for r in records], dtype=np.int64) + committed
+    with open(path, "ab") as f:
+        f.truncate(committed)
+        for record in records:
+            f.write(record)
+        f.flush()
+        os.fsync(f.fileno())
+    with open(offsets_path, "ab") as f:
+        f.truncate(start * _OFFSET_DTYPE.itemsize)
+        f.write(ends.astype(_OFFSET_DTYPE).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _replace_file(path: str, write) -> None:
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _delta_path(directory: str, index_count: int) -> str:
+    """Path of the vectors appended after an index file holding index_count rows."""
+    return snapshot_path(directory, INDEX_DELTA_FILE, index_count)
+
+
+def _append_vectors(path: str, vectors: np.ndarray, start: int) -> None:
+    """Write vectors to a delta file from row start, dropping anything after it."""
+    row_bytes = vectors.shape[1] * _VECTOR_DTYPE.itemsize
+    with open(path, "ab") as f:
+        f.truncate(start * row_bytes)
+        f.write(np.ascontiguousarray(vectors, dtype=_VECTOR_DTYPE).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read_vectors(path: str, count: int, dimension: int) -> np.ndarray:
+    with open(path, "rb") as f:
+        data = f.read(count * dimension * _VECTOR_DTYPE.itemsize)
+    if len(data) != count * dimension * _VECTOR_DTYPE.itemsize:
+        raise ValueError(f"Index delta {path} holds fewer than the {count} vectors the manifest lists")
+    return np.frombuffer(data, dtype=_VECTOR_DTYPE).reshape(count, dimension)
+
+
+def _checkpointed_rows(
+    previous: Optional[Dict[str, Any]], index, extra: Dict[str, Any], epoch: int, start: int
+) -> Optional[int]:
+    """Rows in the index file that new vectors can be appended after, or None to rewrite it.
+
+    The file is only reusable if index was mapped from it, it belongs to
+    the same epoch and index type, and it holds no rows beyond the ones
+    committed before start.
+    """
+    if previous is None or previous.get("epoch", 0) != epoch or previous["count"] != start:
+        return None
+    if not isinstance(index, LayeredIndex) or index.base.ntotal != previous.get("index_count", previous["count"]):
+        return None
+    for key in ("index_type", "quantization"):
+        if key in extra and previous.get(key) != extra[key]:
+            return None
+    return previous.get("index_count", previous["count"])
+
+
+def write_snapshot(
+    directory: str,
+    index,
+    documents,
+    start: int,
+    extra: Optional[Dict[str, Any]] = None,
+    epoch: int = 0,
+    lexical: Optional[LexicalIndex] = None,
+    delta_ratio: float = 0.0,
+) -> int:
+    """Persist documents[start:] and their vectors; returns the committed count.
+
+    index is a FAISS index or a LayeredIndex mapped from this snapshot;
+    documents is a ChunkTable or MappedDocuments.
+
+    Chunk data is appended, so each call only writes what is new. When
+    index is layered over the snapshot's index file, the original vectors
+    of the new rows are appended to a delta file as well, until the rows
+    outside the index file exceed delta_ratio of the rows in it; then the
+    full index (and the BM25 index, whose missing rows are otherwise
+    tokenized again on load) is checkpointed, so the cost of rewriting it
+    is spread over a share of the corpus rather than paid on every write.
+    A delta_ratio of 0 rewrites the index every time.
+    The manifest is replaced last, which makes the snapshot visible atomically.
+    Writing with a new epoch (and start=0) puts the chunks in fresh files,
+    so processes still mapping the previous epoch are unaffected; those
+    files are removed once the manifest points at the new ones.
+    Callers must hold snapshot_lock.
+    """
+    os.makedirs(directory, exist_ok=True)
+    previous = read_manifest(directory)
+    count = len(documents)
+    extra = extra or {}
+    index_count = _checkpointed_rows(previous, index, extra, epoch, start)
+    if index_count is not None and count - index_count > delta_ratio * index_count:
+        index_count = None
+
+    _append_records(
+        snapshot_path(directory, TEXTS_FILE, epoch),
+        snapshot_path(directory, TEXT_OFFSETS_FILE, epoch),
+        [documents.text(i).encode("utf-8") for i in range(start, count)],
+        start,
+    )
+    _append_records(
+        snapshot_path(directory, METADATA_FILE, epoch),
+        snapshot_path(directory, METADATA_OFFSETS_FILE, epoch),
+        [json.dumps(documents.metadata(i), separators=(",", ":")).encode("utf-8") for i in range(start, count)],
+        start,
+    )
+    if index_count is None:
+        index_count = count
+        full = index.merged() if isinstance(index, LayeredIndex) else index
+        _replace_file(os.path.join(directory, INDEX_FILE), lambda path: faiss.write_index(full, path))
+        if lexical is not None:
+            _replace_file(snapshot_path(directory, LEXICAL_FILE, epoch), lexical.write)
+    elif count > start:
+        _append_vectors(
+            _delta_path(directory, index_count),
+            index.delta.reconstruct_batch(np.arange(start, count, dtype=np.int64)),
+            start - index_count,
+        )
+
+    manifest = {"version": SNAPSHOT_VERSION, "count": count, "index_count": index_count, "dimension": index.d, "epoch": epoch}
+    manifest.update(extra)
+
+    def write_manifest(path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+    _replace_file(os.path.join(directory, MANIFEST_FILE), write_manifest)
+    logger.info(
+        f"Wrote snapshot to {directory}: {count - start} new chunks, {count} total"
+        f"{'' if index_count == count else f', {count - index_count} vectors in the index delta'}"
+    )
+
+    if previous is not None:
+        stale = []
+        if previous.get("epoch", 0) != epoch:
+            stale.extend(snapshot_path(directory, name, previous.get("epoch", 0)) for name in _CHUNK_FILES)
+        previous_index_count = previous.get("index_count", previous["count"])
+        if previous_index_count not in (index_count, previous["count"]):
+            stale.append(_delta_path(directory, previous_index_count))
+        for path in stale:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    return count
+
+
+def read_lexical(directory: str, epoch: int = 0) -> Optional[LexicalIndex]:
+    """Load an epoch's lexical index, or None if it was never written or is unreadable.
+
+    The file may cover more or fewer rows than the manifest if another
+    worker is writing; callers reconcile it with the manifest's count.
+    """
+    path = snapshot_path(directory, LEXICAL_FILE, epoch)
+    if not os.path.exists(path):
+        return None
+    try:
+        return LexicalIndex.read(path)
+    except Exception as e:
+        logger.warning(f"Could not read lexical index {path}: {str(e)}")
+        return None
+
+
+def map_index(directory: str) -> LayeredIndex:
+    """Memory-map the snapshot's index file read-only, with an empty delta for new rows.
+
+    Every process mapping the same file shares its pages through the page
+    cache; FAISS cannot add to a mapped index, hence the delta.
+    """
+    return LayeredIndex(faiss.read_index(os.path.join(directory, INDEX_FILE), faiss.IO_FLAG_MMAP_IFC))
+
+
+def load_snapshot(directory: str):
+    """Memory-map a snapshot; returns (index, documents, manifest) or None.
+
+    The index is a LayeredIndex whose delta holds the vectors in the
+    snapshot's index delta file.
+    """
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return None
+    index = map_index(directory)
+    index_count = manifest.get("index_count", manifest["count"])
+    if index.ntotal != index_count:
+        raise ValueError(
+            f"Snapshot index holds {index.ntotal} vectors but manifest lists {index_count}"
+        )
+    if manifest["count"] > index_count:
+        index.add(_read_vectors(_delta_path(directory, index_count), manifest["count"] - index_count, index.d))
+    documents = MappedDocuments(directory, manifest["count"], manifest.get("epoch", 0))
+    logger.info(f"Loaded snapshot from {directory}: {manifest['count']} chunks")
+    return index, documents, manifest
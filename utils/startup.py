@@ -0,0 +1,163 @@
+import os
+import time
+import importlib
+import logging
+import threading
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# How the app warms up once it is created: "background" answers /health at once and
+# /ready when warm, "sync" warms up before the app is returned, "off" loads everything on first use
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "background").lower()
+
+# Comma-separated namespaces loaded during warm-up; with gunicorn --preload every worker shares their indexes
+STARTUP_PRELOAD_NAMESPACES = [
+    name.strip() for name in os.environ.get("STARTUP_PRELOAD_NAMESPACES", "").split(",") if name.strip()
+]
+
+
+def process_started_at() -> float:
+    """When this process was started, from /proc where available, else now."""
+    try:
+        with open("/proc/self/stat") as f:
+            # The command name may contain spaces; the fields after it do not
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/stat") as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith("btime "))
+        return boot_time + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, StopIteration):
+        return time.time()
+
+
+class Startup:
+    """Where a cold start spends its time, and the work done once per process.
+
+    Stages are timed from process start: imports and app setup are marked
+    as they finish, then registered warm-up steps (importing heavy
+    libraries, creating clients, loading indexes) run in the background so
+    /health answers straight away while /ready waits for them. A fork
+    waits for the warm-up first, so workers forked by gunicorn --preload
+    inherit warm state and share loaded indexes copy-on-write.
+    Background services must not run in the process that forks, so they
+    are started per process by start_services.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.started_at = process_started_at()
+        self.ready_at: Optional[float] = None
+        self.stages: List[Tuple[str, float]] = []
+        self.errors: Dict[str, str] = {}
+        self._last = self.started_at
+        self._steps: List[Tuple[str, Callable[[], Any]]] = []
+        self._services: List[Callable[[], Any]] = []
+        self._services_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def mark(self, name: str) -> None:
+        """Record the time since the previous stage (or process start) as the stage name."""
+        now = time.time()
+        self.stages.append((name, now - self._last))
+        self._last = now
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time the block as the stage name."""
+        started = time.time()
+        try:
+            yield
+        finally:
+            now = time.time()
+            self.stages.append((name, now - started))
+            self._last = now
+
+    def add_step(self, name: str, step: Callable[[], Any]) -> None:
+        """Register work for the warm-up; anything it skips is done on first use instead."""
+        self._steps.append((name, step))
+
+    def add_imports(self, *modules: str) -> None:
+        """Import modules during the warm-up instead of in the first request that uses them."""
+        for module in modules:
+            self.add_step(f"import {module}", partial(importlib.import_module, module))
+
+    def add_service(self, start: Callable[[], Any]) -> None:
+        """Register a background service to start in each process that serves requests."""
+        self._services.append(start)
+
+    def warm_up(self, mode: str = STARTUP_WARMUP) -> None:
+        """Run the warm-up steps as configured; the app is ready once they finish."""
+        if self._thread is not None or self._ready.is_set():
+            return
+        if mode == "off":
+            self._finish()
+        elif mode == "sync":
+            self._run_steps()
+        else:
+            self._thread = threading.Thread(target=self._run_steps, name="startup-warm-up", daemon=True)
+            self._thread.start()
+
+    def _run_steps(self) -> None:
+        for name, step in self._steps:
+            try:
+                with self.stage(name):
+                    step()
+            except Exception as e:
+                logger.error(f"Warm-up step {name} failed, it will be retried on first use: {str(e)}")
+                self.errors[name] = str(e)
+        self._finish()
+
+    def _finish(self) -> None:
+        self.ready_at = time.time()
+        self._ready.set()
+        stages = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.stages)
+        logger.info(f"Ready {self.ready_at - self.started_at:.2f}s after process start ({stages})")
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the warm-up has finished; False if it timed out."""
+        return self._ready.wait(timeout)
+
+    def before_fork(self) -> None:
+        """Finish the warm-up before forking so children start warm and never inherit it half done."""
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def start_services(self) -> None:
+        """Start the registered services once in this process; cheap enough to call on every request."""
+        pid = os.getpid()
+        if self._services_pid == pid:
+            return
+        with self._lock:
+            if self._services_pid == pid:
+                return
+            for start in self._services:
+                start()
+            self._services_pid = pid
+
+    def report(self) -> Dict[str, Any]:
+        """Startup timings for /ready, in seconds."""
+        return {
+            "ready": self.ready,
+            "pid": os.getpid(),
+            # Workers forked from a preloaded app report the startup of the process that loaded it
+            "preloaded": os.getpid() != self.pid,
+            "ready_after": round(self.ready_at - self.started_at, 3) if self.ready_at else None,
+            "uptime": round(time.time() - self.started_at, 3),
+            "stages": [{"name": name, "seconds": round(seconds, 4)} for name, seconds in self.stages],
+            "errors": self.errors,
+        }
+
+
+# Shared by the app modules; created when the first of them is imported
+startup = Startup()
+
+os.register_at_fork(before=startup.before_fork)
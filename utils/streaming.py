@@ -0,0 +1,104 @@
+import json
+import logging
+from typing import List, Dict, Any, Iterator, AsyncIterator, Callable, Optional
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# Headers that stop proxies (nginx, Replit's router) from buffering the stream
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def describe_sources(chunks: List[Document]) -> List[Dict[str, str]]:
+    """Short, display-ready descriptions of the retrieved chunks."""
+    return [
+        {
+            "source": chunk.metadata.get("source", ""),
+            "preview": chunk.page_content[:200] + "...",
+        }
+        for chunk in chunks
+    ]
+
+
+def answer_events(
+    chunks: List[Document],
+    tokens: Callable[[], Iterator[str]],
+    extra: Dict[str, Any] = None,
+    on_complete: Optional[Callable[[str], None]] = None,
+) -> Iterator[str]:
+    """Relay an answer as SSE: sources first, then tokens, then done or error.
+
+    The token stream is only opened once the sources event has been
+    produced, and it is closed when this generator is closed, so a client
+    that disconnects mid-answer cancels the upstream completion.
+    on_complete receives the full answer once the stream finishes cleanly.
+    """
+    yield sse_event("sources", {"sources": describe_sources(chunks)})
+
+    stream = None
+    parts = []
+    try:
+        stream = tokens()
+        for token in stream:
+            parts.append(token)
+            yield sse_event("token", {"token": token})
+    except GeneratorExit:
+        logger.info("Client disconnected during streamed answer")
+        raise
+    except Exception as e:
+        logger.error(f"Error streaming answer: {str(e)}")
+        yield sse_event("error", {"detail": f"Error answering question: {str(e)}"})
+        return
+    finally:
+        if stream is not None and hasattr(stream, "close"):
+            stream.close()
+
+    answer = "".join(parts)
+    if on_complete:
+        on_complete(answer)
+    done = {"answer": answer}
+    done.update(extra or {})
+    yield sse_event("done", done)
+
+
+async def aanswer_events(
+    chunks: List[Document],
+    tokens: Callable[[], AsyncIterator[str]],
+    extra: Dict[str, Any] = None,
+    on_complete: Optional[Callable[[str], None]] = None,
+) -> AsyncIterator[str]:
+    """Async variant of answer_events for token streams from the async client."""
+    yield sse_event("sources", {"sources": describe_sources(chunks)})
+
+    stream = None
+    parts = []
+    try:
+        stream = tokens()
+        async for token in stream:
+            parts.append(token)
+            yield sse_event("token", {"token": token})
+    except GeneratorExit:
+        logger.info("Client disconnected during streamed answer")
+        raise
+    except Exception as e:
+        logger.error(f"Error streaming answer: {str(e)}")
+        yield sse_event("error", {"detail": f"Error answering question: {str(e)}"})
+        return
+    finally:
+        if stream is not None and hasattr(stream, "aclose"):
+            await stream.aclose()
+
+    answer = "".join(parts)
+    if on_complete:
+        on_complete(answer)
+    done = {"answer": answer}
+    done.update(extra or {})
+    yield sse_event("done", done)
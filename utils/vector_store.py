@@ -1,72 +1,941 @@
+import os
+import uuid
+import asyncio
+import hashlib
 import logging
+import threading
+import contextlib
+import contextvars
+import concurrent.futures
 import numpy as np
-from typing import List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 import faiss
-from langchain.schema import Document
-from .openai_utils import get_embeddings
+from langchain_core.documents import Document
+from .embedding_pipeline import EmbeddingPipeline
+from .embedding_providers import EmbeddingMismatchError, EmbeddingProvider
+from .chunk_table import ChunkTable
+from .snapshot import (
+    MANIFEST_FILE,
+    MappedDocuments,
+    load_snapshot,
+    map_index,
+    read_lexical,
+    read_manifest,
+    snapshot_lock,
+    write_snapshot,
+)
+from .lexical_index import LexicalIndex, reciprocal_rank_fusion
+from .metrics import timed
+from .ann_index import (
+    INDEX_TYPES,
+    LayeredIndex,
+    QUANTIZATIONS,
+    VECTOR_INDEX_TYPE,
+    VECTOR_QUANTIZATION,
+    VECTOR_INDEX_PROMOTION_THRESHOLD,
+    build_index,
+    configure_search,
+    empty_copy,
+    estimate_index_bytes,
+    evaluate_index,
+    index_type_of,
+    min_training_size,
+    quantization_of,
+    search_parameters,
+)
 
 logger = logging.getLogger(__name__)
 
+# Directory holding the on-disk snapshot; set to an empty string to keep the store in memory only
+VECTOR_STORE_SNAPSHOT_DIR = os.environ.get("VECTOR_STORE_SNAPSHOT_DIR", os.path.join("instance", "vector_store"))
+
+# "incremental" writes after every add_documents call, "interval" writes on a timer
+VECTOR_STORE_SNAPSHOT_MODE = os.environ.get("VECTOR_STORE_SNAPSHOT_MODE", "incremental")
+
+# Seconds between snapshots in interval mode
+VECTOR_STORE_SNAPSHOT_INTERVAL = float(os.environ.get("VECTOR_STORE_SNAPSHOT_INTERVAL", "60"))
+
+# Vectors of new chunks are appended to a delta file until they reach this share of the
+# snapshot index, which is then rewritten in full; 0 rewrites the index on every snapshot
+VECTOR_STORE_INDEX_DELTA_RATIO = float(os.environ.get("VECTOR_STORE_INDEX_DELTA_RATIO", "0.25"))
+
+# Share of deleted rows at which the index is compacted in the background; 0 disables compaction
+VECTOR_STORE_COMPACT_RATIO = float(os.environ.get("VECTOR_STORE_COMPACT_RATIO", "0.25"))
+
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical")
+
+# "hybrid" fuses vector and BM25 rankings, "vector" and "lexical" use one of them
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "hybrid")
+
+# Seconds a hybrid search waits for the query embedding before answering from BM25 alone; 0 waits indefinitely
+QUERY_EMBEDDING_BUDGET = float(os.environ.get("QUERY_EMBEDDING_BUDGET", "2"))
+
+# Candidates taken from each ranking before they are fused
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "20"))
+
+# Snapshots written before indexes recorded their embedding model were all built with ada-002
+_LEGACY_SIGNATURE = {"embedding_provider": "openai", "embedding_model": "text-embedding-ada-002"}
+
+_query_pool = None
+_query_pool_lock = threading.Lock()
+
+
+def _get_query_pool() -> concurrent.futures.ThreadPoolExecutor:
+    """Threads that embed queries so a search can stop waiting on a slow one."""
+    global _query_pool
+    with _query_pool_lock:
+        if _query_pool is None:
+            _query_pool = concurrent.futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix="query-embed")
+        return _query_pool
+
+
+def chunk_id(document: Document) -> str:
+    """Stable id of a chunk, derived from its source and text.
+
+    Re-ingesting unchanged content yields the same ids, which is what lets
+    the store skip duplicates and drop the chunks a new version no longer has.
+    """
+    cid = document.metadata.get("chunk_id")
+    if not cid:
+        source = document.metadata.get("source", "")
+        cid = hashlib.sha256(f"{source}\0{document.page_content}".encode("utf-8")).hexdigest()[:32]
+    return cid
+
+
+def _describe_signature(signature: Dict[str, Any]) -> str:
+    return f"{signature['embedding_provider']}/{signature['embedding_model']} ({signature['dimension']} dimensions)"
+
+
+def _row(embeddings_np: Optional[np.ndarray], i: int) -> np.ndarray:
+    return embeddings_np[i] if embeddings_np is not None else np.zeros(0, dtype=np.float32)
+
+
 class VectorStore:
-    """In-memory vector store using FAISS."""
-    
-    def __init__(self):
-        self.documents = []
+    """FAISS vector store with optional memory-mapped snapshots on disk.
+
+    The store starts on exact flat search and, once it holds
+    promotion_threshold vectors, rebuilds itself as index_type in a
+    background thread while queries keep running against the flat index.
+    With quantization set, the rebuilt index stores its vectors as float16
+    or int8 codes instead of float32.
+
+    Rows are addressed by position. Deleting a chunk tombstones its row,
+    which searches then skip; once enough rows are dead the live ones are
+    copied into a fresh index in the background.
+
+    A BM25 index over the same rows is kept in step with the vector index,
+    so searches can fuse both rankings or fall back to BM25 when the query
+    embedding is slow or unavailable.
+    """
+
+    def __init__(
+        self,
+        embedder: Optional[Union[EmbeddingPipeline, EmbeddingProvider]] = None,
+        snapshot_dir: Optional[str] = VECTOR_STORE_SNAPSHOT_DIR,
+        snapshot_mode: str = VECTOR_STORE_SNAPSHOT_MODE,
+        snapshot_interval: float = VECTOR_STORE_SNAPSHOT_INTERVAL,
+        index_delta_ratio: float = VECTOR_STORE_INDEX_DELTA_RATIO,
+        index_type: str = VECTOR_INDEX_TYPE,
+        quantization: str = VECTOR_QUANTIZATION,
+        promotion_threshold: int = VECTOR_INDEX_PROMOTION_THRESHOLD,
+        compact_ratio: float = VECTOR_STORE_COMPACT_RATIO,
+        retrieval_mode: str = RETRIEVAL_MODE,
+        query_budget: float = QUERY_EMBEDDING_BUDGET,
+        hybrid_candidates: int = HYBRID_CANDIDATES,
+    ):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type}. Expected one of {', '.join(INDEX_TYPES)}")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}. Expected one of {', '.join(QUANTIZATIONS)}")
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode}. Expected one of {', '.join(RETRIEVAL_MODES)}")
+
+        self.documents = ChunkTable()
         self.index = None
-        self.dimension = 1536  # OpenAI ada-002 embedding dimension
-    
+        if isinstance(embedder, EmbeddingProvider):
+            embedder = EmbeddingPipeline(provider=embedder)
+        self.embedder = embedder or EmbeddingPipeline()
+        self.dimension = self.embedder.dimension
+        self.snapshot_dir = snapshot_dir or None
+        self.snapshot_mode = snapshot_mode
+        self.snapshot_interval = snapshot_interval
+        self.index_delta_ratio = index_delta_ratio
+        self._lock = threading.RLock()
+        self._persisted = 0
+        self._timer = None
+        self._closed = False
+        self.index_type = index_type
+        # Product quantization already compresses the vectors
+        self.quantization = "none" if index_type == "ivf_pq" else quantization
+        self.promotion_threshold = max(promotion_threshold, min_training_size(index_type, self.quantization))
+        self._promotion = None
+        self._manifest_mtime = None
+        self.compact_ratio = compact_ratio
+        self._compaction = None
+        # Compaction renumbers rows, so each compacted snapshot starts a new epoch
+        self._epoch = 0
+        self._deleted = set()
+        self._persisted_deleted = set()
+        # source -> {chunk id -> row} for live rows, built on first use
+        self._catalog: Optional[Dict[str, Dict[str, int]]] = None
+        self._search_params = None
+        self.lexical = LexicalIndex()
+        self.retrieval_mode = retrieval_mode
+        self.query_budget = query_budget
+        self.hybrid_candidates = hybrid_candidates
+        # Changes whenever the searchable contents change; used to invalidate cached answers
+        self.generation = uuid.uuid4().hex
+
+        if self.snapshot_dir:
+            self.load_snapshot()
+            if self.snapshot_mode == "interval":
+                self._schedule_snapshot()
+
     def is_initialized(self) -> bool:
         """Check if the vector store is initialized with documents."""
-        return self.index is not None and len(self.documents) > 0
-    
-    def add_documents(self, documents: List[Document]) -> None:
-        """Add documents to the vector store."""
+        return self.index is not None and self.live_count() > 0
+
+    def live_count(self) -> int:
+        """Number of chunks that have not been deleted."""
+        return len(self.documents) - len(self._deleted)
+
+    def add_documents(
+        self,
+        documents: List[Document],
+        on_progress: Optional[Callable[[int], None]] = None,
+    ) -> int:
+        """Add documents to the vector store, skipping chunks it already holds.
+
+        on_progress is called with the number of chunks embedded so far.
+        Returns the number of chunks actually added.
+        """
         logger.info(f"Adding {len(documents)} documents to vector store")
-        
+
         if not documents:
             logger.warning("No documents to add")
+            return 0
+
+        with self._lock:
+            fresh = [documents[i] for i in self._unseen(documents)]
+        if not fresh:
+            logger.info("All documents are already in the vector store")
+            return 0
+
+        # Create embeddings for the new documents in concurrent batches
+        with timed("embed"):
+            embeddings_np = self.embedder.embed([doc.page_content for doc in fresh], on_progress=on_progress)
+
+        with self._lock, timed("index"):
+            # Another request may have added some of them while we were embedding
+            keep = self._unseen(fresh)
+            self._append([fresh[i] for i in keep], embeddings_np[keep])
+
+        if len(keep) < len(documents):
+            logger.info(f"Skipped {len(documents) - len(keep)} chunks already in the vector store")
+        logger.info(f"Vector store now contains {self.live_count()} documents")
+        self._maybe_promote()
+
+        if self.snapshot_dir and self.snapshot_mode == "incremental":
+            self.save_snapshot()
+        return len(keep)
+
+    def _unseen(self, documents: List[Document]) -> List[int]:
+        """Positions of documents whose chunk id is not already live; stamps the ids into metadata."""
+        catalog = self._ensure_catalog()
+        seen = set()
+        fresh = []
+        for i, doc in enumerate(documents):
+            cid = chunk_id(doc)
+            doc.metadata["chunk_id"] = cid
+            key = (doc.metadata.get("source", ""), cid)
+            if key in seen or cid in catalog.get(key[0], ()):
+                continue
+            seen.add(key)
+            fresh.append(i)
+        return fresh
+
+    def _append(self, documents: List[Document], embeddings_np: np.ndarray) -> None:
+        """Add embedded documents as new rows; caller holds the lock."""
+        if not documents:
             return
-        
-        # Store the documents
+        if embeddings_np.shape[1] != self.dimension:
+            raise EmbeddingMismatchError(
+                f"Got {embeddings_np.shape[1]}-dimensional embeddings for an index of {self.dimension} dimensions"
+            )
+        catalog = self._ensure_catalog()
+        first = len(self.documents)
+        # Store the documents only once their embeddings exist
         self.documents.extend(documents)
-        
-        # Create embeddings for the documents
-        embeddings = []
-        for doc in documents:
-            embedding = get_embeddings(doc.page_content)
-            embeddings.append(embedding)
-        
-        # Convert to numpy array
-        embeddings_np = np.array(embeddings, dtype=np.float32)
-        
+        for row, doc in enumerate(documents, start=first):
+            catalog.setdefault(doc.metadata.get("source", ""), {})[chunk_id(doc)] = row
+        self.lexical.add(doc.page_content for doc in documents)
+
         # Create or update the index
-        if self.index is None:
+        if self.index is None and self._promotes() and len(embeddings_np) >= self.promotion_threshold:
+            # The first batch is large enough to train the target index directly
+            self.index = build_index(self.index_type, self.dimension, embeddings_np, self.quantization)
+        elif self.index is None:
             # Create a new index
             self.index = faiss.IndexFlatL2(self.dimension)
             self.index.add(embeddings_np)
         else:
             # Add to existing index
             self.index.add(embeddings_np)
-        
-        logger.info(f"Vector store now contains {len(self.documents)} documents")
-    
+        self.generation = uuid.uuid4().hex
+
+    def _ensure_catalog(self) -> Dict[str, Dict[str, int]]:
+        """Map live chunks by source and id; caller holds the lock.
+
+        Chunks indexed more than once before ids existed are tombstoned
+        here, keeping the copy that was added last.
+        """
+        if self._catalog is None:
+            catalog: Dict[str, Dict[str, int]] = {}
+            duplicates = []
+            for row in range(len(self.documents)):
+                if row in self._deleted:
+                    continue
+                doc = self.documents[row]
+                rows = catalog.setdefault(doc.metadata.get("source", ""), {})
+                previous = rows.get(chunk_id(doc))
+                if previous is not None:
+                    duplicates.append(previous)
+                rows[chunk_id(doc)] = row
+            self._catalog = catalog
+            if duplicates:
+                logger.info(f"Removing {len(duplicates)} duplicate chunks")
+                self._tombstone(duplicates)
+        return self._catalog
+
+    def _tombstone(self, rows: Iterable[int]) -> int:
+        """Mark rows deleted so searches skip them; caller holds the lock."""
+        rows = {int(row) for row in rows} - self._deleted
+        if not rows:
+            return 0
+        if self._catalog is not None:
+            for row in rows:
+                doc = self.documents[row]
+                chunks = self._catalog.get(doc.metadata.get("source", ""), {})
+                if chunks.get(chunk_id(doc)) == row:
+                    del chunks[chunk_id(doc)]
+                    if not chunks:
+                        del self._catalog[doc.metadata.get("source", "")]
+        self._deleted |= rows
+        self.lexical.remove(rows)
+        self._search_params = None
+        self.generation = uuid.uuid4().hex
+        return len(rows)
+
+    def retain_chunks(self, chunk_ids_by_source: Dict[str, Iterable[str]]) -> int:
+        """Delete every chunk of the given sources whose id is not listed.
+
+        This is how a re-ingested source replaces its previous version:
+        unchanged chunks were skipped on add, and the ones the new version
+        no longer has are dropped here. Returns the number of chunks deleted.
+        """
+        with self._lock, self._synced():
+            catalog = self._ensure_catalog()
+            rows = []
+            for source, ids in chunk_ids_by_source.items():
+                ids = set(ids)
+                rows.extend(row for cid, row in catalog.get(source, {}).items() if cid not in ids)
+            removed = self._tombstone(rows)
+            if removed and self.snapshot_dir and self.snapshot_mode == "incremental":
+                self._write()
+
+        if removed:
+            logger.info(f"Deleted {removed} chunks from {len(chunk_ids_by_source)} sources")
+            self._maybe_compact()
+        return removed
+
+    def delete_source(self, source: str) -> int:
+        """Delete every chunk of a source; returns how many were deleted."""
+        return self.retain_chunks({source: ()})
+
+    def has_source(self, source: str) -> bool:
+        """Whether any live chunk comes from source."""
+        with self._lock:
+            return source in self._ensure_catalog()
+
+    def sources(self) -> Dict[str, int]:
+        """Live chunk counts by source."""
+        with self._lock:
+            return {source: len(chunks) for source, chunks in self._ensure_catalog().items()}
+
     def similarity_search(self, query: str, k: int = 4) -> List[Document]:
         """Search for similar documents based on the query."""
+        return self.similarity_search_with_ids(query, k)[0]
+
+    def similarity_search_with_ids(
+        self, query: str, k: int = 4, mode: Optional[str] = None
+    ) -> Tuple[List[Document], List[int], np.ndarray]:
+        """Search for similar documents, also returning their ids and the query embedding.
+
+        The embedding is empty when the results came from BM25 alone.
+        """
         logger.info(f"Performing similarity search for query: {query}")
-        
+        return self.similarity_search_batch([query], k, mode)[0]
+
+    def similarity_search_batch(
+        self, queries: List[str], k: int = 4, mode: Optional[str] = None
+    ) -> List[Tuple[List[Document], List[int], np.ndarray]]:
+        """similarity_search_with_ids for several queries, in order.
+
+        The queries are embedded together (one embeddings request for those
+        not cached) and searched with a single FAISS call on the matrix of
+        their embeddings.
+        """
+        mode = mode or self.retrieval_mode
+
         if not self.is_initialized():
             logger.warning("Vector store is not initialized")
+            return [([], [], np.zeros(0, dtype=np.float32)) for _ in queries]
+        if not queries:
             return []
-        
-        # Get embedding for the query
-        query_embedding = get_embeddings(query)
-        query_embedding_np = np.array([query_embedding], dtype=np.float32)
-        
-        # Search the index
-        distances, indices = self.index.search(query_embedding_np, k=min(k, len(self.documents)))
-        
-        # Get the documents for the indices
-        results = [self.documents[idx] for idx in indices[0]]
-        
+
+        # Get embeddings for the queries (served from the cache when seen before)
+        with timed("embed_query"):
+            query_embeddings_np = None if mode == "lexical" else self._embed_queries(queries, mode)
+        ranked = self.search_batch(queries, query_embeddings_np, k, mode)
+        logger.info(f"Found {sum(len(ids) for _, ids in ranked)} relevant documents for {len(queries)} queries")
+        return [(results, ids, _row(query_embeddings_np, i)) for i, (results, ids) in enumerate(ranked)]
+
+    async def asimilarity_search_with_ids(
+        self, query: str, k: int = 4, mode: Optional[str] = None
+    ) -> Tuple[List[Document], List[int], np.ndarray]:
+        """Async variant of similarity_search_with_ids.
+
+        The query is embedded through the async client and the FAISS search
+        runs in a worker thread, so the event loop is never blocked.
+        """
+        logger.info(f"Performing similarity search for query: {query}")
+        return (await self.asimilarity_search_batch([query], k, mode))[0]
+
+    async def asimilarity_search_batch(
+        self, queries: List[str], k: int = 4, mode: Optional[str] = None
+    ) -> List[Tuple[List[Document], List[int], np.ndarray]]:
+        """Async variant of similarity_search_batch."""
+        mode = mode or self.retrieval_mode
+
+        if not self.is_initialized():
+            logger.warning("Vector store is not initialized")
+            return [([], [], np.zeros(0, dtype=np.float32)) for _ in queries]
+        if not queries:
+            return []
+
+        with timed("embed_query"):
+            query_embeddings_np = None if mode == "lexical" else await self._aembed_queries(queries, mode)
+        ranked = await asyncio.to_thread(self.search_batch, queries, query_embeddings_np, k, mode)
+        logger.info(f"Found {sum(len(ids) for _, ids in ranked)} relevant documents for {len(queries)} queries")
+        return [(results, ids, _row(query_embeddings_np, i)) for i, (results, ids) in enumerate(ranked)]
+
+    def _embed_queries(self, queries: List[str], mode: str) -> Optional[np.ndarray]:
+        """Embed queries, or give up on them (None) once a hybrid search's budget is spent."""
+        if mode == "vector":
+            return self.embedder.embed(queries)
+        try:
+            if self.query_budget <= 0:
+                return self.embedder.embed(queries)
+            # A late embedding still lands in the cache for the next time the question is asked
+            future = _get_query_pool().submit(contextvars.copy_context().run, self.embedder.embed, queries)
+            return future.result(timeout=self.query_budget)
+        except concurrent.futures.TimeoutError:
+            logger.warning(f"Query embedding took longer than {self.query_budget}s; searching BM25 only")
+        except Exception as e:
+            logger.warning(f"Query embedding failed; searching BM25 only: {str(e)}")
+        return None
+
+    async def _aembed_queries(self, queries: List[str], mode: str) -> Optional[np.ndarray]:
+        """Async variant of _embed_queries."""
+        if mode == "vector":
+            return await self.embedder.aembed(queries)
+        task = asyncio.ensure_future(self.embedder.aembed(queries))
+        try:
+            if self.query_budget <= 0:
+                return await task
+            return await asyncio.wait_for(asyncio.shield(task), self.query_budget)
+        except asyncio.TimeoutError:
+            logger.warning(f"Query embedding took longer than {self.query_budget}s; searching BM25 only")
+            # Let it finish in the background and fill the cache; its outcome is not needed here
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        except Exception as e:
+            logger.warning(f"Query embedding failed; searching BM25 only: {str(e)}")
+        return None
+
+    def search(
+        self,
+        query: str,
+        query_embedding_np: Optional[np.ndarray],
+        k: int = 4,
+        mode: Optional[str] = None,
+    ) -> Tuple[List[Document], List[int]]:
+        """Rank chunks for a query with whichever signals are available.
+
+        Hybrid mode fuses the vector and BM25 rankings with reciprocal rank
+        fusion; without a query embedding only BM25 is used.
+        """
+        results, ids = self.search_batch([query], query_embedding_np, k, mode)[0]
         logger.info(f"Found {len(results)} relevant documents")
-        return results
+        return results, ids
+
+    def search_batch(
+        self,
+        queries: List[str],
+        query_embeddings_np: Optional[np.ndarray],
+        k: int = 4,
+        mode: Optional[str] = None,
+    ) -> List[Tuple[List[Document], List[int]]]:
+        """search for several queries, with one row of query_embeddings_np per query."""
+        mode = mode or self.retrieval_mode
+        with self._lock, timed("search"):
+            if query_embeddings_np is None or mode == "lexical":
+                rankings = [self.lexical.search(query, k) for query in queries]
+            elif mode == "vector":
+                rankings = self._vector_ids(query_embeddings_np, k)
+            else:
+                fetch = max(k, self.hybrid_candidates)
+                rankings = [
+                    reciprocal_rank_fusion([vector_ids, self.lexical.search(query, fetch)])[:k]
+                    for query, vector_ids in zip(queries, self._vector_ids(query_embeddings_np, fetch))
+                ]
+            return [([self.documents[idx] for idx in ids], ids) for ids in rankings]
+
+    def search_by_vector(self, query_embedding_np: np.ndarray, k: int = 4) -> Tuple[List[Document], List[int]]:
+        """Return the documents nearest to an already embedded query, with their ids."""
+        return self.search("", query_embedding_np, k, mode="vector")
+
+    def _vector_ids(self, query_embeddings_np: np.ndarray, k: int) -> List[List[int]]:
+        """Rows nearest to each query embedding, skipping deleted ones; caller holds the lock."""
+        params = None
+        if self._deleted:
+            if self._search_params is None or self._search_params[0] is not self.index:
+                # Keep the selectors referenced; the parameters only hold raw pointers to them
+                batch = faiss.IDSelectorBatch(np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted)))
+                selector = faiss.IDSelectorNot(batch)
+                self._search_params = (self.index, search_parameters(self.index, selector), selector, batch)
+            params = self._search_params[1]
+
+        # Search the index for every query at once, skipping deleted rows
+        distances, indices = self.index.search(
+            query_embeddings_np, k=max(1, min(k, self.live_count())), params=params
+        )
+        return [[int(idx) for idx in row if idx >= 0] for row in indices]
+
+    def memory_usage(self) -> int:
+        """Estimated bytes held by the index and chunk texts."""
+        with self._lock:
+            index_bytes = estimate_index_bytes(self.index) if self.index is not None else 0
+            return index_bytes + self.documents.nbytes + self.lexical.nbytes
+
+    def load_snapshot(self) -> bool:
+        """Warm start from the snapshot directory by memory-mapping it."""
+        try:
+            loaded = load_snapshot(self.snapshot_dir)
+        except Exception as e:
+            logger.error(f"Could not load vector store snapshot: {str(e)}")
+            return False
+        if loaded is None:
+            return False
+
+        # Searching vectors from another model would return nonsense, so refuse to start instead
+        self._check_embeddings(loaded[2])
+        with self._lock:
+            self._adopt(loaded)
+        self._maybe_promote()
+        self._maybe_compact()
+        return True
+
+    def _check_embeddings(self, manifest: Dict[str, Any]) -> None:
+        """Raise EmbeddingMismatchError unless the snapshot was built by this store's embedding model."""
+        expected = self.embedder.provider.signature()
+        recorded = {key: manifest.get(key, _LEGACY_SIGNATURE.get(key)) for key in expected}
+        if recorded != expected:
+            raise EmbeddingMismatchError(
+                f"Snapshot in {self.snapshot_dir} was built with {_describe_signature(recorded)} "
+                f"but this store embeds with {_describe_signature(expected)}"
+            )
+
+    def _adopt(self, loaded, lexical: Optional[LexicalIndex] = None) -> None:
+        """Switch to a freshly loaded snapshot's index, documents and tombstones.
+
+        lexical, if given, is the BM25 index for the snapshot's rows.
+        """
+        index, documents, manifest = loaded
+        self.lexical = lexical or self._load_lexical(documents, manifest)
+        configure_search(index)
+        self.index = index
+        self.documents = documents
+        self._persisted = manifest["count"]
+        self._epoch = manifest.get("epoch", 0)
+        self._deleted = set(manifest.get("deleted", ()))
+        self._persisted_deleted = set(self._deleted)
+        self._search_params = None
+        self._catalog = None
+        self._manifest_mtime = self._read_manifest_mtime()
+        self.generation = uuid.uuid4().hex
+
+    def _load_lexical(self, documents, manifest) -> LexicalIndex:
+        """The snapshot's BM25 index, reconciled with its manifest.
+
+        Rows missing from the file (or all of them, for snapshots written
+        before it existed) are tokenized from the mapped chunk texts.
+        """
+        count = manifest["count"]
+        lexical = read_lexical(self.snapshot_dir, manifest.get("epoch", 0)) or LexicalIndex()
+        lexical.truncate(count)
+        if len(lexical) < count:
+            logger.info(f"Indexing {count - len(lexical)} chunks for BM25")
+            lexical.add(documents[row].page_content for row in range(len(lexical), count))
+        lexical.remove(manifest.get("deleted", ()))
+        return lexical
+
+    def _read_manifest_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(os.path.join(self.snapshot_dir, MANIFEST_FILE)).st_mtime_ns
+        except OSError:
+            return None
+
+    def refresh(self) -> None:
+        """Pick up chunks and deletions that another worker has written to the shared snapshot.
+
+        Costs a single stat() when nothing has changed. Stores with unsaved
+        changes of their own are left alone; save_snapshot merges those.
+        """
+        if not self.snapshot_dir:
+            return
+        mtime = self._read_manifest_mtime()
+        if mtime is None or mtime == self._manifest_mtime:
+            return
+
+        with self._lock:
+            if (
+                len(self.documents) > self._persisted
+                or self._deleted != self._persisted_deleted
+                or self._promotion is not None
+                or self._compaction is not None
+            ):
+                return
+            try:
+                manifest = read_manifest(self.snapshot_dir)
+                if manifest is None:
+                    return
+                current = (index_type_of(self.index), quantization_of(self.index)) if self.index is not None else None
+                if (
+                    manifest["count"] == self._persisted
+                    and manifest.get("epoch", 0) == self._epoch
+                    and (manifest.get("index_type", "flat"), manifest.get("quantization", "none")) == current
+                ):
+                    # Same rows; at most some of them were deleted
+                    self._tombstone(set(manifest.get("deleted", ())))
+                    self._persisted_deleted = set(self._deleted)
+                    self._manifest_mtime = mtime
+                    return
+                self._check_embeddings(manifest)
+                loaded = load_snapshot(self.snapshot_dir)
+                if loaded is not None:
+                    self._adopt(loaded)
+                    logger.info(f"Refreshed vector store from {self.snapshot_dir}: {self._persisted} chunks")
+            except Exception as e:
+                logger.error(f"Could not refresh vector store snapshot: {str(e)}")
+
+    @contextlib.contextmanager
+    def _synced(self):
+        """Hold the snapshot lock with this store caught up on what other workers wrote.
+
+        Caller holds self._lock.
+        """
+        if not self.snapshot_dir:
+            yield
+            return
+        with snapshot_lock(self.snapshot_dir):
+            self._sync_with_disk(read_manifest(self.snapshot_dir))
+            yield
+
+    def _sync_with_disk(self, manifest) -> None:
+        """Merge the snapshot on disk with changes of ours that are not saved yet.
+
+        If another worker has added chunks, or compacted the snapshot, it is
+        loaded and our pending chunks are appended after its rows (minus any
+        it already has); pending deletions are carried over either way.
+        """
+        if manifest:
+            self._check_embeddings(manifest)
+        on_disk = manifest["count"] if manifest else 0
+        epoch = manifest.get("epoch", 0) if manifest else 0
+        disk_deleted = set(manifest.get("deleted", ())) if manifest else set()
+        if on_disk == self._persisted and epoch == self._epoch:
+            self._tombstone(disk_deleted - self._deleted)
+            self._persisted_deleted |= disk_deleted
+            return
+
+        total = len(self.documents)
+        pending_rows = [row for row in range(self._persisted, total) if row not in self._deleted]
+        pending_docs = [self.documents[row] for row in pending_rows]
+        pending_vectors = (
+            self.index.reconstruct_batch(np.array(pending_rows, dtype=np.int64)) if pending_rows else None
+        )
+        unsynced = [row for row in self._deleted if row < self._persisted and row not in self._persisted_deleted]
+        # If the rows were renumbered under us, the deleted chunks are found again by id
+        renumbered = [self.documents[row] for row in unsynced] if epoch != self._epoch else []
+
+        loaded = load_snapshot(self.snapshot_dir)
+        if loaded is not None:
+            self._adopt(loaded)
+        else:
+            self.index, self.documents = faiss.IndexFlatL2(self.dimension), ChunkTable()
+            self._persisted, self._epoch = 0, 0
+            self._deleted, self._persisted_deleted = set(), set()
+            self._catalog, self._search_params = None, None
+            self.lexical = LexicalIndex()
+            unsynced, renumbered = [], []
+
+        if renumbered:
+            catalog = self._ensure_catalog()
+            unsynced = [
+                catalog[doc.metadata.get("source", "")][chunk_id(doc)]
+                for doc in renumbered
+                if chunk_id(doc) in catalog.get(doc.metadata.get("source", ""), ())
+            ]
+        self._tombstone(unsynced)
+
+        if pending_docs:
+            keep = self._unseen(pending_docs)
+            self._append([pending_docs[i] for i in keep], pending_vectors[keep])
+
+    def _write(self) -> None:
+        """Write rows and tombstones not yet on disk; caller holds both locks and has synced.
+
+        Chunks just written, and an index file just rewritten, are then
+        served from the mapped files rather than from private memory.
+        """
+        previous = self._persisted
+        with timed("snapshot"):
+            self._persisted = write_snapshot(
+                self.snapshot_dir,
+                self.index,
+                self.documents,
+                self._persisted,
+                extra={
+                    "index_type": index_type_of(self.index),
+                    "quantization": quantization_of(self.index),
+                    "deleted": sorted(self._deleted),
+                    **self.embedder.provider.signature(),
+                },
+                epoch=self._epoch,
+                lexical=self.lexical,
+                delta_ratio=self.index_delta_ratio,
+            )
+        self._persisted_deleted = set(self._deleted)
+        self._manifest_mtime = self._read_manifest_mtime()
+
+        manifest = read_manifest(self.snapshot_dir)
+        if not isinstance(self.index, LayeredIndex) or self.index.base.ntotal != manifest["index_count"]:
+            self.index = map_index(self.snapshot_dir)
+            configure_search(self.index)
+            self._search_params = None
+            self.generation = uuid.uuid4().hex
+        if self._persisted > previous:
+            self.documents = MappedDocuments(self.snapshot_dir, self._persisted, self._epoch)
+
+    def save_snapshot(self) -> None:
+        """Persist chunks added and deleted since the last snapshot.
+
+        If another worker has written to the same directory in the meantime,
+        its chunks are loaded first and ours are appended after them, so
+        every worker converges on the same corpus.
+        """
+        if not self.snapshot_dir:
+            return
+
+        try:
+            with self._lock, self._synced():
+                if len(self.documents) == self._persisted and self._deleted == self._persisted_deleted:
+                    return
+                self._write()
+        except Exception as e:
+            logger.error(f"Error writing vector store snapshot: {str(e)}")
+
+    def _schedule_snapshot(self) -> None:
+        def run():
+            self.save_snapshot()
+            self._schedule_snapshot()
+
+        with self._lock:
+            if self._closed:
+                return
+            self._timer = threading.Timer(self.snapshot_interval, run)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def close(self) -> None:
+        """Stop the snapshot timer of a store that is being unloaded.
+
+        save_snapshot still works afterwards, so the caller can write what
+        is pending once the store is closed.
+        """
+        with self._lock:
+            self._closed = True
+            if self._timer is not None:
+                self._timer.cancel()
+
+    def _promotes(self) -> bool:
+        """Whether the store outgrows its initial float32 flat index."""
+        return self.index_type != "flat" or self.quantization != "none"
+
+    def _maybe_promote(self) -> None:
+        """Start a background rebuild once a flat index crosses the threshold."""
+        with self._lock:
+            if (
+                not self._promotes()
+                or self.index is None
+                or self._promotion is not None
+                or self._compaction is not None
+                or self.index.ntotal < self.promotion_threshold
+                or index_type_of(self.index) != "flat"
+                or quantization_of(self.index) != "none"
+            ):
+                return
+            self._promotion = threading.Thread(target=self._promote, name="index-promotion", daemon=True)
+            self._promotion.start()
+
+    def _promote(self) -> None:
+        """Rebuild the flat index as self.index_type without blocking queries."""
+        try:
+            with self._lock:
+                count = self.index.ntotal
+                epoch = self._epoch
+                vectors = self.index.reconstruct_n(0, count)
+            logger.info(f"Promoting flat index with {count} vectors to {self.index_type} ({self.quantization})")
+
+            # Training and adding run outside the lock; searches keep using the flat index
+            promoted = build_index(self.index_type, self.dimension, vectors, self.quantization)
+
+            with self._lock:
+                if self._epoch != epoch or self.index.ntotal < count:
+                    logger.info("Rows were renumbered during promotion; keeping the current index")
+                    return
+                # Catch up with vectors added while the new index was being built
+                if self.index.ntotal > count:
+                    promoted.add(self.index.reconstruct_n(count, self.index.ntotal - count))
+                self.index = promoted
+                self._search_params = None
+                self.generation = uuid.uuid4().hex
+            logger.info(f"Vector store now searches a {self.index_type} ({self.quantization}) index")
+        except Exception as e:
+            logger.error(f"Error promoting vector index: {str(e)}")
+            return
+        finally:
+            with self._lock:
+                self._promotion = None
+
+        if self.snapshot_dir and self.snapshot_mode == "incremental":
+            self._force_index_write()
+        self._maybe_compact()
+
+    def _force_index_write(self) -> None:
+        """Rewrite the snapshot index after a promotion even if no chunks are new."""
+        try:
+            with self._lock, self._synced():
+                self._write()
+        except Exception as e:
+            logger.error(f"Error writing promoted index snapshot: {str(e)}")
+
+    def _maybe_compact(self) -> None:
+        """Start a background compaction once enough rows are deleted."""
+        with self._lock:
+            if (
+                self.compact_ratio <= 0
+                or self.index is None
+                or self._compaction is not None
+                or self._promotion is not None
+                or len(self._deleted) < self.compact_ratio * max(1, len(self.documents))
+            ):
+                return
+            self._compaction = threading.Thread(target=self._compact, name="index-compaction", daemon=True)
+            self._compaction.start()
+
+    def _compact(self) -> None:
+        """Copy the live rows into a fresh index and document table without blocking queries.
+
+        With a snapshot directory the result is written as a new epoch, so
+        other workers reload it the next time they refresh.
+        """
+        try:
+            # Make sure the snapshot holds everything before rows are renumbered
+            self.save_snapshot()
+            with self._lock:
+                index, documents, epoch = self.index, self.documents, self._epoch
+                total, deleted = len(documents), set(self._deleted)
+                if self.snapshot_dir and (self._persisted != total or self._persisted_deleted != deleted):
+                    return
+                live = np.array([row for row in range(total) if row not in deleted], dtype=np.int64)
+                vectors = index.reconstruct_batch(live) if len(live) else None
+                compacted = empty_copy(index)
+                lexical = self.lexical.compact(live)
+            logger.info(f"Compacting vector store: keeping {len(live)} of {total} rows")
+
+            # Adding to the new index and copying documents run outside the lock
+            if vectors is not None:
+                compacted.add(vectors)
+            kept = ChunkTable(documents[int(row)] for row in live)
+
+            with self._lock, (snapshot_lock(self.snapshot_dir) if self.snapshot_dir else contextlib.nullcontext()):
+                manifest = read_manifest(self.snapshot_dir) if self.snapshot_dir else None
+                if (
+                    self.index is not index
+                    or self._epoch != epoch
+                    or len(self.documents) != total
+                    or self._deleted != deleted
+                    or (manifest is not None and (manifest["count"] != total or manifest.get("epoch", 0) != epoch))
+                ):
+                    logger.info("Vector store changed during compaction; will compact again later")
+                    return
+                if self.snapshot_dir:
+                    write_snapshot(
+                        self.snapshot_dir,
+                        compacted,
+                        kept,
+                        0,
+                        extra={
+                            "index_type": index_type_of(compacted),
+                            "quantization": quantization_of(compacted),
+                            "deleted": [],
+                            **self.embedder.provider.signature(),
+                        },
+                        epoch=epoch + 1,
+                        lexical=lexical,
+                    )
+                    loaded = load_snapshot(self.snapshot_dir)
+                    self._adopt(loaded, lexical=lexical)
+                else:
+                    self.index, self.documents, self.lexical = compacted, kept, lexical
+                    self._epoch = epoch + 1
+                    self._deleted = set()
+                    self._catalog, self._search_params = None, None
+                    self.generation = uuid.uuid4().hex
+            logger.info(f"Compacted vector store to {len(kept)} rows")
+        except Exception as e:
+            logger.error(f"Error compacting vector store: {str(e)}")
+        finally:
+            with self._lock:
+                self._compaction = None
+        self._maybe_promote()
+
+    def index_report(self, k: int = 10, num_queries: int = 100) -> dict:
+        """Report recall@k and query latency of the current index against exact search.
+
+        Queries are stored vectors with a little Gaussian noise added, so the
+        report reflects the actual corpus rather than synthetic data. Stored
+        vectors of a quantized index are already decoded approximations, so
+        the loss from quantization itself is not part of this recall;
+        compare_index_types measures it against the original embeddings.
+        """
+        with self._lock:
+            if self.index is None or self.index.ntotal == 0:
+                return {}
+            index = self.index
+            vectors = index.reconstruct_n(0, index.ntotal)
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)]
+        queries = (sample + rng.normal(0, 0.01, sample.shape)).astype(np.float32)
+        return evaluate_index(index, vectors, queries, k=min(k, len(vectors)))
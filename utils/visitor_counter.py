@@ -0,0 +1,114 @@
+import os
+import time
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Seconds between writes of buffered visits to the database
+VISITOR_COUNT_FLUSH_INTERVAL = float(os.environ.get("VISITOR_COUNT_FLUSH_INTERVAL", "5"))
+
+# Seconds /visitor-count may serve a cached total before reading the database again
+VISITOR_COUNT_CACHE_TTL = float(os.environ.get("VISITOR_COUNT_CACHE_TTL", "10"))
+
+
+class VisitorCounter:
+    """Count page visits in memory and add them to the database in batches.
+
+    Visits only touch a local counter, so the landing page never waits on
+    the database. A background thread adds the buffered delta with an
+    atomic UPDATE every flush_interval seconds and once more at exit.
+    """
+
+    def __init__(
+        self,
+        app=None,
+        flush_interval: float = VISITOR_COUNT_FLUSH_INTERVAL,
+        cache_ttl: float = VISITOR_COUNT_CACHE_TTL,
+    ):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = 0
+        self._total = None
+        self._read_at = 0.0
+        self._thread = None
+
+    def init_app(self, app) -> None:
+        """Use app's database, for counters created before the app."""
+        self.app = app
+
+    def start(self) -> None:
+        """Start the flush thread and register the final flush."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._flush_forever, name="visitor-counter", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def increment(self) -> int:
+        """Record a visit and return the best known total, without touching the database.
+
+        The stored total is read by the flush thread; until that succeeds it
+        is counted as 0.
+        """
+        with self._lock:
+            self._pending += 1
+            return (self._total or 0) + self._pending
+
+    def count(self) -> int:
+        """Total visits, read from the database at most once per cache_ttl."""
+        if time.time() - self._read_at > self.cache_ttl:
+            self._read_total()
+        with self._lock:
+            # Until a read succeeds the stored total is unknown and counted as 0
+            return (self._total or 0) + self._pending
+
+    def flush(self) -> None:
+        """Add buffered visits to the database."""
+        from models import VisitorCount
+
+        with self._flush_lock:
+            with self._lock:
+                delta, self._pending = self._pending, 0
+            if not delta:
+                return
+            try:
+                with self.app.app_context():
+                    total = VisitorCount.add(delta)
+            except Exception as e:
+                logger.error(f"Error flushing {delta} visits: {str(e)}")
+                with self._lock:
+                    self._pending += delta
+                return
+            with self._lock:
+                self._total = total
+                self._read_at = time.time()
+
+    def _read_total(self) -> int:
+        from models import VisitorCount
+
+        try:
+            with self.app.app_context():
+                total = VisitorCount.get_count()
+        except Exception as e:
+            logger.error(f"Error reading visitor count: {str(e)}")
+            # A failed read is retried no sooner than a successful one would be
+            self._read_at = time.time()
+            return self._total or 0
+        with self._lock:
+            self._total = total
+            self._read_at = time.time()
+        return total
+
+    def _flush_forever(self) -> None:
+        # Seed the total served by increment() here rather than on a visit
+        self._read_total()
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+            if self._total is None:
+                self._read_total()
@@ -1,5 +1,4 @@
 import logging
-import trafilatura
 from typing import Optional
 
 logger = logging.getLogger(__name__)
@@ -16,6 +15,8 @@ def get_website_text_content(url: str) -> Optional[str]:
     """
     try:
         logger.info(f"Fetching content from URL: {url}")
+        import trafilatura
+
         # Download the web page
         downloaded = trafilatura.fetch_url(url)
         